@@ -1,5 +1,5 @@
 from flask import Blueprint, jsonify, request
-from app.services.categories import rename_category,delete_category
+from app.services.categories import rename_category,delete_category,merge_category
 
 categories_dp = Blueprint("categories_bp",__name__)
 
@@ -26,4 +26,17 @@ def delete_category_route(id):
     token = auth_header.split(' ')[1]
     
     resp,code = delete_category(token,id)
-    return jsonify(resp),code
\ No newline at end of file
+    return jsonify(resp),code
+
+
+@categories_dp.route("/v1/categories/<id>/merge",methods=['POST'])
+def merge_category_route(id):
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer'):
+        return {"error":"Forbidden"},403
+
+    token = auth_header.split(' ')[1]
+    body = request.get_json(silent=True) or {}
+
+    resp,code = merge_category(token,id,body)
+    return jsonify(resp),code
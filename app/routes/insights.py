@@ -1,6 +1,11 @@
 from flask import request, jsonify, Blueprint
 from app.utils.llm_advice import llm_advice
-from app.services.insights import handle_chat
+import os
+import json
+from app.services.insights import handle_chat, INSIGHT_TYPES
+from app.utils.single_flight import coalesce, request_key
+from app.utils.ledger import ledger_path
+from app.utils.llm import llm_admission, LLMBusy, CHAT_COST, ADVICE_COST
 
 insights_bp = Blueprint('insights_bp',__name__)
 
@@ -8,7 +13,19 @@ insights_bp = Blueprint('insights_bp',__name__)
 @insights_bp.route('/v1/instances/<id>/advice',methods=['POST'])
 def get_advice(id):
     body = request.get_json()
-    suggestion = llm_advice(id,body['focus'])
+    # Identical concurrent requests share one model call (and one admission)
+    def advise():
+        with llm_admission(id, ADVICE_COST):
+            return llm_advice(id,body['focus'])
+
+    try:
+        suggestion = coalesce(
+            "advice",
+            request_key(id, None, json.dumps(body['focus'], sort_keys=True)),
+            advise
+        )
+    except LLMBusy as e:
+        return jsonify({"error": str(e)}), 429, {"Retry-After": str(e.retry_after)}
     return jsonify(suggestion),200
 
 
@@ -20,6 +37,22 @@ def chat_with_bot(id):
         return jsonify({"error": "Missing 'message' in request body"}), 400
 
     message = data["message"]
-    resp = handle_chat(id,message)
+    try:
+        with llm_admission(id, CHAT_COST):
+            resp, code = handle_chat(id,message)
+    except LLMBusy as e:
+        return jsonify({"error": str(e)}), 429, {"Retry-After": str(e.retry_after)}
 
-    return jsonify(resp),200
+    return jsonify(resp),code
+
+
+@insights_bp.route('/v1/instances/<id>/insights',methods=['GET'])
+def get_insights(id):
+    insight_type = request.args.get("insight_type", "anomalies")
+    if insight_type not in INSIGHT_TYPES:
+        return jsonify({"error": f"Invalid insight_type, expected one of {list(INSIGHT_TYPES)}"}), 400
+    if not os.path.isfile(ledger_path(id)):
+        return jsonify({"error": "Instance data not found"}), 404
+
+    resp, code = INSIGHT_TYPES[insight_type](id, request.args)
+    return jsonify(resp), code
@@ -0,0 +1,144 @@
+import json
+from functools import wraps
+from starlette.requests import Request
+from starlette.responses import Response, PlainTextResponse
+from starlette.routing import Route
+from starlette.exceptions import HTTPException
+from starlette.datastructures import UploadFile
+from app.services.reciepts import upload_and_parse_reciept_async
+from app.services.insights import handle_chat_async
+from app.utils.llm_advice import llm_advice_async
+from app.utils.image_store import ImageTooLarge, MAX_UPLOAD_BYTES
+from app.utils.idempotency import idempotent_async
+from app.utils.llm import async_llm_admission, LLMBusy, RECEIPT_COST, CHAT_COST, ADVICE_COST
+from app.utils.single_flight import coalesce_async, request_key
+from app.utils.json_provider import encode_json
+
+# Async versions of the model-bound endpoints, served by asgi.py in front of
+# the Flask app. They share the blueprints' service code: the model call is
+# awaited on the async OpenAI client and the file and ledger work runs in
+# worker threads, so one worker keeps hundreds of calls in flight instead of
+# a thread per call.
+
+
+class JSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return encode_json(content)
+
+
+def _busy(e):
+    return JSONResponse({"error": str(e)}, 429, {"Retry-After": str(e.retry_after)})
+
+
+def _capped(receive, limit):
+    # Counts the body as it arrives, for clients that stream it chunked
+    received = 0
+
+    async def capped():
+        nonlocal received
+        message = await receive()
+        received += len(message.get("body", b""))
+        if received > limit:
+            raise HTTPException(413, f"Request body is larger than {limit} bytes")
+        return message
+
+    return capped
+
+
+def _body_limit(limit):
+    """
+    Refuse bodies over limit bytes: at once by Content-Length, else as they
+    are read. Applied outside idempotent_async, which reads the body.
+    """
+    def decorate(handler):
+        @wraps(handler)
+        async def wrapper(request):
+            if int(request.headers.get("content-length") or 0) > limit:
+                return JSONResponse({"error": f"Request body is larger than {limit} bytes"}, 413)
+            return await handler(Request(request.scope, _capped(request.receive, limit)))
+
+        return wrapper
+
+    return decorate
+
+
+async def _json_body(request):
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+@_body_limit(MAX_UPLOAD_BYTES)
+@idempotent_async
+async def upload_and_parse_reciept_route(request):
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer'):
+        return JSONResponse({"error": "invalid token"}, 404)
+    token = auth_header.split(' ')[1]
+
+    async with request.form() as form:
+        file = form.get("reciept")
+        instance_id = form.get("instance_id")
+        if not isinstance(file, UploadFile):
+            return PlainTextResponse("No file uploaded", 400)
+        if not instance_id:
+            return PlainTextResponse("No instance ID provided", 400)
+
+        try:
+            # Admitted before the image is stored, so a refused upload leaves nothing behind
+            async with async_llm_admission(instance_id, RECEIPT_COST):
+                resp = await upload_and_parse_reciept_async(token, instance_id, file)
+        except LLMBusy as e:
+            return _busy(e)
+        except ImageTooLarge as e:
+            return JSONResponse({"error": str(e)}, 413)
+        except ValueError as e:
+            return JSONResponse({"error": str(e)}, 400)
+
+    return JSONResponse(resp, 200)
+
+
+async def get_advice(request):
+    id = request.path_params["id"]
+    body = await _json_body(request)
+    if not isinstance(body, dict) or "focus" not in body:
+        return JSONResponse({"error": "Missing 'focus' in request body"}, 400)
+
+    # Identical concurrent requests share one model call (and one admission)
+    async def advise():
+        async with async_llm_admission(id, ADVICE_COST):
+            return await llm_advice_async(id, body['focus'])
+
+    try:
+        suggestion = await coalesce_async(
+            "advice",
+            request_key(id, None, json.dumps(body['focus'], sort_keys=True)),
+            advise
+        )
+    except LLMBusy as e:
+        return _busy(e)
+    return JSONResponse(suggestion, 200)
+
+
+async def chat_with_bot(request):
+    id = request.path_params["id"]
+    data = await _json_body(request)
+    if not data or "message" not in data:
+        return JSONResponse({"error": "Missing 'message' in request body"}, 400)
+
+    try:
+        async with async_llm_admission(id, CHAT_COST):
+            resp, code = await handle_chat_async(id, data["message"])
+    except LLMBusy as e:
+        return _busy(e)
+    return JSONResponse(resp, code)
+
+
+routes = [
+    Route('/v1/reciepts', upload_and_parse_reciept_route, methods=['POST']),
+    Route('/v1/instances/{id}/advice', get_advice, methods=['POST']),
+    Route('/v1/instances/{id}/chat', chat_with_bot, methods=['POST']),
+]
@@ -1,14 +1,26 @@
-from flask import request, jsonify, Blueprint,render_template
-from app.services.reciepts import upload_and_parse_reciept, get_parsed_reciept,correct_parse_reciept
+import os
+from flask import request, jsonify, Blueprint,render_template,send_file
+from app.services.reciepts import upload_and_parse_reciept, get_parsed_reciept,correct_parse_reciept,correct_receipts
+from app.services.images import receipt_image, receipt_thumbnail, THUMB_SIZE
+from app.utils.image_store import ImageTooLarge
+from app.utils.uploads import image_upload
+from app.utils.idempotency import idempotent
+from app.utils.llm import llm_admission, LLMBusy, RECEIPT_COST
 from app.utils.save_reciept_image import save_receipt_image
 from app.utils.reciept_parser import reciept_parser
 
 
 reciepts_bp = Blueprint('reciepts_bp',__name__)
 
+IMAGE_MAX_AGE = 86400
+
 @reciepts_bp.route('/v1/reciepts',methods=['GET','POST'])
+@image_upload
+@idempotent
 def upload_and_parse_reciept_route():
     if request.method == "POST":
+        # The body is capped and the image spooled into the store while it
+        # is parsed (see UploadRequest)
         file = request.files.get("reciept")
         instance_id = request.form.get("instance_id")
         auth_header = request.headers.get('Authorization')
@@ -22,7 +34,16 @@ def upload_and_parse_reciept_route():
         if not instance_id:
             return "No instance ID provided", 400
 
-        resp = upload_and_parse_reciept(token,instance_id,file)
+        try:
+            # Admitted before the image is stored, so a refused upload leaves nothing behind
+            with llm_admission(instance_id, RECEIPT_COST):
+                resp = upload_and_parse_reciept(token,instance_id,file)
+        except LLMBusy as e:
+            return jsonify({"error": str(e)}), 429, {"Retry-After": str(e.retry_after)}
+        except ImageTooLarge as e:
+            return jsonify({"error": str(e)}), 413
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         
         return jsonify(resp),200
     
@@ -38,6 +59,7 @@ def get_parsed_reciept_route(id):
 
 
 @reciepts_bp.route('/v1/reciepts/<id>',methods=['PATCH'])
+@idempotent
 def correct_parsed_reciept_route(id):
     # auth_header = request.headers.get('Authorization')
     # if not auth_header or not auth_header.startswith('Bearer '):
@@ -50,4 +72,47 @@ def correct_parsed_reciept_route(id):
     resp,code = correct_parse_reciept(token,id,fixes)
 
 
-    return jsonify(resp),code
\ No newline at end of file
+    return jsonify(resp),code
+
+@reciepts_bp.route('/v1/reciepts',methods=['PATCH'])
+@idempotent
+def correct_parsed_reciepts_route():
+    """
+    Correct many receipts in one request.
+
+    Body: {"instance_id": ..., "corrections": [{"receipt_id": ..., "fixes": [...]}]}
+    """
+    body = request.get_json(silent=True) or {}
+    instance_id = body.get("instance_id")
+    corrections = body.get("corrections")
+    if not instance_id:
+        return jsonify({"error": "instance_id missing"}), 400
+    if not isinstance(corrections, list) or not all(isinstance(c, dict) for c in corrections):
+        return jsonify({"error": "corrections must be a list of objects"}), 400
+
+    try:
+        resp, code = correct_receipts(instance_id, corrections)
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": f"Invalid correction: {str(e)}"}), 400
+
+    return jsonify(resp), code
+
+
+@reciepts_bp.route('/v1/reciepts/<id>/image',methods=['GET'])
+def get_reciept_image_route(id):
+    path = receipt_image(id)
+    if path is None:
+        return jsonify({"error": "No image for this receipt"}), 404
+    # Content-addressed, so the bytes behind a receipt never change
+    return send_file(os.path.abspath(path), conditional=True, max_age=IMAGE_MAX_AGE)
+
+
+@reciepts_bp.route('/v1/reciepts/<id>/thumbnail',methods=['GET'])
+def get_reciept_thumbnail_route(id):
+    try:
+        path = receipt_thumbnail(id, request.args.get("size", THUMB_SIZE, type=int))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if path is None:
+        return jsonify({"error": "No image for this receipt"}), 404
+    return send_file(os.path.abspath(path), mimetype="image/jpeg", conditional=True, max_age=IMAGE_MAX_AGE)
@@ -1,67 +1,156 @@
-from flask import Blueprint, request,jsonify,send_file,abort
+from flask import Blueprint, request,jsonify,abort,Response,send_file
 import os
-from app.services.graphs import get_bar_chart_data ,get_line_chart_data,get_pie_chart_data
-import matplotlib
-matplotlib.use('Agg')  # Use non-GUI backend for server environments
-import matplotlib.pyplot as plt
+import hashlib
+from datetime import date
+from app.utils.lazy import lazy_import
 from app.services.reports import instance_report
+from app.services.charts import CHART_TYPES, IMAGE_FORMATS, get_chart_image
+from app.services.export import export_ledger, available_formats, EXPORT_FORMATS
+from app.utils.compression import compressed
+from app.utils.http_cache import not_modified
+from app.utils.single_flight import coalesce, request_key
+from app.utils.ledger import ledger_path, ledger_version, ledger_modified
+
+pd = lazy_import("pandas")
 
 
 report_bp = Blueprint('report_bp',__name__)
 
+MAX_CHART_POINTS = 2000
+
 @report_bp.route("/v1/instances/<id>/reports", methods=["GET"])
+@compressed
 def get_instance_reports(id):
     period = request.args.get("period", "monthly")
     start = request.args.get("start")
     end = request.args.get("end")
 
-    report_data = instance_report(id, period, start, end)
+    try:
+        as_of = pd.to_datetime(request.args["as_of"]).date() if request.args.get("as_of") else None
+    except ValueError:
+        return {"error": "Invalid 'as_of' date"}, 400
+
+    # Windows are anchored on today, so the day is part of the key
+    report_data = coalesce(
+        "reports",
+        request_key(id, request.args, date.today().isoformat()),
+        lambda: instance_report(id, period, start, end, as_json=True, as_of=as_of)
+    )
     return jsonify(report_data),200
    
 
 
-CHARTS_PATH = "storage/charts"
-
-def save_chart(fig, filename):
-    os.makedirs(CHARTS_PATH, exist_ok=True)
-    full_path = os.path.join(CHARTS_PATH, filename)
-    fig.savefig(full_path, bbox_inches='tight')
-    plt.close(fig)
-    return f"/{CHARTS_PATH}/{filename}"  # relative URL
-
-
 @report_bp.route('/v1/instances/<instance_id>/graphs',methods=['GET'])
+@compressed
 def get_graph_data(instance_id):
-    chart_type = 'pie'
-    if chart_type == "pie":
-        return get_pie_chart_data(instance_id)
-    elif chart_type == "bar":
-        return get_bar_chart_data(instance_id)
-    elif chart_type == "line":
-        return get_line_chart_data(instance_id)
-    else:
+    """
+    Chart data as JSON (format=json, default) or a rendered png/svg image.
+
+    Query params: chart_type (pie, bar, line), format, width, height (inches).
+    Line charts also take points (target point count) and resolution
+    (day, week, month or auto).
+    """
+    chart_type = request.args.get("chart_type", "pie")
+    fmt = request.args.get("format", "json").lower()
+
+    if chart_type not in CHART_TYPES:
         return {"error": "Invalid chart type"}, 400
-    
+    if not os.path.isfile(ledger_path(instance_id)):
+        return {"error": "Instance data not found"}, 404
+
+    options = {}
+    if chart_type == "line":
+        try:
+            if request.args.get("points"):
+                options["points"] = min(max(int(request.args["points"]), 3), MAX_CHART_POINTS)
+            options["resolution"] = request.args.get("resolution", "auto" if "points" in options else "day")
+            if options["resolution"] not in ("auto", "day", "week", "month"):
+                raise ValueError
+        except ValueError:
+            return {"error": "Invalid 'points' or 'resolution'"}, 400
+
+    key = request_key(instance_id, request.args)
+    if fmt == "json":
+        return coalesce("graphs", key, lambda: CHART_TYPES[chart_type](instance_id, **options))
+    if fmt not in IMAGE_FORMATS:
+        return {"error": f"Invalid format, expected json or one of {list(IMAGE_FORMATS)}"}, 400
+
+    try:
+        width = min(max(float(request.args.get("width", 8)), 1), 20)
+        height = min(max(float(request.args.get("height", 6)), 1), 20)
+    except ValueError:
+        return {"error": "Invalid 'width' or 'height'"}, 400
+
+    path, key = coalesce(
+        "graphs", key, lambda: get_chart_image(instance_id, chart_type, fmt, width, height, options)
+    )
+
+    cached = not_modified(key)
+    if cached is not None:
+        return cached
+
+    return send_file(
+        os.path.abspath(path),
+        mimetype=IMAGE_FORMATS[fmt],
+        etag=key,
+        conditional=False
+    )
+
 
 @report_bp.route('/v1/instances/<instance_id>/export', methods=['GET'])
+@compressed
 def export_csv(instance_id):
     """
-    Streams a raw CSV file for the given instance ID.
-    Expects the CSV to be located at 'storage/instances/{instance_id}.csv'.
+    Streams the ledger of the given instance ID.
+
+    Query params:
+        format: csv (default), ndjson or parquet
+        start, end: inclusive YYYY-MM-DD date range
+        category_id: repeatable or comma separated category ids
+
+    Responds 304 when the client already holds this export of the current
+    ledger version.
     """
 
-    csv_path = f'storage/instances/{instance_id}.csv'
+    csv_path = ledger_path(instance_id)
 
     # Check if file exists
     if not os.path.isfile(csv_path):
         abort(404, description="CSV file not found.")
 
+    fmt = request.args.get("format", "csv").lower()
+    if fmt not in available_formats():
+        return {"error": f"Unsupported format, expected one of {available_formats()}"}, 400
+
     try:
-        return send_file(
-            csv_path,
-            mimetype='text/csv',
-            as_attachment=True,
-            download_name=f'{instance_id}.csv'
-        )
-    except Exception as e:
-        abort(500, description=f"An error occurred while streaming the file: {str(e)}")
+        start = pd.to_datetime(request.args["start"]) if request.args.get("start") else None
+        end = pd.to_datetime(request.args["end"]) if request.args.get("end") else None
+        category_ids = sorted({
+            int(cid)
+            for value in request.args.getlist("category_id")
+            for cid in value.split(",") if cid.strip()
+        })
+    except ValueError:
+        return {"error": "Invalid 'start', 'end' or 'category_id'"}, 400
+
+    # The tag covers both the ledger version and the export parameters
+    params = f"{fmt}|{start}|{end}|{category_ids}"
+    etag = f"{ledger_version(instance_id)}-{hashlib.sha1(params.encode()).hexdigest()[:12]}"
+    last_modified = ledger_modified(instance_id)
+
+    cached = not_modified(etag, last_modified)
+    if cached is not None:
+        return cached
+
+    mimetype, ext = EXPORT_FORMATS[fmt]
+    response = Response(
+        export_ledger(instance_id, fmt, start, end, category_ids),
+        mimetype=mimetype
+    )
+    response.headers["Content-Disposition"] = f"attachment; filename={instance_id}.{ext}"
+    response.set_etag(etag)
+    response.last_modified = last_modified
+
+    # Always revalidate, an unchanged ledger then costs a 304
+    response.cache_control.no_cache = True
+    return response
@@ -1,29 +1,85 @@
+import io
+import os
+from datetime import date
 from flask import request, jsonify,Blueprint
 from app.services.transactions import list_transactions,create_or_update_budget,get_budget_utilisation
+from app.services.imports import import_transactions, detect_format
+from app.utils.compression import compressed
+from app.utils.single_flight import coalesce, request_key
+from app.utils.idempotency import idempotent
 
 transaction_bp = Blueprint('transaction_bp',__name__)
 
 @transaction_bp.route('/v1/instances/<id>/transactions',methods=['GET'])
+@compressed
 def list_transactions_route(id):
-    transaction = list_transactions(id)
-    return jsonify(transaction),200
+    transaction,code = list_transactions(id, request.args)
+    return jsonify(transaction),code
 
 
 @transaction_bp.route('/v1/instances/<instance_id>/budgets', methods=['POST'])
+@idempotent
 def create_or_update_budget_route(instance_id):
     data = request.get_json()
     category_id = data.get("category_id")
     limit = data.get("limit")
+    period = data.get("period", "all")
 
     if category_id is None or limit is None:
         return {"error": "Missing 'category_id' or 'limit'"}, 400
 
-    create_or_update_budget(instance_id, category_id, limit)
+    try:
+        create_or_update_budget(instance_id, category_id, limit, period)
+    except ValueError as e:
+        return {"error": str(e)}, 400
 
     return {"message": "Budget upserted successfully"}, 200
 
 
 @transaction_bp.route('/v1/instances/<instance_id>/budgets', methods=['GET'])
 def get_utilised_budget_route(instance_id):
-    resp = get_budget_utilisation(instance_id)
-    return jsonify({'Details':resp}),200
\ No newline at end of file
+    # Utilisation also depends on the budgets file and the current period
+    budgets_path = "storage/budgets.csv"
+    budgets_mtime = os.stat(budgets_path).st_mtime_ns if os.path.exists(budgets_path) else None
+    resp = coalesce(
+        "budgets",
+        request_key(instance_id, None, budgets_mtime, date.today().isoformat()),
+        lambda: get_budget_utilisation(instance_id)
+    )
+    return jsonify({'Details':resp}),200
+
+
+@transaction_bp.route('/v1/instances/<instance_id>/imports', methods=['POST'])
+@idempotent
+def import_transactions_route(instance_id):
+    """
+    Bulk import a bank or card export.
+
+    Multipart form: file (CSV, OFX/QFX or QIF), optional format (default: from
+    the file name), spend_sign ("negative" default, or "positive") and
+    date_format (CSV only).
+    """
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return jsonify({"error": "Unauthorized"}), 401
+    token = auth_header.split(" ")[1]
+
+    file = request.files.get("file")
+    if not file:
+        return {"error": "No file uploaded"}, 400
+    fmt = request.form.get("format") or detect_format(file.filename)
+    if fmt is None:
+        return {"error": "Cannot tell the file format, pass 'format'"}, 400
+
+    # Parse straight from the upload stream, one chunk at a time
+    stream = io.TextIOWrapper(file.stream, encoding="utf-8-sig", errors="replace", newline="")
+    try:
+        resp, code = import_transactions(
+            token, instance_id, stream, fmt.lower(),
+            spend_sign=request.form.get("spend_sign", "negative"),
+            date_format=request.form.get("date_format")
+        )
+    except ValueError as e:
+        return {"error": str(e)}, 400
+
+    return jsonify(resp), code
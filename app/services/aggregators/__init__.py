@@ -14,8 +14,17 @@ from .category import (
 
 from .items import top_items
 
+from .vendor import vendor_totals, vendor_frequency, average_basket
+
+from .comparison import period_comparison
+
+from .timeseries import lttb
+
+from .anomalies import detect_anomalies
+
 __all__ = [
     "total_spend", "daily_spend", "weekly_spend", "monthly_spend",
     "receipt_summary", "category_totals", "category_monthly", "category_overages",
-    "detect_anomalies", "top_items", "generate_insight_input", "format_export_csv"
+    "detect_anomalies", "top_items", "generate_insight_input", "format_export_csv",
+    "lttb", "vendor_totals", "vendor_frequency", "average_basket", "period_comparison"
 ]
@@ -0,0 +1,143 @@
+from __future__ import annotations
+from app.utils.lazy import lazy_import
+
+pd = lazy_import("pandas")
+np = lazy_import("numpy")
+
+# EWMA baseline per category: a value is anomalous when it lies more than
+# Z_THRESHOLD standard deviations above the mean of what came before it,
+# once MIN_OBSERVATIONS values have been seen.
+EWMA_ALPHA = 0.1
+Z_THRESHOLD = 3.0
+MIN_OBSERVATIONS = 5
+MIN_STD = 0.01
+
+
+def zscore(value, mean, var):
+    return (value - mean) / max(var ** 0.5, MIN_STD)
+
+
+def _prepare(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.assign(
+        amount=pd.to_numeric(df["amount"], errors="coerce").fillna(0),
+        date=pd.to_datetime(df["date"], errors="coerce"),
+        category=df["category_id"].astype("Int64").astype("string").fillna("none")
+    )
+    # Replay in date order, ledger order within a day
+    return df.sort_values("date", kind="stable", na_position="first").reset_index(drop=True)
+
+
+def _baseline(df: pd.DataFrame, value: str, alpha: float) -> pd.DataFrame:
+    """
+    EWMA mean/variance per category after each row, and the baseline each
+    row was compared against (the stats just before it).
+    """
+    grouped = df.groupby("category", sort=False)[value]
+    df = df.assign(
+        mean=grouped.transform(lambda s: s.ewm(alpha=alpha, adjust=False).mean()),
+        var=grouped.transform(lambda s: s.ewm(alpha=alpha, adjust=False).var(bias=True)),
+        n=grouped.cumcount() + 1
+    )
+    shifted = df.groupby("category", sort=False)[["mean", "var"]].shift(1)
+    return df.assign(prev_mean=shifted["mean"], prev_var=shifted["var"], prev_n=df["n"] - 1)
+
+
+def _flag(df: pd.DataFrame, value: str, threshold: float, min_obs: int) -> pd.DataFrame:
+    std = np.maximum(np.sqrt(df["prev_var"]), MIN_STD)
+    z = (df[value] - df["prev_mean"]) / std
+    return df.assign(z=z)[(df["prev_n"] >= min_obs) & (z > threshold)]
+
+
+def _daily(items: pd.DataFrame) -> pd.DataFrame:
+    return (
+        items.dropna(subset=["date"])
+        .groupby(["category", "date"], sort=False)["amount"]
+        .sum()
+        .reset_index()
+        .sort_values("date", kind="stable")
+        .reset_index(drop=True)
+    )
+
+
+def detect_anomalies(df: pd.DataFrame, alpha: float = EWMA_ALPHA, threshold: float = Z_THRESHOLD,
+                     min_obs: int = MIN_OBSERVATIONS) -> list[dict]:
+    """
+    Flag item amounts and daily category totals far above their category's
+    EWMA baseline.
+
+    Parameters:
+        df (pd.DataFrame): Ledger rows with date, text, amount, category_id, receipt_id.
+
+    Returns:
+        list[dict]: Anomalies in date order, with the expected value and z-score.
+    """
+    if df.empty:
+        return []
+
+    items = _baseline(_prepare(df), "amount", alpha)
+    days = _baseline(_daily(items), "amount", alpha)
+
+    flagged_items = _flag(items, "amount", threshold, min_obs)
+    flagged_days = _flag(days, "amount", threshold, min_obs)
+
+    anomalies = [
+        {
+            "kind": "item",
+            "category_id": None if row.category == "none" else int(row.category),
+            "date": None if pd.isna(row.date) else row.date.strftime("%Y-%m-%d"),
+            "receipt_id": row.receipt_id,
+            "text": row.text,
+            "amount": round(float(row.amount), 2),
+            "expected": round(float(row.prev_mean), 2),
+            "z": round(float(row.z), 2)
+        }
+        for row in flagged_items.itertuples(index=False)
+    ] + [
+        {
+            "kind": "day",
+            "category_id": None if row.category == "none" else int(row.category),
+            "date": row.date.strftime("%Y-%m-%d"),
+            "receipt_id": None,
+            "text": None,
+            "amount": round(float(row.amount), 2),
+            "expected": round(float(row.prev_mean), 2),
+            "z": round(float(row.z), 2)
+        }
+        for row in flagged_days.itertuples(index=False)
+    ]
+    return sorted(anomalies, key=lambda a: a["date"] or "")
+
+
+def baseline_state(df: pd.DataFrame, alpha: float = EWMA_ALPHA, threshold: float = Z_THRESHOLD,
+                   min_obs: int = MIN_OBSERVATIONS) -> dict:
+    """
+    Final per-category EWMA state after replaying the ledger, in the form
+    the streaming detector continues from.
+
+    The last day of each category stays open: its running total is kept
+    apart and only folded into the baseline once a later day arrives.
+    """
+    state = {}
+    if df.empty:
+        return state
+
+    items = _baseline(_prepare(df), "amount", alpha)
+    for row in items.groupby("category", sort=False).tail(1).itertuples(index=False):
+        state[row.category] = {
+            "item": {"mean": float(row.mean), "var": float(row.var), "n": int(row.n)},
+            "day": {"mean": 0.0, "var": 0.0, "n": 0, "current": None, "total": 0.0, "flagged": False}
+        }
+
+    days = _baseline(_daily(items), "amount", alpha)
+    flagged = _flag(days, "amount", threshold, min_obs)
+    for row in days.groupby("category", sort=False).tail(1).itertuples(index=False):
+        state[row.category]["day"] = {
+            # Baseline before the open day
+            "mean": 0.0 if pd.isna(row.prev_mean) else float(row.prev_mean),
+            "var": 0.0 if pd.isna(row.prev_var) else float(row.prev_var),
+            "n": int(row.prev_n),
+            "current": row.date.strftime("%Y-%m-%d"),
+            "total": float(row.amount),
+            "flagged": bool(((flagged["category"] == row.category) & (flagged["date"] == row.date)).any())
+        }
+    return state
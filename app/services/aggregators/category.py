@@ -1,6 +1,9 @@
-import pandas as pd
+from __future__ import annotations
+from app.utils.lazy import lazy_import
 from app.utils.query_transactions import get_category_map
 
+pd = lazy_import("pandas")
+
 
 def category_totals(df: pd.DataFrame, instance_id: str) -> list[dict]:
     category_map = get_category_map(instance_id)
@@ -73,6 +76,10 @@ def category_overages(data_df: pd.DataFrame, budgets_df: pd.DataFrame, instance_
     data_df["date"] = pd.to_datetime(data_df["date"]).dt.date
     data_df["category_id"] = data_df["category_id"].astype(int)
 
+    # One budget row per category of this instance, periodic budgets would
+    # otherwise duplicate rows in the merge
+    budgets_df = budgets_df[budgets_df["instance_id"] == instance_id]
+    budgets_df = budgets_df[["category_id", "limit"]].drop_duplicates(subset="category_id")
     budgets_df["category_id"] = budgets_df["category_id"].astype(int)
 
     merged = data_df.merge(budgets_df, how="left", on="category_id")
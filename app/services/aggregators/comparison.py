@@ -0,0 +1,73 @@
+from __future__ import annotations
+from app.utils.lazy import lazy_import
+from app.utils.query_transactions import get_category_map
+
+pd = lazy_import("pandas")
+np = lazy_import("numpy")
+
+
+def _pct(delta, previous):
+    return None if not previous else round(delta / previous * 100, 2)
+
+
+def period_comparison(df: pd.DataFrame, split: int, instance_id: str, bounds) -> dict:
+    """
+    Current vs previous period, overall and per category.
+
+    Parameters:
+        df (pd.DataFrame): Date-sorted rows of the previous period followed by
+            those of the current one.
+        split (int): Position in df where the current period starts.
+        bounds: (previous_start, current_start, current_end) timestamps, end exclusive.
+
+    Returns:
+        dict: Both periods with totals and receipt counts, the deltas, and
+        per-category deltas largest change first.
+    """
+    category_map = get_category_map(instance_id)
+    previous_start, current_start, current_end = bounds
+
+    window = np.where(np.arange(len(df)) < split, "previous", "current")
+    frame = pd.DataFrame({
+        "category_id": df["category_id"].to_numpy(),
+        "receipt_id": df["receipt_id"].to_numpy(),
+        "amount": pd.to_numeric(df["amount"], errors="coerce").fillna(0).to_numpy(),
+        "window": window
+    })
+
+    totals = frame.groupby("window")["amount"].sum().reindex(["previous", "current"], fill_value=0.0)
+    receipts = frame.groupby("window")["receipt_id"].nunique().reindex(["previous", "current"], fill_value=0)
+    by_category = (
+        frame.groupby(["category_id", "window"], dropna=False)["amount"]
+        .sum()
+        .unstack("window", fill_value=0.0)
+        .reindex(columns=["previous", "current"], fill_value=0.0)
+    )
+    by_category["delta"] = by_category["current"] - by_category["previous"]
+    by_category = by_category.iloc[by_category["delta"].abs().argsort()[::-1]]
+
+    def period(name, start, end):
+        return {
+            "start": start.strftime("%Y-%m-%d"),
+            "end": (end - pd.Timedelta(days=1)).strftime("%Y-%m-%d"),
+            "total": round(float(totals[name]), 2),
+            "receipts": int(receipts[name])
+        }
+
+    delta = float(totals["current"] - totals["previous"])
+    return {
+        "current": period("current", current_start, current_end),
+        "previous": period("previous", previous_start, current_start),
+        "delta": round(delta, 2),
+        "delta_pct": _pct(delta, float(totals["previous"])),
+        "categories": [
+            {
+                "category_name": "Uncategorized" if pd.isna(category_id) else category_map.get(int(category_id), "Uncategorized"),
+                "current": round(float(row.current), 2),
+                "previous": round(float(row.previous), 2),
+                "delta": round(float(row.delta), 2),
+                "delta_pct": _pct(float(row.delta), float(row.previous))
+            }
+            for category_id, row in zip(by_category.index, by_category.itertuples(index=False))
+        ]
+    }
@@ -0,0 +1,103 @@
+from __future__ import annotations
+from app.utils.lazy import lazy_import
+
+np = lazy_import("numpy")
+
+# Every model takes a matrix of series (one row per series, NaN before a
+# series starts) and returns a (rows, horizon) matrix of forecasts, so one
+# call covers every category of every instance in a batch.
+
+
+def seasonal_naive(Y: np.ndarray, horizon: int, season: int) -> np.ndarray:
+    """
+    Repeat the last full season; series shorter than a season repeat their
+    last value.
+    """
+    T = Y.shape[1]
+    last = Y[:, [-1]]
+    if T < season:
+        return np.repeat(last, horizon, axis=1)
+    forecast = Y[:, T - season + np.arange(horizon) % season]
+    return np.where(np.isnan(forecast), last, forecast)
+
+
+def holt(Y: np.ndarray, horizon: int, season: int = None, alpha: float = 0.5, beta: float = 0.1) -> np.ndarray:
+    """
+    Holt's linear exponential smoothing (level + trend).
+    """
+    level = np.full(Y.shape[0], np.nan)
+    trend = np.zeros(Y.shape[0])
+    for y in Y.T:
+        valid = ~np.isnan(y)
+        start = valid & np.isnan(level)
+        level[start] = y[start]
+        update = valid & ~start
+        previous = level[update]
+        level[update] = alpha * y[update] + (1 - alpha) * (previous + trend[update])
+        trend[update] = beta * (level[update] - previous) + (1 - beta) * trend[update]
+    return level[:, None] + trend[:, None] * np.arange(1, horizon + 1)
+
+
+def linear_trend(Y: np.ndarray, horizon: int, season: int = None) -> np.ndarray:
+    """
+    Least-squares line through each series, extrapolated.
+    """
+    T = Y.shape[1]
+    t = np.arange(T, dtype=float)
+    w = ~np.isnan(Y)
+    y = np.where(w, Y, 0.0)
+
+    sw, st, stt = w.sum(axis=1), (w * t).sum(axis=1), (w * t * t).sum(axis=1)
+    sy, sty = y.sum(axis=1), (y * t).sum(axis=1)
+    denom = sw * stt - st ** 2
+    slope = np.divide(sw * sty - st * sy, denom, out=np.zeros(len(Y)), where=denom > 0)
+    intercept = (sy - slope * st) / np.maximum(sw, 1)
+    return intercept[:, None] + slope[:, None] * np.arange(T, T + horizon)
+
+
+FORECAST_MODELS = {
+    "seasonal_naive": seasonal_naive,
+    "holt": holt,
+    "linear_trend": linear_trend,
+}
+
+DEFAULT_MODEL = "holt"
+
+
+def _mean_abs_error(forecast, actual):
+    # Per row, over the buckets where both exist; inf when there are none
+    diff = np.abs(forecast - actual)
+    valid = ~np.isnan(diff)
+    total = np.where(valid, diff, 0.0).sum(axis=1)
+    count = valid.sum(axis=1)
+    return np.divide(total, count, out=np.full(len(diff), np.inf), where=count > 0)
+
+
+def forecast_series(Y, horizon: int, season: int):
+    """
+    Forecast every row of Y with the model that did best on a holdout.
+
+    Each model is fitted on the series minus its last horizon buckets and
+    scored by mean absolute error on them; series too short for a holdout
+    use DEFAULT_MODEL. Forecasts are clipped at zero.
+
+    Returns:
+        (np.ndarray, list[str]): (rows, horizon) forecasts and the model per row.
+    """
+    Y = np.asarray(Y, dtype=float)
+    names = list(FORECAST_MODELS)
+    choice = np.full(len(Y), names.index(DEFAULT_MODEL))
+
+    if Y.shape[1] > horizon:
+        train, test = Y[:, :-horizon], Y[:, -horizon:]
+        errors = np.stack([
+            _mean_abs_error(model(train, horizon, season), test)
+            for model in FORECAST_MODELS.values()
+        ], axis=1)
+        # Need at least two observed points to fit before the holdout
+        enough = (~np.isnan(train)).sum(axis=1) >= 2
+        choice = np.where(enough, errors.argmin(axis=1), choice)
+
+    forecasts = np.stack([model(Y, horizon, season) for model in FORECAST_MODELS.values()])
+    chosen = forecasts[choice, np.arange(len(Y))]
+    return np.clip(chosen, 0, None), [names[i] for i in choice]
@@ -1,11 +1,14 @@
-import pandas as pd
+from __future__ import annotations
+from app.utils.lazy import lazy_import
+
+pd = lazy_import("pandas")
 
 def top_items(df: pd.DataFrame, top_n: int = 5) -> list[dict]:
     if df.empty or 'text' not in df.columns or 'amount' not in df.columns:
         return []
 
     item_stats = (
-        df.groupby("text")
+        df.groupby("text", observed=True)
         .agg(count=("text", "count"), total_spent=("amount", "sum"))
         .sort_values(by="count", ascending=False)
         .head(top_n)
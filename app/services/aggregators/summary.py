@@ -1,6 +1,9 @@
-import pandas as pd
+from __future__ import annotations
+from app.utils.lazy import lazy_import
 from app.utils.query_transactions import get_category_map
 
+pd = lazy_import("pandas")
+
 def total_spend(df: pd.DataFrame) -> dict:
     """
     Compute the total amount spent in the dataframe.
@@ -88,36 +91,59 @@ def monthly_spend(df: pd.DataFrame) -> list[dict]:
 
 
 
-import pandas as pd
 from app.utils.query_transactions import get_category_map
+from app.utils.json_provider import JSONFragment, frame_records
 
-def receipt_summary(df: pd.DataFrame, id: str) -> list[dict]:
-    df["amount"] = pd.to_numeric(df["amount"], errors="coerce").fillna(0)
-    df["date"] = pd.to_datetime(df["date"], errors="coerce")
+def receipt_summary(df: pd.DataFrame, id: str, as_json: bool = False):
+    """
+    Per-receipt totals with their line items.
+
+    With as_json=True the result is returned as a pre-encoded JSON fragment,
+    built straight from the DataFrame without per-row dicts.
+    """
+    df = df.dropna(subset=["receipt_id"])
+    df = df.assign(
+        amount=pd.to_numeric(df["amount"], errors="coerce").fillna(0),
+        date=pd.to_datetime(df["date"], errors="coerce")
+    )
 
     # Get category_id -> category_name mapping
     category_map = get_category_map(id)
 
-    result = []
-
-    for rid, group in df.groupby("receipt_id"):
-        receipt = {
-            "receipt_id": rid,
-            "date": group["date"].min().date().isoformat(),
-            "total": float(round(group["amount"].sum(), 2)),
-            "items": []
-        }
-
-        for _, row in group.iterrows():
-            category_id = row.get("category_id", -1)
-            category_name = category_map.get(category_id, "Uncategorized")
-
-            receipt["items"].append({
-                "name": row.get("text", "Unknown"),
-                "category": category_name,
-                "amount": round(row["amount"], 2)
-            })
-
-        result.append(receipt)
+    # Keep the receipts in groupby order and their items in ledger order
+    df = df.sort_values("receipt_id", kind="stable")
+    grouped = df.groupby("receipt_id", sort=False, observed=True)
+
+    heads = grouped.agg(date=("date", "min"), total=("amount", "sum")).reset_index()
+    heads["date"] = heads["date"].dt.strftime("%Y-%m-%d")
+    heads["total"] = heads["total"].round(2)
+    bounds = grouped.size().cumsum().tolist()
+
+    items = pd.DataFrame({
+        "name": df["text"].astype("string").fillna("Unknown"),
+        "category": df["category_id"].map(category_map).fillna("Uncategorized"),
+        "amount": df["amount"].round(2)
+    })
+
+    if as_json:
+        if heads.empty:
+            return frame_records(heads)
+        # Records are split on "\n" only: JSON escapes it inside strings, but
+        # not U+0085 or U+2028, which str.splitlines would also break on
+        head_lines = heads.to_json(orient="records", lines=True, force_ascii=False).split("\n")
+        item_lines = items.to_json(orient="records", lines=True, force_ascii=False).split("\n")
+        parts = []
+        start = 0
+        for head, end in zip(head_lines, bounds):
+            parts.append(f'{head[:-1]},"items":[{",".join(item_lines[start:end])}]}}')
+            start = end
+        return JSONFragment("[" + ",".join(parts) + "]")
+
+    records = items.to_dict(orient="records")
+    result = heads.astype(object).where(heads.notna(), None).to_dict(orient="records")
+    start = 0
+    for receipt, end in zip(result, bounds):
+        receipt["items"] = records[start:end]
+        start = end
 
     return result
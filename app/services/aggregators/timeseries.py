@@ -0,0 +1,47 @@
+from __future__ import annotations
+from app.utils.lazy import lazy_import
+
+np = lazy_import("numpy")
+
+
+def lttb(x, y, threshold: int) -> np.ndarray:
+    """
+    Largest-triangle-three-buckets downsampling.
+
+    Returns the indices of the points to keep. The first and last points are
+    always kept, and each bucket in between keeps the point forming the
+    largest triangle with its neighbours, which preserves the visual shape.
+
+    Parameters:
+        x, y: Point coordinates, x ascending.
+        threshold (int): Number of points to keep.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if threshold >= n:
+        return np.arange(n)
+    if threshold < 3:
+        raise ValueError("threshold must be at least 3")
+
+    # Bucket edges for the n - 2 inner points
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    keep = np.empty(threshold, dtype=int)
+    keep[0], keep[-1] = 0, n - 1
+
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        # Average of the next bucket (or the last point) is the third vertex
+        next_start, next_end = end, edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+
+        areas = np.abs(
+            (x[a] - avg_x) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (avg_y - y[a])
+        )
+        a = start + int(areas.argmax())
+        keep[i + 1] = a
+
+    return keep
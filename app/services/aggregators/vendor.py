@@ -0,0 +1,92 @@
+from __future__ import annotations
+from app.utils.lazy import lazy_import
+from app.utils.vendor_index import normalize_vendor
+
+pd = lazy_import("pandas")
+
+
+def _vendor_receipts(df: pd.DataFrame, vendor_names: dict = None) -> pd.DataFrame:
+    """
+    One row per receipt with a known vendor: vendor, total, items, date.
+
+    Vendors are matched on their normalized name. Display names come from
+    vendor_names ({key: name}) when given, else from the first spelling in df.
+    """
+    vendor = df["vendor"].astype("category")
+    # Normalize each distinct name once
+    keys = pd.Series([normalize_vendor(name) for name in vendor.cat.categories], dtype=object)
+    df = df.assign(
+        vendor_key=keys.reindex(vendor.cat.codes.to_numpy()).to_numpy(),
+        amount=pd.to_numeric(df["amount"], errors="coerce").fillna(0),
+        date=pd.to_datetime(df["date"], errors="coerce")
+    ).dropna(subset=["vendor_key", "receipt_id"])
+
+    receipts = df.groupby("receipt_id", observed=True).agg(
+        vendor_key=("vendor_key", "first"),
+        raw_name=("vendor", "first"),
+        total=("amount", "sum"),
+        items=("amount", "size"),
+        date=("date", "min")
+    ).reset_index()
+
+    names = receipts.groupby("vendor_key")["raw_name"].first().astype(str).str.strip()
+    if vendor_names:
+        names = names.index.to_series().map(vendor_names).fillna(names)
+    return receipts.assign(vendor=receipts["vendor_key"].map(names))
+
+
+def vendor_totals(df: pd.DataFrame, vendor_names: dict = None, top_n: int = 10) -> list[dict]:
+    """
+    Spend per vendor, highest first, with its share of all spend in df.
+    """
+    receipts = _vendor_receipts(df, vendor_names)
+    if receipts.empty:
+        return []
+    overall = float(pd.to_numeric(df["amount"], errors="coerce").fillna(0).sum())
+
+    grouped = receipts.groupby("vendor", as_index=False)["total"].sum()
+    grouped = grouped.sort_values("total", ascending=False).head(top_n)
+    grouped["share"] = (grouped["total"] / overall).round(4) if overall else 0.0
+    grouped["total"] = grouped["total"].round(2)
+    return grouped[["vendor", "total", "share"]].to_dict(orient="records")
+
+
+def vendor_frequency(df: pd.DataFrame, vendor_names: dict = None, top_n: int = 10) -> list[dict]:
+    """
+    Visits (receipts) per vendor, most visited first, with the first and
+    last visit and the average visits per month in between.
+    """
+    receipts = _vendor_receipts(df, vendor_names)
+    if receipts.empty:
+        return []
+
+    grouped = receipts.groupby("vendor").agg(
+        visits=("receipt_id", "size"),
+        first_visit=("date", "min"),
+        last_visit=("date", "max")
+    ).reset_index()
+    months = ((grouped["last_visit"] - grouped["first_visit"]).dt.days / 30.44).clip(lower=1).fillna(1)
+    grouped["visits_per_month"] = (grouped["visits"] / months).round(2)
+    grouped = grouped.sort_values(["visits", "vendor"], ascending=[False, True]).head(top_n)
+    grouped["first_visit"] = grouped["first_visit"].dt.strftime("%Y-%m-%d")
+    grouped["last_visit"] = grouped["last_visit"].dt.strftime("%Y-%m-%d")
+    return grouped.astype(object).where(grouped.notna(), None).to_dict(orient="records")
+
+
+def average_basket(df: pd.DataFrame, vendor_names: dict = None, top_n: int = 10) -> list[dict]:
+    """
+    Average receipt total and item count per vendor, largest basket first.
+    """
+    receipts = _vendor_receipts(df, vendor_names)
+    if receipts.empty:
+        return []
+
+    grouped = receipts.groupby("vendor").agg(
+        visits=("receipt_id", "size"),
+        avg_basket=("total", "mean"),
+        avg_items=("items", "mean")
+    ).reset_index()
+    grouped = grouped.sort_values("avg_basket", ascending=False).head(top_n)
+    grouped["avg_basket"] = grouped["avg_basket"].round(2)
+    grouped["avg_items"] = grouped["avg_items"].round(2)
+    return grouped[["vendor", "avg_basket", "avg_items", "visits"]].to_dict(orient="records")
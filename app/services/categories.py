@@ -1,118 +1,202 @@
 import os
 import uuid
+import argparse
 from datetime import datetime, timezone
-import pandas as pd
+from app.utils.lazy import lazy_import
+from app.utils.ledger import (
+    UNCATEGORIZED, ledger_path, load_ledger, write_ledger, ledger_version, instance_lock, list_instances,
+    load_category_table, save_category_table, category_table_path
+)
+from app.utils.query_transactions import get_category_map
+from app.utils.file_lock import file_lock
+from app.services.transactions import remap_budgets
+from app.utils import spend_counters, anomaly_stats
+
+pd = lazy_import("pandas")
 
 # Constants
 STORAGE_DIR = "storage"
 META_FILE = "meta.json"
 
-# Ensure the storage directory exists
-os.makedirs(STORAGE_DIR, exist_ok=True)
-
 # Dummy function to simulate extracting user ID from token
 def extract_user_id(token):
-    return token  
+    return token
 
-def rename_category(token, cat_id, data):
+
+def _user_instance(token):
+    """
+    Instance of the token's user, as (instance_id, None) or (None, (error, status)).
+    """
     user_id = extract_user_id(token)
 
     # File paths
     meta_path = os.path.join(STORAGE_DIR, META_FILE)
     categories_path = os.path.join(STORAGE_DIR, "categories.csv")
 
-    # Load metadata and categories
+    # Load metadata
     if not os.path.exists(meta_path) or not os.path.exists(categories_path):
-        return {"error": "Metadata or category data missing"}, 500
+        return None, ({"error": "Metadata or category data missing"}, 500)
 
     try:
         meta_df = pd.read_json(meta_path)
-        cat_df = pd.read_csv(categories_path)
     except Exception as e:
-        return {"error": "Failed to load data", "details": str(e)}, 500
+        return None, ({"error": "Failed to load data", "details": str(e)}, 500)
 
-    # Step 1: Get instance_id for this user (assuming one instance per user)
+    # Get instance_id for this user (assuming one instance per user)
     user_instances = meta_df[meta_df["user_id"] == user_id]
     if user_instances.empty:
-        return {"error": "No workspace found for user"}, 404
+        return None, ({"error": "No workspace found for user"}, 404)
 
     # ⚠️ If multiple instances exist for the user, you can refine this part as needed.
-    instance_id = user_instances.iloc[0]["instance_id"]
+    return user_instances.iloc[0]["instance_id"], None
+
+
+def _remap(instance_id, old_id, new_id):
+    """
+    Record that the ledger rows of old_id belong to new_id, keeping the
+    remap resolved, and move the running spend counters and budgets along.
+
+    The row-keyed derived files follow data_version, which the category
+    table is not part of, so they are left alone.
+    """
+    with instance_lock(instance_id):
+        previous_version = ledger_version(instance_id)
+        table = load_category_table(instance_id)
+        remap = {k: (new_id if v == old_id else v) for k, v in table["remap"].items()}
+        remap[old_id] = new_id
+        names = {k: v for k, v in table["names"].items() if k != old_id}
+        save_category_table(instance_id, {"remap": remap, "names": names})
 
-    # Step 2: Find category with matching cat_id AND instance_id
-    cat_row = cat_df[(cat_df["id"] == int(cat_id)) & (cat_df["instance_id"] == instance_id)]
-    if cat_row.empty:
+        # Fold the old category's running spend and budgets into the new one
+        spend_counters.on_recategorize(instance_id, old_id, new_id, previous_version, ledger_version(instance_id))
+        remap_budgets(instance_id, {old_id: new_id})
+
+
+def rename_category(token, cat_id, data):
+    instance_id, error = _user_instance(token)
+    if error:
+        return error
+
+    # Step 1: Find the active category with matching cat_id in the instance
+    if int(cat_id) not in get_category_map(instance_id):
         return {"error": "Category not found in this workspace"}, 404
 
-    # Step 3: Validate input
+    # Step 2: Validate input
     new_name = data.get("name", "").strip()
     if not new_name:
         return {"error": "Missing category name"}, 400
 
-    # Step 4: Update name
-    idx = cat_row.index[0]
-    cat_df.at[idx, "name"] = new_name
-
-    # Step 5: Save back to file
+    # Step 3: Record the new name in the instance's category table
     try:
-        cat_df.to_csv(categories_path, index=False)
+        with instance_lock(instance_id):
+            previous_version = ledger_version(instance_id)
+            table = load_category_table(instance_id)
+            names = {**table["names"], int(cat_id): new_name}
+            save_category_table(instance_id, {"remap": table["remap"], "names": names})
+            version = ledger_version(instance_id)
+            spend_counters.on_patch(instance_id, previous_version, version)
+            anomaly_stats.on_patch(instance_id, previous_version, version)
     except Exception as e:
         return {"error": "Failed to save category", "details": str(e)}, 500
 
-    # Step 6: Return updated category
+    # Step 4: Return updated category
     return {"id": int(cat_id), "name": new_name}, 200
 
 
 
 def delete_category(token, cat_id):
-    user_id = extract_user_id(token)
+    instance_id, error = _user_instance(token)
+    if error:
+        return error
 
-    # File paths
-    meta_path = os.path.join(STORAGE_DIR, META_FILE)
-    categories_path = os.path.join(STORAGE_DIR, "categories.csv")
+    # Step 1: Find the active category with matching id & instance
+    categories = get_category_map(instance_id)
+    if int(cat_id) not in categories:
+        return {"error": "Category not found in this workspace"}, 404
 
-    # Step 1: Load metadata and categories
-    if not os.path.exists(meta_path) or not os.path.exists(categories_path):
-        return {"error": "Metadata or categories not found"}, 500
+    # Step 2: Ensure at least one category remains after deletion
+    if len(categories) <= 1:
+        return {"error": "At least one category must remain"}, 400
 
-    meta_df = pd.read_json(meta_path)
-    cat_df = pd.read_csv(categories_path)
+    if not os.path.exists(ledger_path(instance_id)):
+        return {"error": "Instance data file not found"}, 500
 
-    # Step 2: Get instance_id from user_id
-    user_instances = meta_df[meta_df["user_id"] == user_id]
-    if user_instances.empty:
-        return {"error": "No workspace found for user"}, 404
+    # Step 3: Tombstone the category: its rows read as uncategorized (0) and
+    # it leaves the workspace; compaction later rewrites both files
+    try:
+        _remap(instance_id, int(cat_id), UNCATEGORIZED)
+    except Exception as e:
+        return {"error": "Failed to update instance data", "details": str(e)}, 500
 
-    # If user has multiple instances, you may need to modify this logic
-    instance_id = user_instances.iloc[0]["instance_id"]
+    return {"deleted": True}, 200
 
-    # Step 3: Find the category with matching id & instance
-    cat_row = cat_df[(cat_df["id"] == int(cat_id)) & (cat_df["instance_id"] == instance_id)]
-    if cat_row.empty:
-        return {"error": "Category not found in this workspace"}, 404
 
-    # Step 4: Ensure at least one category remains after deletion
-    instance_categories = cat_df[cat_df["instance_id"] == instance_id]
-    if len(instance_categories) <= 1:
-        return {"error": "At least one category must remain"}, 400
+def merge_category(token, cat_id, data):
+    instance_id, error = _user_instance(token)
+    if error:
+        return error
 
-    # Step 5: Update rows in instance CSV with category_id == cat_id → 0
-    instance_csv_path = os.path.join(STORAGE_DIR, f"instances/{instance_id}.csv")
-    if not os.path.exists(instance_csv_path):
+    # Step 1: Validate both categories
+    target = data.get("into")
+    if not isinstance(target, int) or isinstance(target, bool):
+        return {"error": "Missing or invalid 'into' category id"}, 400
+    categories = get_category_map(instance_id)
+    if int(cat_id) not in categories or target not in categories:
+        return {"error": "Category not found in this workspace"}, 404
+    if int(cat_id) == target:
+        return {"error": "Cannot merge a category into itself"}, 400
+
+    if not os.path.exists(ledger_path(instance_id)):
         return {"error": "Instance data file not found"}, 500
 
+    # Step 2: Remap the category's rows to the target
     try:
-        instance_df = pd.read_csv(instance_csv_path)
-        instance_df.loc[instance_df["category_id"] == int(cat_id), "category_id"] = 0
-        instance_df.to_csv(instance_csv_path, index=False)
+        _remap(instance_id, int(cat_id), target)
     except Exception as e:
         return {"error": "Failed to update instance data", "details": str(e)}, 500
 
-    # Step 6: Remove category from categories.csv
-    cat_df = cat_df.drop(cat_row.index)
-    try:
-        cat_df.to_csv(categories_path, index=False)
-    except Exception as e:
-        return {"error": "Failed to save updated categories", "details": str(e)}, 500
+    return {"id": target, "name": categories[target], "merged": int(cat_id)}, 200
 
-    return {"deleted": True}, 200
+
+def compact_categories(instance_id):
+    """
+    Fold an instance's category table into its ledger and categories.csv:
+    remapped ids rewritten in the ledger, deleted and merged categories
+    removed with any budget still set on them, renames applied. Derived
+    files are rebuilt by their next reader.
+    """
+    categories_path = os.path.join(STORAGE_DIR, "categories.csv")
+    with instance_lock(instance_id):
+        table = load_category_table(instance_id)
+        if not table["remap"] and not table["names"]:
+            return False
+
+        # load_ledger applies the remap, so writing it back persists it
+        if table["remap"]:
+            write_ledger(instance_id, load_ledger(instance_id, parse_dates=False, categorical=False))
+
+        with file_lock(categories_path):
+            cat_df = pd.read_csv(categories_path)
+            cat_df = cat_df[~((cat_df["instance_id"] == instance_id) & cat_df["id"].isin(list(table["remap"])))]
+            own = cat_df["instance_id"] == instance_id
+            cat_df.loc[own, "name"] = cat_df.loc[own, "id"].map(table["names"]).fillna(cat_df.loc[own, "name"])
+            tmp_path = f"{categories_path}.tmp"
+            cat_df.to_csv(tmp_path, index=False)
+            os.replace(tmp_path, categories_path)
+
+        remap_budgets(instance_id, table["remap"])
+        os.remove(category_table_path(instance_id))
+        return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fold category deletes, merges and renames into the ledgers.")
+    parser.add_argument("instances", nargs="*", help="Instance ids (default: all)")
+    args = parser.parse_args(argv)
+
+    compacted = [instance_id for instance_id in args.instances or list_instances() if compact_categories(instance_id)]
+    print(f"Compacted the categories of {len(compacted)} instance(s)")
+
+
+if __name__ == "__main__":
+    main()
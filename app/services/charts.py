@@ -0,0 +1,124 @@
+import os
+import json
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from app.services.graphs import get_bar_chart_data, get_line_chart_data, get_pie_chart_data
+from app.utils.ledger import ledger_version
+
+CHARTS_PATH = "storage/charts"
+
+CHART_TYPES = {
+    "pie": get_pie_chart_data,
+    "bar": get_bar_chart_data,
+    "line": get_line_chart_data,
+}
+
+IMAGE_FORMATS = {
+    "png": "image/png",
+    "svg": "image/svg+xml",
+}
+
+RENDER_WORKERS = int(os.getenv("CHART_RENDER_WORKERS", "2"))
+RENDER_TIMEOUT = 30
+
+# Older data versions are never requested again, keep only the newest images
+MAX_CHARTS_PER_INSTANCE = 50
+
+# matplotlib is not thread-safe, so rendering runs in its own processes.
+# Spawned (not forked) so workers never inherit the server's threads.
+_pool = None
+
+
+def _render_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=RENDER_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _pool
+
+
+def render_chart(chart, spec, path):
+    """
+    Render chart data ({"type", "data": [{"label", "value"}]}) to an image file.
+
+    Runs inside a render worker process.
+    """
+    import matplotlib
+    matplotlib.use('Agg')  # Use non-GUI backend for server environments
+    import matplotlib.pyplot as plt
+
+    labels = [entry["label"] for entry in chart["data"]]
+    values = [entry["value"] for entry in chart["data"]]
+
+    fig, ax = plt.subplots(figsize=(spec["width"], spec["height"]))
+    if spec["chart_type"] == "pie":
+        ax.pie(values, labels=labels, autopct="%1.1f%%")
+        ax.axis("equal")
+    elif spec["chart_type"] == "bar":
+        ax.bar(labels, values)
+        ax.tick_params(axis="x", labelrotation=45)
+    else:
+        ax.plot(labels, values)
+        ax.tick_params(axis="x", labelrotation=45)
+
+    # Write to a temp name first so readers never see a partial image
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    fig.savefig(tmp_path, format=spec["format"], bbox_inches='tight')
+    plt.close(fig)
+    os.replace(tmp_path, path)
+    return path
+
+
+def chart_cache_key(instance_id, spec):
+    """
+    Content address of a rendered chart: (instance, chart spec, data version).
+    """
+    payload = json.dumps(
+        {"instance_id": instance_id, "spec": spec, "version": ledger_version(instance_id)},
+        sort_keys=True
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def get_chart_image(instance_id, chart_type, fmt, width=8, height=6, options=None):
+    """
+    Return (path, cache_key) of the rendered chart, rendering it on a cache miss.
+
+    options are passed through to the chart data function.
+    """
+    options = options or {}
+    spec = {
+        "chart_type": chart_type,
+        "format": fmt,
+        "width": float(width),
+        "height": float(height),
+        "options": options
+    }
+    key = chart_cache_key(instance_id, spec)
+
+    chart_dir = os.path.join(CHARTS_PATH, instance_id)
+    path = os.path.join(chart_dir, f"{key}.{fmt}")
+    if os.path.exists(path):
+        return path, key
+
+    os.makedirs(chart_dir, exist_ok=True)
+    chart = CHART_TYPES[chart_type](instance_id, **options)
+    _render_pool().submit(render_chart, chart, spec, os.path.abspath(path)).result(timeout=RENDER_TIMEOUT)
+    _prune(chart_dir)
+    return path, key
+
+
+def _prune(chart_dir):
+    entries = sorted(
+        (entry for entry in os.scandir(chart_dir) if not entry.name.endswith(".tmp")),
+        key=lambda entry: entry.stat().st_mtime,
+        reverse=True
+    )
+    for entry in entries[MAX_CHARTS_PER_INSTANCE:]:
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,104 @@
+import io
+from app.utils.lazy import lazy_import, is_available
+from app.utils.ledger import iter_ledger_chunks
+from app.utils.query_transactions import get_category_map
+
+pd = lazy_import("pandas")
+
+# format -> (mimetype, file extension)
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+EXPORT_COLUMNS = ["date", "text", "amount", "category_id", "category_name", "receipt_id"]
+
+
+def available_formats():
+    return [fmt for fmt in EXPORT_FORMATS if fmt != "parquet" or is_available("pyarrow")]
+
+
+def filtered_chunks(instance_id, start=None, end=None, category_ids=None):
+    """
+    Yield ledger chunks with filters applied and category names joined in.
+
+    start/end are inclusive pd.Timestamp bounds, category_ids an iterable of ids.
+    """
+    category_map = get_category_map(instance_id)
+    category_ids = set(category_ids) if category_ids else None
+
+    for chunk in iter_ledger_chunks(instance_id):
+        if start is not None or end is not None:
+            dates = pd.to_datetime(chunk["date"], errors="coerce")
+            mask = dates.notna()
+            if start is not None:
+                mask &= dates >= start
+            if end is not None:
+                mask &= dates < end + pd.Timedelta(days=1)
+            chunk = chunk[mask]
+
+        if category_ids is not None:
+            chunk = chunk[chunk["category_id"].isin(category_ids)]
+
+        if chunk.empty:
+            continue
+
+        chunk = chunk.assign(
+            category_name=chunk["category_id"].map(category_map).fillna("Uncategorized").astype("string")
+        )
+        yield chunk[EXPORT_COLUMNS]
+
+
+def _csv_stream(chunks):
+    # The header goes out before the first chunk is read
+    yield (",".join(EXPORT_COLUMNS) + "\n").encode("utf-8")
+    for chunk in chunks:
+        yield chunk.to_csv(header=False, index=False).encode("utf-8")
+
+
+def _ndjson_stream(chunks):
+    for chunk in chunks:
+        yield chunk.to_json(orient="records", lines=True, force_ascii=False).rstrip("\n").encode("utf-8") + b"\n"
+
+
+def _parquet_stream(chunks):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ("date", pa.string()),
+        ("text", pa.string()),
+        ("amount", pa.float64()),
+        ("category_id", pa.int64()),
+        ("category_name", pa.string()),
+        ("receipt_id", pa.string()),
+    ])
+    sink = io.BytesIO()
+
+    def drain():
+        data = sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+        return data
+
+    # One row group per chunk, flushed to the client as soon as it is written
+    with pq.ParquetWriter(sink, schema) as writer:
+        yield drain()
+        for chunk in chunks:
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+            yield drain()
+    yield drain()
+
+
+def export_ledger(instance_id, fmt="csv", start=None, end=None, category_ids=None):
+    """
+    Build a byte generator streaming the filtered ledger in the given format.
+    """
+    chunks = filtered_chunks(instance_id, start, end, category_ids)
+
+    if fmt == "ndjson":
+        return _ndjson_stream(chunks)
+    if fmt == "parquet":
+        return _parquet_stream(chunks)
+    return _csv_stream(chunks)
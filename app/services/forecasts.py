@@ -0,0 +1,139 @@
+from __future__ import annotations
+import argparse
+from datetime import date, datetime
+from app.utils.lazy import lazy_import
+from app.utils.ledger import DerivedFile, list_instances, ledger_version, instance_lock
+from app.utils.spend_counters import load_counters
+from app.services.aggregators.forecast import forecast_series
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+# Spend forecasts per category, fitted on the weekly and monthly buckets of
+# the spend counters. Stored per instance with the day they were made for;
+# the nightly batch refreshes every instance at once and the insights
+# endpoint only recomputes stale ones.
+_file = DerivedFile("forecast.json")
+
+FORECAST_PERIODS = {
+    "monthly": {"prefix": "M", "freq": "M", "horizon": 3, "season": 12, "history": 36},
+    "weekly": {"prefix": "W", "freq": "W", "horizon": 4, "season": 52, "history": 104},
+}
+
+def _to_period(label, freq):
+    if freq == "W":
+        return pd.Period(datetime.strptime(f"{label}-1", "%G-W%V-%u"), freq="W")
+    return pd.Period(label, freq=freq)
+
+
+def _label(period, freq):
+    return period.start_time.strftime("%G-W%V" if freq == "W" else "%Y-%m")
+
+
+def _series(counters, config, end):
+    """
+    {category: {period: spend}} of one instance within the history window.
+    """
+    start = end - (config["history"] - 1)
+    series = {}
+    prefix = f"{config['prefix']}:"
+    for key, buckets in counters["periods"].items():
+        if not key.startswith(prefix):
+            continue
+        period = _to_period(key[2:], config["freq"])
+        if start <= period <= end:
+            for category, amount in buckets.items():
+                series.setdefault(category, {})[period] = amount
+    return series
+
+
+def _forecast_period(instances, config, end):
+    """
+    Forecast one period type for many instances with a single model fit.
+
+    instances maps instance_id -> {category: {period: spend}}. All series
+    share one column per period up to end; a series is NaN before its first
+    bucket and zero in later buckets without spend.
+    """
+    columns = pd.period_range(end - (config["history"] - 1), end, freq=config["freq"])
+    position = {period: i for i, period in enumerate(columns)}
+
+    rows = [(instance_id, category, buckets)
+            for instance_id, series in instances.items()
+            for category, buckets in series.items()]
+    Y = np.full((len(rows), len(columns)), np.nan)
+    for r, (_, _, buckets) in enumerate(rows):
+        cols = [position[p] for p in buckets]
+        Y[r, min(cols):] = 0.0
+        Y[r, cols] = list(buckets.values())
+
+    horizon = config["horizon"]
+    labels = [_label(end + step, config["freq"]) for step in range(1, horizon + 1)]
+    results = {instance_id: {"labels": labels, "categories": {}, "total": [0.0] * horizon}
+               for instance_id in instances}
+    if not rows:
+        return results
+
+    forecasts, models = forecast_series(Y, horizon, config["season"])
+    for (instance_id, category, _), forecast, model in zip(rows, forecasts, models):
+        result = results[instance_id]
+        result["categories"][category] = {"model": model, "forecast": [round(v, 2) for v in forecast.tolist()]}
+        result["total"] = [round(t + v, 2) for t, v in zip(result["total"], forecast.tolist())]
+    return results
+
+
+def build_forecasts(instance_ids, today=None):
+    """
+    Forecast every instance in instance_ids in one batch and store the results.
+
+    Returns:
+        dict: instance_id -> forecast.
+    """
+    today = today or date.today()
+    counters = {instance_id: load_counters(instance_id) for instance_id in instance_ids}
+
+    forecasts = {
+        instance_id: {"version": counters[instance_id]["version"], "as_of": today.isoformat()}
+        for instance_id in instance_ids
+    }
+    for name, config in FORECAST_PERIODS.items():
+        # Fit on complete buckets, the forecast starts at the current one
+        end = pd.Period(today, freq=config["freq"]) - 1
+        series = {instance_id: _series(counters[instance_id], config, end) for instance_id in instance_ids}
+        for instance_id, result in _forecast_period(series, config, end).items():
+            forecasts[instance_id][name] = result
+
+    for instance_id, forecast in forecasts.items():
+        with instance_lock(instance_id):
+            # Skip instances that changed while forecasting, they are stale anyway
+            if ledger_version(instance_id) == forecast["version"]:
+                _file.save(instance_id, forecast)
+    return forecasts
+
+
+def load_forecast(instance_id, today=None):
+    """
+    Return the forecast of an instance, recomputing it if the data changed or
+    it was made on an earlier day.
+    """
+    today = today or date.today()
+    forecast = _file.current(instance_id, ledger_version(instance_id))
+    if forecast is None or forecast["as_of"] != today.isoformat():
+        forecast = build_forecasts([instance_id], today)[instance_id]
+    return forecast
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Refresh spend forecasts (nightly batch).")
+    parser.add_argument("instances", nargs="*", help="Instance ids (default: all)")
+    parser.add_argument("--batch-size", type=int, default=500, help="Instances per model fit")
+    args = parser.parse_args(argv)
+
+    instance_ids = args.instances or list_instances()
+    for start in range(0, len(instance_ids), args.batch_size):
+        build_forecasts(instance_ids[start:start + args.batch_size])
+    print(f"Forecast {len(instance_ids)} instance(s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,14 @@
 from app.services.aggregators.category import category_totals
-import pandas as pd
+from app.utils.lazy import lazy_import
+from app.utils.ledger import load_ledger
+
+pd = lazy_import("pandas")
 
 def get_pie_chart_data(instance_id):
     """
     Pie chart data showing total spend per category.
     """
-    df = pd.read_csv(f"storage/instances/{instance_id}.csv")
+    df = load_ledger(instance_id, ["amount", "category_id"])
 
     data = category_totals(df,instance_id)  # [{'category_id': 4, 'total': 1246.0}, ...]
     return {
@@ -26,7 +29,7 @@ def get_bar_chart_data(instance_id):
     """
     Bar chart data showing total spend per month.
     """
-    df = pd.read_csv(f"storage/instances/{instance_id}.csv")
+    df = load_ledger(instance_id, ["date", "amount"])
     data = monthly_spend(df)  # [{'month': '2024-02', 'total': 1246.0}, ...]
     return {
         "type": "bar",
@@ -40,21 +43,58 @@ def get_bar_chart_data(instance_id):
     }
 
 
-from app.services.aggregators.summary import daily_spend
+from datetime import datetime
+from app.services.aggregators.timeseries import lttb
+from app.utils.spend_counters import period_totals
+
+np = lazy_import("numpy")
+
+LINE_RESOLUTIONS = {"day": "daily", "week": "weekly", "month": "monthly"}
+
+
+def _bucket_start(label, resolution):
+    if resolution == "week":
+        return datetime.strptime(f"{label}-1", "%G-W%V-%u")
+    if resolution == "month":
+        return datetime.strptime(label, "%Y-%m")
+    return datetime.strptime(label, "%Y-%m-%d")
+
 
-def get_line_chart_data(instance_id):
+def get_line_chart_data(instance_id, points=None, resolution="day"):
     """
-    Line chart data showing total spent per day.
+    Line chart data showing total spent per day, week or month.
+
+    Series come from the pre-aggregated spend counters. With points set,
+    resolution="auto" picks the finest resolution that fits, and any series
+    still longer than points is downsampled with LTTB.
     """
-    df = pd.read_csv(f"storage/instances/{instance_id}.csv")
-    data = daily_spend(df)  # [{'date': '2024-02-25', 'total_spent': 317.0}, ...]
+    if resolution == "auto":
+        candidates = ["day", "week", "month"]
+    elif resolution in LINE_RESOLUTIONS:
+        candidates = [resolution]
+    else:
+        raise ValueError(f"resolution must be 'auto' or one of {list(LINE_RESOLUTIONS)}")
+
+    for resolution in candidates:
+        series = period_totals(instance_id, LINE_RESOLUTIONS[resolution])
+        if points is None or len(series) <= points:
+            break
+
+    downsampled = points is not None and len(series) > points
+    if downsampled:
+        x = np.array([_bucket_start(label, resolution).toordinal() for label, _ in series])
+        y = np.array([total for _, total in series])
+        series = [series[i] for i in lttb(x, y, points)]
+
     return {
         "type": "line",
+        "resolution": resolution,
+        "downsampled": downsampled,
         "data": [
             {
-                "label": entry["date"],
-                "value": entry["total_spent"]
+                "label": label,
+                "value": round(total, 2)
             }
-            for entry in data
+            for label, total in series
         ]
     }
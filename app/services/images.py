@@ -0,0 +1,79 @@
+from __future__ import annotations
+import os
+import json
+import argparse
+from app.utils.lazy import lazy_import
+from app.utils.image_store import image_path, thumbnail_path, collect_garbage, THUMB_SIZE
+
+pd = lazy_import("pandas")
+
+META_PATH = "storage/meta.json"
+RECEIPTS_JSON = "storage/receipts/receipts.json"
+
+# Thumbnail sizes a client may ask for, so the cache cannot be filled with
+# arbitrary renders
+THUMB_SIZES = (128, THUMB_SIZE, 512)
+
+
+def receipt_image(receipt_id):
+    """
+    Path of a receipt's image, or None if it has none.
+    """
+    return image_path(receipt_id)
+
+
+def receipt_thumbnail(receipt_id, size=THUMB_SIZE):
+    """
+    Path of a receipt's cached thumbnail, rendered on first request.
+    """
+    if size not in THUMB_SIZES:
+        raise ValueError(f"size must be one of {list(THUMB_SIZES)}")
+    return thumbnail_path(receipt_id, size)
+
+
+def live_instances(meta_path=META_PATH) -> set:
+    """
+    Ids of the workspaces in the metadata (deleted ones are removed from it).
+    """
+    if not os.path.exists(meta_path):
+        return set()
+    meta_df = pd.read_json(meta_path, convert_dates=False)
+    return set(meta_df["instance_id"]) if "instance_id" in meta_df.columns else set()
+
+
+def legacy_owners(receipts_path=RECEIPTS_JSON) -> dict:
+    """
+    receipt_id -> instance_id of every parsed receipt, to attribute images
+    uploaded before the image store existed.
+    """
+    if not os.path.exists(receipts_path):
+        return {}
+    with open(receipts_path) as f:
+        try:
+            receipts = json.load(f)
+        except json.JSONDecodeError:
+            return {}
+    return {r["receipt_id"]: r.get("instance_id") for r in receipts if r.get("receipt_id")}
+
+
+def collect_images():
+    """
+    Reclaim the images and thumbnails of deleted workspaces.
+    """
+    if not os.path.exists(META_PATH):
+        # Without metadata every image would look orphaned
+        return {"refs": 0, "images": 0, "legacy": 0, "tmp": 0}
+    return collect_garbage(live_instances(), legacy_owners())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reclaim receipt images of deleted workspaces.")
+    parser.parse_args(argv)
+
+    stats = collect_images()
+    print(f"Dropped {stats['refs']} reference(s), removed {stats['images']} image(s), "
+          f"{stats['legacy']} legacy upload(s) and {stats['tmp']} stale temp file(s)")
+
+
+if __name__ == "__main__":
+    main()
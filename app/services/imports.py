@@ -0,0 +1,298 @@
+from __future__ import annotations
+import os
+import re
+import argparse
+from app.utils.lazy import lazy_import
+from app.utils.ledger import LEDGER_COLUMNS, append_rows, ledger_path, instance_lock
+from app.utils.query_transactions import get_category_map
+from app.utils.category_matcher import category_key, match_category
+from app.services.workspace import add_categories
+
+pd = lazy_import("pandas")
+np = lazy_import("numpy")
+
+# Rows parsed, validated and appended per step, so memory stays flat
+# whatever the size of the file
+IMPORT_CHUNK_ROWS = 100_000
+
+# Header names of common bank and card CSV exports, by ledger field
+CSV_COLUMNS = {
+    "date": ["date", "transaction date", "posted date", "posting date", "booking date", "value date"],
+    "text": ["description", "memo", "details", "narrative", "text", "transaction description"],
+    "amount": ["amount", "transaction amount", "value"],
+    "debit": ["debit", "withdrawal", "withdrawals", "money out", "paid out"],
+    "credit": ["credit", "deposit", "deposits", "money in", "paid in"],
+    "category": ["category", "category name"],
+    "vendor": ["payee", "merchant", "vendor", "name"],
+}
+
+_OFX_TAG = re.compile(r"<(/?)(\w+)>([^<\r\n]*)")
+
+
+def _parse_amounts(values: pd.Series) -> pd.Series:
+    """
+    Vectorized parse of money strings: currency symbols and thousands
+    separators dropped, "(12.50)" and "12.50-" read as negative.
+    """
+    amount = pd.to_numeric(values, errors="coerce").astype("float64")
+    # Only values that are not plain numbers go through the string cleanup
+    messy = amount.isna() & values.notna()
+    if messy.any():
+        raw = values[messy].astype("string").str.strip()
+        negative = raw.str.startswith(("(", "-"), na=False) | raw.str.endswith("-", na=False)
+        cleaned = pd.to_numeric(raw.str.replace(r"[^\d.]", "", regex=True), errors="coerce").astype("float64")
+        amount[messy] = cleaned.where(~negative, -cleaned)
+    return amount
+
+
+def _csv_chunks(stream, chunk_rows, date_format=None):
+    columns = None
+    with pd.read_csv(stream, dtype="string", chunksize=chunk_rows, skipinitialspace=True) as reader:
+        for chunk in reader:
+            if columns is None:
+                # Resolve the header once: first alias present wins
+                present = {c.strip().lower(): c for c in chunk.columns}
+                columns = {
+                    field: next((present[a] for a in aliases if a in present), None)
+                    for field, aliases in CSV_COLUMNS.items()
+                }
+                if columns["date"] is None or (columns["amount"] is None and columns["debit"] is None):
+                    raise ValueError("CSV needs a date column and an amount or debit column")
+
+            def column(field):
+                name = columns[field]
+                return chunk[name] if name is not None else pd.Series(pd.NA, index=chunk.index, dtype="string")
+
+            if columns["amount"] is not None:
+                amount = _parse_amounts(column("amount"))
+            else:
+                # Separate debit/credit columns, both unsigned
+                amount = _parse_amounts(column("credit")).fillna(0).abs() - _parse_amounts(column("debit")).fillna(0).abs()
+                amount = amount.where(column("debit").notna() | column("credit").notna())
+
+            text = column("text").fillna(column("vendor"))
+            yield pd.DataFrame({
+                "date": pd.to_datetime(column("date"), errors="coerce", format=date_format),
+                "text": text,
+                "amount": amount,
+                "category": column("category"),
+                "vendor": column("vendor"),
+            })
+
+
+def _ofx_chunks(stream, chunk_rows):
+    # OFX 1.x is SGML with unclosed leaf tags, 2.x is XML; reading tags as
+    # <NAME>value pairs handles both, one line at a time
+    records, record = [], None
+    for line in stream:
+        for closing, tag, value in _OFX_TAG.findall(line):
+            tag = tag.upper()
+            if tag == "STMTTRN":
+                if closing and record is not None:
+                    records.append(record)
+                    record = None
+                    if len(records) == chunk_rows:
+                        yield _ofx_frame(records)
+                        records = []
+                elif not closing:
+                    record = {}
+            elif record is not None and not closing:
+                record[tag] = value.strip()
+    if records:
+        yield _ofx_frame(records)
+
+
+def _ofx_frame(records):
+    df = pd.DataFrame.from_records(records).reindex(columns=["DTPOSTED", "TRNAMT", "NAME", "PAYEE", "MEMO"])
+    name = df["NAME"].fillna(df["PAYEE"]).astype("string")
+    return pd.DataFrame({
+        # DTPOSTED is YYYYMMDD with an optional time and zone suffix
+        "date": pd.to_datetime(df["DTPOSTED"].astype("string").str[:8], errors="coerce", format="%Y%m%d"),
+        "text": df["MEMO"].astype("string").replace("", pd.NA).fillna(name),
+        "amount": _parse_amounts(df["TRNAMT"].astype("string")),
+        "category": pd.Series(pd.NA, index=df.index, dtype="string"),
+        "vendor": name,
+    })
+
+
+def _qif_chunks(stream, chunk_rows):
+    # One field per line, keyed by its first character; "^" ends a record
+    fields = {"D": "date", "T": "amount", "U": "amount", "P": "vendor", "M": "text", "L": "category"}
+    records, record = [], {}
+    for line in stream:
+        line = line.rstrip("\r\n")
+        if not line or line.startswith("!"):
+            continue
+        if line[0] == "^":
+            if record:
+                records.append(record)
+                record = {}
+                if len(records) == chunk_rows:
+                    yield _qif_frame(records)
+                    records = []
+        elif line[0] in fields:
+            record.setdefault(fields[line[0]], line[1:].strip())
+    if record:
+        records.append(record)
+    if records:
+        yield _qif_frame(records)
+
+
+def _qif_frame(records):
+    df = pd.DataFrame.from_records(records).reindex(columns=["date", "text", "amount", "category", "vendor"])
+    df = df.astype("string")
+    # Quicken writes 1/15'24 for 2024 and 1/15/24 or 1/15/2024 otherwise
+    dates = df["date"].str.replace("'", "/", regex=False).str.replace(" ", "", regex=False)
+    # Subcategories: "Food:Groceries" -> "Food". "[Savings]" is a transfer
+    # between the user's own accounts, not spending
+    category = df["category"].str.split(":").str[0].str.strip()
+    transfer = category.str.startswith("[", na=False)
+    return df.assign(
+        date=pd.to_datetime(dates, errors="coerce", format="%m/%d/%y").fillna(
+            pd.to_datetime(dates, errors="coerce", format="%m/%d/%Y")
+        ),
+        text=df["text"].replace("", pd.NA).fillna(df["vendor"]),
+        amount=_parse_amounts(df["amount"]),
+        category=category.mask(transfer),
+        transfer=transfer,
+    )
+
+
+IMPORT_FORMATS = {
+    "csv": _csv_chunks,
+    "ofx": _ofx_chunks,
+    "qfx": _ofx_chunks,
+    "qif": _qif_chunks,
+}
+
+
+def _normalize(frame: pd.DataFrame, spend_sign: str) -> tuple[pd.DataFrame, dict]:
+    """
+    Turn parsed transactions into ledger rows: invalid rows, money coming in
+    and transfers dropped, spending made positive.
+    """
+    valid = frame["date"].notna() & frame["amount"].notna() & (frame["amount"] != 0)
+    spend = frame["amount"] < 0 if spend_sign == "negative" else frame["amount"] > 0
+    transfer = frame["transfer"] if "transfer" in frame else pd.Series(False, index=frame.index)
+    rows = frame[valid & spend & ~transfer]
+    skipped = {
+        "invalid": int((~valid).sum()),
+        "credits": int((valid & ~spend).sum()),
+        "transfers": int((valid & spend & transfer).sum()),
+    }
+
+    return pd.DataFrame({
+        "date": rows["date"].dt.strftime("%Y-%m-%d"),
+        "text": rows["text"].astype("string").str.strip().fillna(""),
+        "amount": rows["amount"].abs().round(2),
+        "category": rows["category"].astype("string").str.strip().replace("", pd.NA),
+        "vendor": rows["vendor"].astype("string").str.strip().replace("", pd.NA),
+    }), skipped
+
+
+def detect_format(filename):
+    ext = os.path.splitext(filename or "")[1].lower().lstrip(".")
+    return ext if ext in IMPORT_FORMATS else None
+
+
+def import_transactions(token, instance_id, stream, fmt, spend_sign="negative", date_format=None,
+                        chunk_rows=IMPORT_CHUNK_ROWS):
+    """
+    Append the transactions of a bank or card export to an instance ledger.
+
+    The file is read IMPORT_CHUNK_ROWS at a time. Each chunk is validated and
+    normalized column-wise, its category names are matched case-insensitively
+    against the workspace's categories (the missing ones created in one
+    batch) and it is appended to the ledger in one write. Derived files
+    (sorted ledger, counters, indexes) are rebuilt by their next reader
+    rather than updated row by row.
+
+    Parameters:
+        stream: Text stream of the file.
+        fmt (str): One of IMPORT_FORMATS.
+        spend_sign (str): "negative" if the export writes spending as negative
+            amounts (bank convention), "positive" if as positive ones.
+        date_format (str): strftime format of CSV dates, inferred by default.
+
+    Returns:
+        tuple: (summary dict, status)
+    """
+    if fmt not in IMPORT_FORMATS:
+        raise ValueError(f"Unsupported format, expected one of {sorted(IMPORT_FORMATS)}")
+    if spend_sign not in ("negative", "positive"):
+        raise ValueError("spend_sign must be 'negative' or 'positive'")
+    if not os.path.exists(ledger_path(instance_id)):
+        return {"error": f"CSV not found for instance_id: {instance_id}"}, 404
+
+    # Workspace and ownership check up front (an empty batch creates nothing)
+    resp, status = add_categories(token, instance_id, [])
+    if status != 200:
+        return resp, status
+
+    options = {"date_format": date_format} if fmt == "csv" else {}
+    categories = {name.lower(): category_id for category_id, name in get_category_map(instance_id).items()}
+    summary = {"imported": 0, "skipped": {"invalid": 0, "credits": 0, "transfers": 0}, "categories_created": []}
+
+    for frame in IMPORT_FORMATS[fmt](stream, chunk_rows, **options):
+        rows, skipped = _normalize(frame, spend_sign)
+        for reason, count in skipped.items():
+            summary["skipped"][reason] += count
+        if rows.empty:
+            continue
+
+        # Resolve the chunk's unknown names to similar existing categories,
+        # then create the rest in one batch, one per distinct matching key
+        missing = {}
+        for name in rows["category"].dropna().unique():
+            if name.lower() in categories:
+                continue
+            category_id, _ = match_category(instance_id, name)
+            if category_id is not None:
+                categories[name.lower()] = category_id
+            else:
+                missing.setdefault(category_key(name), []).append(name)
+        if missing:
+            resp, status = add_categories(token, instance_id, [names[0] for names in missing.values()])
+            if status != 200:
+                return resp, status
+            for category in resp["categories"]:
+                summary["categories_created"].append(category)
+                for name in missing[category_key(category["name"])]:
+                    categories[name.lower()] = category["id"]
+
+        rows["category_id"] = rows["category"].str.lower().map(categories).astype("Int64")
+        with instance_lock(instance_id):
+            append_rows(instance_id, rows.reindex(columns=LEDGER_COLUMNS))
+        summary["imported"] += len(rows)
+
+    return summary, 200
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import a CSV/OFX/QIF bank export into an instance ledger.")
+    parser.add_argument("instance_id")
+    parser.add_argument("path")
+    parser.add_argument("--token", required=True, help="Token of the workspace owner")
+    parser.add_argument("--format", choices=sorted(IMPORT_FORMATS), help="Default: from the file extension")
+    parser.add_argument("--spend-sign", choices=["negative", "positive"], default="negative")
+    parser.add_argument("--date-format", help="strftime format of CSV dates")
+    parser.add_argument("--chunk-rows", type=int, default=IMPORT_CHUNK_ROWS)
+    args = parser.parse_args(argv)
+
+    fmt = args.format or detect_format(args.path)
+    if fmt is None:
+        parser.error("cannot tell the format from the file name, pass --format")
+
+    with open(args.path, encoding="utf-8-sig", errors="replace", newline="") as stream:
+        summary, status = import_transactions(
+            args.token, args.instance_id, stream, fmt,
+            spend_sign=args.spend_sign, date_format=args.date_format, chunk_rows=args.chunk_rows
+        )
+    if status != 200:
+        parser.exit(1, f"{summary.get('error')}\n")
+    print(f"Imported {summary['imported']} transaction(s), skipped {summary['skipped']}, "
+          f"created {len(summary['categories_created'])} categor(ies)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,11 @@
-from flask import request, jsonify
-import openai
-import os
-from dotenv import load_dotenv
+import asyncio
 from app.services.reports import instance_report
+from app.utils.llm import chat_completion, achat_completion
+from app.utils.anomaly_stats import query_anomalies
+from app.utils.query_transactions import get_category_map
+from app.services.forecasts import FORECAST_PERIODS, load_forecast
 import json
 
-# Load env vars
-load_dotenv()
-openai.api_key = os.getenv("OPENAI_API_KEY")
-
 # In-memory memory store
 chat_memory = {}
 MEMORY_WINDOW = 5
@@ -37,17 +34,95 @@ def handle_chat(id, message):
     messages = [build_system_message(report_data)] + build_message_log(id, message)
 
     try:
-        response = openai.chat.completions.create(
-            model="gpt-4o",
-            messages=messages
-        )
-        assistant_reply = response.choices[0].message.content.strip()
+        assistant_reply = chat_completion(messages, purpose="chat").strip()
     except Exception as e:
         return {"error": "LLM request failed", "details": str(e)}, 500
 
+    return remember_chat(id, message, assistant_reply)
+
+
+async def handle_chat_async(id, message):
+    try:
+        # Built from the ledger files in a worker thread
+        report_data = await asyncio.to_thread(instance_report, id)
+    except Exception as e:
+        return {"error": "Failed to load instance report", "details": str(e)}, 500
+
+    messages = [build_system_message(report_data)] + build_message_log(id, message)
+
+    try:
+        assistant_reply = (await achat_completion(messages, purpose="chat")).strip()
+    except Exception as e:
+        return {"error": "LLM request failed", "details": str(e)}, 500
+
+    return remember_chat(id, message, assistant_reply)
+
+
+def remember_chat(id, message, assistant_reply):
     history = chat_memory.get(id, [])
     history.append({"role": "user", "content": message})
     history.append({"role": "assistant", "content": assistant_reply})
     chat_memory[id] = history[-MEMORY_WINDOW:]
 
     return {"response": assistant_reply}, 200
+
+
+MAX_ANOMALIES_PAGE = 200
+
+
+def get_anomalies(instance_id, args):
+    """
+    Spending anomalies recorded at ingest, newest first.
+
+    Query params: kind (item or day), category_id, since (YYYY-MM-DD), limit.
+    """
+    try:
+        kind = args.get("kind")
+        if kind not in (None, "item", "day"):
+            raise ValueError
+        category_id = int(args["category_id"]) if args.get("category_id") else None
+        limit = min(max(int(args.get("limit", 50)), 1), MAX_ANOMALIES_PAGE)
+    except ValueError:
+        return {"error": "Invalid 'kind', 'category_id' or 'limit'"}, 400
+
+    category_map = get_category_map(instance_id)
+    anomalies = [
+        {**anomaly, "category": category_map.get(anomaly["category_id"], "Uncategorized")}
+        for anomaly in query_anomalies(instance_id, kind, category_id, args.get("since"), limit)
+    ]
+    return {"insight_type": "anomalies", "anomalies": anomalies}, 200
+
+
+def get_forecast(instance_id, args):
+    """
+    Spend forecast per category for the next buckets of a period.
+
+    Query params: period (monthly or weekly).
+    """
+    period = args.get("period", "monthly")
+    if period not in FORECAST_PERIODS:
+        return {"error": f"Invalid period, expected one of {list(FORECAST_PERIODS)}"}, 400
+
+    forecast = load_forecast(instance_id)[period]
+    category_map = get_category_map(instance_id)
+    categories = [
+        {
+            "category_id": None if key == "none" else int(key),
+            "category": "Uncategorized" if key == "none" else category_map.get(int(key), "Uncategorized"),
+            **entry
+        }
+        for key, entry in forecast["categories"].items()
+    ]
+    return {
+        "insight_type": "forecast",
+        "period": period,
+        "labels": forecast["labels"],
+        "total": forecast["total"],
+        "categories": categories
+    }, 200
+
+
+INSIGHT_TYPES = {
+    "anomalies": get_anomalies,
+    "forecast": get_forecast,
+}
@@ -1,12 +1,20 @@
 import os
-import pandas as pd
+import asyncio
+from app.utils.lazy import lazy_import
 import uuid
 import datetime
-from app.utils.reciept_parser import reciept_parser
+from app.utils.reciept_parser import reciept_parser, reciept_parser_async
+from app.utils.category_matcher import match_category
 from app.utils.save_reciept_image import save_receipt_image
 from app.services.workspace import add_category
+from app.utils.ledger import (
+    append_rows, append_deltas, compact_deltas, coerce_amounts, ledger_path, ledger_version, data_version, instance_lock
+)
+from app.utils import sorted_ledger, spend_counters, anomaly_stats, text_index, vendor_index, receipt_index
 import json
 
+pd = lazy_import("pandas")
+
 
 RECIEPTS_PATH = "storage/receipts"
 RECIEPT_FILE = 'receipts.json'
@@ -14,12 +22,29 @@ RECIEPT_FILE = 'receipts.json'
 
 def upload_and_parse_reciept(token, instance_id, file):
     # Step 1: Save uploaded image
-    receipt_id, path = save_receipt_image(file)
-    img_url = path.split('\\')[1]
+    receipt_id, path = save_receipt_image(file, instance_id)
 
     # Step 2: Parse the receipt
-    extracted_json = reciept_parser(img_url, instance_id)
+    extracted_json = reciept_parser(path, instance_id)
+
+    return _record_receipt(token, instance_id, receipt_id, extracted_json)
+
+
+async def upload_and_parse_reciept_async(token, instance_id, file):
+    """
+    upload_and_parse_reciept for the ASGI endpoint: the model call is
+    awaited, the file and ledger work runs in worker threads.
+    """
+    receipt_id, path = await asyncio.to_thread(save_receipt_image, file, instance_id)
+    extracted_json = await reciept_parser_async(path, instance_id)
+    return await asyncio.to_thread(_record_receipt, token, instance_id, receipt_id, extracted_json)
 
+
+def _record_receipt(token, instance_id, receipt_id, extracted_json):
+    """
+    Steps after parsing: resolve new categories, store the parsed receipt
+    and append its items to the ledger.
+    """
     # Defensive checks in case parser fails
     if not isinstance(extracted_json, dict):
         extracted_json = {}
@@ -38,11 +63,22 @@ def upload_and_parse_reciept(token, instance_id, file):
             category_map[item["category_name"].strip()] = None
 
     for category_name in category_map.keys():
+        # Reuse an existing category with a similar name before creating one
+        category_id, _ = match_category(instance_id, category_name)
+        if category_id is not None:
+            category_map[category_name] = category_id
+            continue
+
         category_resp, status = add_category(token, instance_id, {"name": category_name})
         if status == 200:
             category_map[category_name] = category_resp["id"]
-        else:
+            continue
+
+        # A concurrent upload may have just created it
+        category_id, _ = match_category(instance_id, category_name)
+        if category_id is None:
             raise Exception(f"Failed to add category '{category_name}': {category_resp.get('error')}")
+        category_map[category_name] = category_id
 
     for item in extracted_json["items"]:
         if "category_name" in item and not item.get("category_id"):
@@ -65,22 +101,34 @@ def upload_and_parse_reciept(token, instance_id, file):
         json.dump(receipt_data, f, indent=2)
 
     # Step 4: Append items to instance CSV
-    instance_csv_path = f"storage/instances/{instance_id}.csv"
-    os.makedirs(os.path.dirname(instance_csv_path), exist_ok=True)
-
     if extracted_json["items"]:
-        csv_rows = [
+        csv_rows = pd.DataFrame([
             {
                 "date": extracted_json.get("date", ""),
                 "text": item["text"],
                 "amount": item["price"],
                 "category_id": item["category_id"],
-                "receipt_id": receipt_id
+                "receipt_id": receipt_id,
+                "vendor": extracted_json.get("vendor")
             }
             for item in extracted_json["items"]
-        ]
-        file_exists = os.path.exists(instance_csv_path)
-        pd.DataFrame(csv_rows).to_csv(instance_csv_path, mode='a', header=not file_exists, index=False)
+        ])
+        # The model may return prices as text ("$4.50"); those are stored as missing
+        csv_rows["amount"] = coerce_amounts(csv_rows["amount"])
+        with instance_lock(instance_id):
+            previous_version = ledger_version(instance_id)
+            previous_data_version = data_version(instance_id)
+            append_rows(instance_id, csv_rows)
+            version, current_data_version = ledger_version(instance_id), data_version(instance_id)
+
+            # Keep the date-sorted copy, spend counters, anomaly baselines,
+            # text, vendor and receipt row indexes current without a rebuild
+            sorted_ledger.on_append(instance_id, csv_rows, previous_data_version, current_data_version)
+            spend_counters.on_append(instance_id, csv_rows, previous_version, version)
+            anomaly_stats.on_append(instance_id, csv_rows, previous_version, version)
+            text_index.on_append(instance_id, csv_rows, previous_data_version, current_data_version)
+            vendor_index.on_append(instance_id, csv_rows, previous_data_version, current_data_version)
+            receipt_index.on_append(instance_id, csv_rows, previous_data_version, current_data_version)
 
     return {"receipt_id": receipt_id, "items": extracted_json['items']}
 
@@ -95,76 +143,137 @@ def get_parsed_reciept(reciept_id):
     
     for reciept in data:
         if reciept.get('receipt_id') == reciept_id:
-            return {"JSON":reciept,"url":f'storage/receipts/uploads/{reciept_id}.jpg'}
+            return {
+                "JSON": reciept,
+                "url": f"/v1/reciepts/{reciept_id}/image",
+                "thumbnail_url": f"/v1/reciepts/{reciept_id}/thumbnail"
+            }
 
     return None  # If no match found
 
 
 
-def correct_parse_reciept(token, reciept_id, fix_data):
-    instance_id = fix_data.get("instance_id")
-    if not instance_id:
-        return {"error": "instance_id missing"}, 400
+def _ledger_fields(fix) -> dict:
+    """
+    Ledger columns a receipt item fix changes, with validated values.
+    """
+    fields = {}
+    if "text" in fix:
+        if not isinstance(fix["text"], str):
+            raise ValueError("text must be a string")
+        fields["text"] = fix["text"]
+    if "price" in fix:
+        fields["amount"] = float(fix["price"])
+    if "category_id" in fix:
+        fields["category_id"] = int(fix["category_id"])
+    return fields
 
-    receipt_path = os.path.join(RECIEPTS_PATH, RECIEPT_FILE)
 
-    # Load the existing JSON data
-    with open(receipt_path, 'r') as file:
-        all_receipts = json.load(file)
+def correct_receipts(instance_id, corrections):
+    """
+    Apply item fixes to many receipts at once.
 
-    updated = False
-    receipt_found = None
-
-    # Apply fixes to JSON receipt
-    for receipt in all_receipts:
-        if receipt.get('receipt_id') == reciept_id:
-            for fix in fix_data.get("fixes", []):
-                line = fix.get("line")
-                if isinstance(line, int) and 0 <= line < len(receipt.get("items", [])):
-                    for key, value in fix.items():
-                        if key != "line":
-                            receipt["items"][line][key] = value
-            # Recalculate total
-            receipt["total"] = round(sum(item.get("price", 0) for item in receipt.get("items", [])), 2)
-            updated = True
-            receipt_found = receipt
-            break
-
-    if not updated:
-        return {"error": f"No receipt found with ID: {reciept_id}"}, 404
+    receipts.json is read and written once for the whole batch. In the
+    ledger only the corrected rows are touched: they are located through the
+    receipt row index, their new values are appended to the correction log
+    in one write and the derived files are updated in place.
 
-    # Save updated JSON back
-    with open(receipt_path, 'w') as file:
-        json.dump(all_receipts, file, indent=2)
+    Parameters:
+        corrections (list[dict]): {"receipt_id": ..., "fixes": [{"line": n, "text"/"price"/"category_id": ...}]}
 
-    # Update instance CSV
-    csv_path = os.path.join("storage", "instances", f"{instance_id}.csv")
-    if not os.path.exists(csv_path):
+    Returns:
+        dict: updated receipt ids, not_found receipt ids and the number of rows_patched.
+    """
+    if not os.path.exists(ledger_path(instance_id)):
         return {"error": f"CSV not found for instance_id: {instance_id}"}, 404
 
-    try:
-        df = pd.read_csv(csv_path)
-
-        # Locate rows that belong to the current receipt_id
-        mask = df["receipt_id"] == reciept_id
-        receipt_rows = df[mask].copy()
+    # Validate everything before writing anything
+    fixes = {}
+    for correction in corrections:
+        receipt_id = correction.get("receipt_id")
+        if not receipt_id:
+            raise ValueError("receipt_id missing")
+        for fix in correction.get("fixes", []):
+            if isinstance(fix.get("line"), int):
+                fixes.setdefault(receipt_id, []).append((fix, _ledger_fields(fix)))
 
-        for fix in fix_data.get("fixes", []):
-            line = fix.get("line")
-            if isinstance(line, int) and 0 <= line < len(receipt_rows):
-                index = receipt_rows.index[line]
+    receipt_path = os.path.join(RECIEPTS_PATH, RECIEPT_FILE)
+    with open(receipt_path, 'r') as file:
+        all_receipts = json.load(file)
+    by_id = {receipt.get('receipt_id'): receipt for receipt in all_receipts}
+
+    # Apply fixes to JSON receipts
+    receipt_ids = list(dict.fromkeys(correction["receipt_id"] for correction in corrections))
+    updated = [receipt_id for receipt_id in receipt_ids if receipt_id in by_id]
+    not_found = [receipt_id for receipt_id in receipt_ids if receipt_id not in by_id]
+    for receipt_id in updated:
+        receipt = by_id[receipt_id]
+        for fix, _ in fixes.get(receipt_id, []):
+            line = fix["line"]
+            if 0 <= line < len(receipt.get("items", [])):
                 for key, value in fix.items():
-                    if key == "text":
-                        df.at[index, "text"] = value
-                    elif key == "price":
-                        df.at[index, "amount"] = value
-                    elif key == "category_id":
-                        df.at[index, "category_id"] = value
+                    if key != "line":
+                        receipt["items"][line][key] = value
+        # Recalculate total
+        receipt["total"] = round(sum(item.get("price", 0) for item in receipt.get("items", [])), 2)
+
+    if updated:
+        with open(receipt_path, 'w') as file:
+            json.dump(all_receipts, file, indent=2)
+
+    with instance_lock(instance_id):
+        previous_version = ledger_version(instance_id)
+        previous_data_version = data_version(instance_id)
+
+        # Collect the new values of each corrected row, later fixes winning
+        patches, keys = {}, {}
+        for receipt_id in updated:
+            rows = receipt_index.receipt_rows(instance_id, receipt_id)
+            for fix, fields in fixes.get(receipt_id, []):
+                line = fix["line"]
+                if 0 <= line < len(rows) and fields:
+                    date, seq = rows[line]
+                    patches.setdefault(seq, {}).update(fields)
+                    keys[seq] = (date, seq)
+
+        if patches:
+            found = sorted_ledger.fetch_rows(instance_id, list(keys.values()))
+            before = pd.DataFrame.from_dict(
+                {seq: found[key] for seq, key in keys.items() if key in found}, orient="index"
+            )
+            patches = {seq: fields for seq, fields in patches.items() if seq in before.index}
+            after = before.copy()
+            for seq, fields in patches.items():
+                for field, value in fields.items():
+                    after.at[seq, field] = value
+
+            append_deltas(instance_id, patches.items())
+            version, current_data_version = ledger_version(instance_id), data_version(instance_id)
+
+            # Move the corrected amounts between the running spend counters,
+            # re-index the corrected text and carry the row-keyed files over
+            spend_counters.on_correction(instance_id, before, after, previous_version, version)
+            text_index.on_correction(instance_id, before, after, previous_data_version, current_data_version)
+            sorted_ledger.on_patch(instance_id, previous_data_version, current_data_version)
+            receipt_index.on_patch(instance_id, previous_data_version, current_data_version)
+            vendor_index.on_patch(instance_id, previous_data_version, current_data_version)
+            compact_deltas(instance_id)
+
+    return {"updated": updated, "not_found": not_found, "rows_patched": len(patches)}, 200
 
-        # Save updated CSV
-        df.to_csv(csv_path, index=False)
 
-    except Exception as e:
-        return {"error": f"Error processing CSV: {str(e)}"}, 500
+def correct_parse_reciept(token, reciept_id, fix_data):
+    instance_id = fix_data.get("instance_id")
+    if not instance_id:
+        return {"error": "instance_id missing"}, 400
 
+    try:
+        resp, code = correct_receipts(instance_id, [{"receipt_id": reciept_id, "fixes": fix_data.get("fixes", [])}])
+    except (TypeError, ValueError) as e:
+        return {"error": f"Invalid fix: {str(e)}"}, 400
+
+    if code != 200:
+        return resp, code
+    if resp["not_found"]:
+        return {"error": f"No receipt found with ID: {reciept_id}"}, 404
     return {"message": "Receipt and CSV updated successfully."}, 200
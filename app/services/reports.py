@@ -1,51 +1,108 @@
-from flask import request,jsonify
-import pandas as pd
+import threading
+from datetime import date
+from collections import OrderedDict
+from app.utils.lazy import lazy_import
+from app.utils.ledger import load_ledger, ledger_version
 from app.services.aggregators.items import top_items
 from app.services.aggregators.category import category_totals,category_overages
 from app.services.aggregators.summary import receipt_summary, daily_spend,weekly_spend,monthly_spend
+from app.services.aggregators.vendor import vendor_totals, vendor_frequency, average_basket
+from app.services.aggregators.comparison import period_comparison
+from app.utils.vendor_index import vendor_names
 
-def instance_report(id, period="monthly", start_str=None, end_str=None):
-    import pandas as pd
+pd = lazy_import("pandas")
 
+# Date-sorted ledgers of recently reported instances, reused while the
+# ledger version holds: instance_id -> (version, frame, invalid date count).
+# Request threads share it, so it is only touched under _frames_lock; frames
+# are built outside it.
+MAX_CACHED_FRAMES = 8
+_frames = OrderedDict()
+_frames_lock = threading.Lock()
+
+
+def _sorted_frame(id):
+    version = ledger_version(id)
+    with _frames_lock:
+        cached = _frames.get(id)
+        if cached is not None and cached[0] == version:
+            _frames.move_to_end(id)
+            return cached[1], cached[2]
+
+    df = load_ledger(id)
+    invalid_count = int(df["date"].isna().sum())
+    df = df.dropna(subset=["date"]).sort_values("date", kind="stable").reset_index(drop=True)
+
+    with _frames_lock:
+        _frames[id] = (version, df, invalid_count)
+        while len(_frames) > MAX_CACHED_FRAMES:
+            _frames.popitem(last=False)
+    return df, invalid_count
+
+
+def report_windows(period, start_str=None, end_str=None, as_of=None):
+    """
+    Bounds of the current report period and the one before it.
+
+    Weekly and monthly periods end on as_of (today by default); custom
+    periods span start_str to end_str inclusive, and the previous period
+    has the same length.
+
+    Returns:
+        (previous_start, current_start, current_end) timestamps with the end
+        exclusive, or None when the report covers all data.
+    """
+    end = pd.Timestamp(as_of or date.today()).normalize() + pd.Timedelta(days=1)
+    if period == "custom" and start_str and end_str:
+        start = pd.to_datetime(start_str).normalize()
+        end = pd.to_datetime(end_str).normalize() + pd.Timedelta(days=1)
+        return start - (end - start), start, end
+    if period == "weekly":
+        return end - pd.Timedelta(days=14), end - pd.Timedelta(days=7), end
+    if period == "monthly":
+        return end - pd.DateOffset(months=2), end - pd.DateOffset(months=1), end
+    return None
+
+
+def instance_report(id, period="monthly", start_str=None, end_str=None, as_json=False, as_of=None):
     # Load CSV data
-    df = pd.read_csv(f'storage/instances/{id}.csv')
+    frame, invalid_count = _sorted_frame(id)
     bdf = pd.read_csv(f'storage/budgets.csv')
 
-    if df is None or df.empty:
+    if frame.empty and not invalid_count:
         return {"error": "No data found"}, 404
 
-    # Convert dates, coercing errors to NaT
-    df["date"] = pd.to_datetime(df["date"], errors="coerce")
-
-    # Drop rows with invalid dates
-    invalid_count = df["date"].isna().sum()
+    # Rows with invalid dates are left out
     if invalid_count > 0:
         print(f"[instance_report] Dropped {invalid_count} rows with invalid dates")
-        df = df.dropna(subset=["date"])
 
-    if df.empty:
+    if frame.empty:
         return {"error": "No valid dated data available"}, 404
 
-    # Filter data by period
-    if period == "custom" and start_str and end_str:
-        start = pd.to_datetime(start_str)
-        end = pd.to_datetime(end_str)
-        df = df[(df["date"] >= start) & (df["date"] <= end)]
-    elif period == "weekly":
-        start = df["date"].max() - pd.Timedelta(days=6)
-        df = df[df["date"] >= start]
-    elif period == "monthly":
-        start = df["date"].max() - pd.DateOffset(months=1)
-        df = df[df["date"] >= start]
+    # Locate the period and the previous one by binary search on the sorted
+    # dates; together they are one contiguous slice
+    bounds = report_windows(period, start_str, end_str, as_of)
+    if bounds is None:
+        df = frame.copy()
+        comparison = None
+    else:
+        lo, mid, hi = frame["date"].searchsorted(list(bounds), side="left")
+        df = frame.iloc[mid:hi].copy()
+        comparison = period_comparison(frame.iloc[lo:hi], mid - lo, id, bounds)
 
     # Generate insights
+    names = vendor_names(id)
     return {
         "total_spent": df["amount"].sum(),
         "top_items": top_items(df),
         "top_categories": category_totals(df, id),
         "category_overages": category_overages(df, bdf, id),
-        "receipt_summary": receipt_summary(df, id),
+        "receipt_summary": receipt_summary(df, id, as_json=as_json),
         "daily_spend": daily_spend(df),
         "weekly_spend": weekly_spend(df),
-        "monthly_spend": monthly_spend(df)
+        "monthly_spend": monthly_spend(df),
+        "vendor_totals": vendor_totals(df, names),
+        "vendor_frequency": vendor_frequency(df, names),
+        "average_basket": average_basket(df, names),
+        "comparison": comparison
     }
@@ -1,78 +1,170 @@
-import pandas as pd
+from app.utils.lazy import lazy_import
 import csv
 import os
-from collections import defaultdict
+from datetime import date
 from app.utils.query_transactions import query_transactions, get_category_map
-
-
-def list_transactions(instance_id):
-    transactions = query_transactions(instance_id)
-    return transactions
-
-
-def create_or_update_budget(instance_id, category_id, limit):
-    file_path = "storage/budgets.csv"
-
-    # If file doesn't exist, create it
-    if not os.path.exists(file_path):
-        df = pd.DataFrame(columns=["instance_id", "category_id", "limit"])
-    else:
-        df = pd.read_csv(file_path)
-
-    # Check if the category already exists for this instance
-    match = (df["instance_id"] == instance_id) & (df["category_id"] == category_id)
-
-    if match.any():
-        df.loc[match, "limit"] = limit
-    else:
-        df = pd.concat([
-            df,
-            pd.DataFrame([{
-                "instance_id": instance_id,
-                "category_id": category_id,
-                "limit": limit
-            }])
-        ], ignore_index=True)
-
-    df.to_csv(file_path, index=False)
-
-
-def get_budget_utilisation(instance_id, budgets_csv_path="storage/budgets.csv"):
+from app.utils.spend_counters import category_spend, period_key
+from app.utils.ledger import UNCATEGORIZED
+from app.utils.file_lock import file_lock
+
+pd = lazy_import("pandas")
+
+BUDGET_PERIODS = ["all", "monthly", "weekly"]
+
+MAX_PAGE_SIZE = 500
+
+BUDGETS_PATH = "storage/budgets.csv"
+
+
+def list_transactions(instance_id, args):
+    """
+    Parse the listing query params and return one page of transactions.
+
+    Supported params: start, end (or date for a single day), category_id
+    (repeatable or comma separated), min_amount, max_amount, text, search,
+    fields, cursor, limit and order (asc/desc, or relevance with search,
+    which is then the default).
+    """
+    try:
+        start = args.get("start") or args.get("date")
+        end = args.get("end") or args.get("date")
+        start = pd.to_datetime(start).strftime("%Y-%m-%d") if start else None
+        end = pd.to_datetime(end).strftime("%Y-%m-%d") if end else None
+
+        category_ids = {
+            int(cid)
+            for value in args.getlist("category_id")
+            for cid in value.split(",") if cid.strip()
+        }
+        min_amount = float(args["min_amount"]) if args.get("min_amount") else None
+        max_amount = float(args["max_amount"]) if args.get("max_amount") else None
+        fields = [f.strip() for f in args["fields"].split(",") if f.strip()] if args.get("fields") else None
+        limit = min(int(args.get("limit", 50)), MAX_PAGE_SIZE)
+
+        transactions = query_transactions(
+            instance_id,
+            start=start,
+            end=end,
+            category_ids=category_ids,
+            min_amount=min_amount,
+            max_amount=max_amount,
+            text=args.get("text"),
+            fields=fields,
+            cursor=args.get("cursor"),
+            limit=limit,
+            order=args.get("order", "relevance" if args.get("search") else "asc"),
+            search=args.get("search")
+        )
+    except ValueError as e:
+        return {"error": str(e)}, 400
+
+    if isinstance(transactions, tuple):
+        return transactions
+    return transactions, 200
+
+
+def create_or_update_budget(instance_id, category_id, limit, period="all"):
+    file_path = BUDGETS_PATH
+
+    if period not in BUDGET_PERIODS:
+        raise ValueError(f"period must be one of {BUDGET_PERIODS}")
+
+    with file_lock(file_path):
+        # If file doesn't exist, create it
+        if not os.path.exists(file_path):
+            df = pd.DataFrame(columns=["instance_id", "category_id", "limit", "period"])
+        else:
+            df = pd.read_csv(file_path)
+
+        # Budgets saved before periods existed cover all time
+        if "period" not in df.columns:
+            df["period"] = "all"
+        df["period"] = df["period"].fillna("all")
+
+        # Check if the category already has a budget for this period
+        match = (df["instance_id"] == instance_id) & (df["category_id"] == category_id) & (df["period"] == period)
+
+        if match.any():
+            df.loc[match, "limit"] = limit
+        else:
+            df = pd.concat([
+                df,
+                pd.DataFrame([{
+                    "instance_id": instance_id,
+                    "category_id": category_id,
+                    "limit": limit,
+                    "period": period
+                }])
+            ], ignore_index=True)
+
+        df.to_csv(file_path, index=False)
+
+
+def remap_budgets(instance_id, remap, budgets_csv_path=BUDGETS_PATH):
+    """
+    Move an instance's budgets along a category remap, {old id: new id}.
+
+    Budgets of deleted categories (remapped to UNCATEGORIZED) are dropped. A
+    merged category's budget joins the target's budget for the same period,
+    limits added, as the target now carries the spend of both.
+    """
+    if not remap or not os.path.exists(budgets_csv_path):
+        return False
+
+    with file_lock(budgets_csv_path):
+        df = pd.read_csv(budgets_csv_path)
+        if "period" not in df.columns:
+            df["period"] = "all"
+        df["period"] = df["period"].fillna("all")
+
+        own = df["instance_id"].astype(str) == str(instance_id)
+        moved = own & df["category_id"].isin(list(remap))
+        if not moved.any():
+            return False
+        df.loc[moved, "category_id"] = df.loc[moved, "category_id"].map(remap)
+        keep = ~(moved & (df["category_id"] == UNCATEGORIZED))
+        df, own = df[keep], own[keep]
+
+        merged = df[own].groupby(["instance_id", "category_id", "period"], as_index=False, sort=False)["limit"].sum()
+        df = pd.concat([df[~own], merged], ignore_index=True)[["instance_id", "category_id", "limit", "period"]]
+
+        tmp_path = f"{budgets_csv_path}.tmp"
+        df.to_csv(tmp_path, index=False)
+        os.replace(tmp_path, budgets_csv_path)
+        return True
+
+
+def get_budget_utilisation(instance_id, budgets_csv_path=BUDGETS_PATH, today=None):
     # Step 1: Load budgets and filter for this instance
     budgets = []
-    with open(budgets_csv_path, mode="r", encoding="utf-8") as file:
-        reader = csv.DictReader(file)
-        for row in reader:
-            if str(row["instance_id"]) == str(instance_id):
-                budgets.append({
-                    "category_id": int(row["category_id"]),
-                    "limit": float(row["limit"])
-                })
+    if os.path.exists(budgets_csv_path):
+        with open(budgets_csv_path, mode="r", encoding="utf-8") as file:
+            reader = csv.DictReader(file)
+            for row in reader:
+                if str(row["instance_id"]) == str(instance_id):
+                    budgets.append({
+                        "category_id": int(float(row["category_id"])),
+                        "limit": float(row["limit"]),
+                        "period": row.get("period") or "all"
+                    })
 
     # Step 2: Get category names for this instance
     category_map = get_category_map(instance_id)
+    today = today or date.today()
 
-    # Step 3: Get all transactions for this instance
-    tx_response = query_transactions(instance_id, limit=1000000)  # get all
-    transactions = tx_response["rows"]
-
-    # Step 4: Calculate total spent per category name
-    spent_by_category = defaultdict(float)
-    for tx in transactions:
-        category = tx["category"]
-        spent_by_category[category] += float(tx["amount"])
-
-    # Step 5: Combine budgets + spend
+    # Step 3: Look up spend per category id from the running counters
     result = []
     for entry in budgets:
         cat_id = entry["category_id"]
-        cat_name = category_map.get(cat_id, "Unknown")
         limit = entry["limit"]
-        spent = spent_by_category.get(cat_name, 0.0)
+        spent = category_spend(instance_id, cat_id, entry["period"], today)
         remaining = limit - spent
 
         result.append({
-            "category": cat_name,
+            "category_id": cat_id,
+            "category": category_map.get(cat_id, "Unknown"),
+            "period": entry["period"],
+            "period_key": None if entry["period"] == "all" else period_key(entry["period"], today)[2:],
             "limit": limit,
             "spent": round(spent, 2),
             "remaining": round(remaining, 2)
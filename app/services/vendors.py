@@ -0,0 +1,63 @@
+from __future__ import annotations
+import os
+import json
+import argparse
+from app.utils.lazy import lazy_import
+from app.utils.ledger import load_ledger, write_ledger, upgrade_ledger, list_instances, instance_lock
+from app.utils.vendor_index import build_vendor_index
+
+pd = lazy_import("pandas")
+
+RECEIPTS_JSON = "storage/receipts/receipts.json"
+
+
+def receipt_vendors(receipts_path=RECEIPTS_JSON) -> dict:
+    """
+    {instance_id: {receipt_id: vendor}} of every parsed receipt with a vendor.
+    """
+    if not os.path.exists(receipts_path):
+        return {}
+    with open(receipts_path) as f:
+        try:
+            receipts = json.load(f)
+        except json.JSONDecodeError:
+            return {}
+
+    vendors = {}
+    for receipt in receipts:
+        vendor = receipt.get("vendor")
+        if isinstance(vendor, str) and vendor.strip() and receipt.get("receipt_id"):
+            vendors.setdefault(receipt.get("instance_id"), {})[receipt["receipt_id"]] = vendor
+    return vendors
+
+
+def backfill_vendors(instance_id, vendors: dict) -> int:
+    """
+    Fill the vendor of ledger rows that have none from their receipt.
+
+    vendors maps receipt_id -> vendor. Returns the number of rows filled.
+    """
+    with instance_lock(instance_id):
+        upgrade_ledger(instance_id)
+        df = load_ledger(instance_id, parse_dates=False, categorical=False)
+        missing = df["vendor"].isna() & df["receipt_id"].isin(list(vendors))
+        if missing.any():
+            df.loc[missing, "vendor"] = df.loc[missing, "receipt_id"].map(vendors)
+            write_ledger(instance_id, df)
+        build_vendor_index(instance_id)
+        return int(missing.sum())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Backfill the ledger vendor column from receipts.json.")
+    parser.add_argument("instances", nargs="*", help="Instance ids (default: all)")
+    args = parser.parse_args(argv)
+
+    vendors = receipt_vendors()
+    for instance_id in args.instances or list_instances():
+        filled = backfill_vendors(instance_id, vendors.get(instance_id, {}))
+        print(f"{instance_id}: filled vendor on {filled} row(s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,18 @@
 import os
 import uuid
+import shutil
 from datetime import datetime, timezone
-import pandas as pd
+from app.utils.lazy import lazy_import
+from app.utils.ledger import LEDGER_COLUMNS, load_ledger
+from app.utils.query_transactions import get_category_map
+from app.utils.file_lock import file_lock
+
+pd = lazy_import("pandas")
 
 # Constants
 STORAGE_DIR = "storage"
 META_FILE = "meta.json"
 
-# Ensure the storage directory exists
-os.makedirs(STORAGE_DIR, exist_ok=True)
-
 # Dummy function to simulate extracting user ID from token
 def extract_user_id(token):
     return token  
@@ -49,7 +52,7 @@ def create_workspace(name, token):
 
     # 7. Create an empty CSV file for the new instance
     csv_path = os.path.join(STORAGE_DIR, f"instances/{instance_id}.csv")
-    pd.DataFrame(columns=["date", "text", "amount", "category_id", "receipt_id"]).to_csv(csv_path, index=False)
+    pd.DataFrame(columns=LEDGER_COLUMNS).to_csv(csv_path, index=False)
 
     # 8. Return response
     return {
@@ -113,7 +116,7 @@ def get_workspace(instance_id, token):
     if not os.path.exists(csv_path):
         return {"error": "Workspace data file not found"}, 500
 
-    df = pd.read_csv(csv_path)
+    df = load_ledger(instance_id, ["amount", "category_id"])
 
     # Step 4: Calculate total spend
     total_spend = df["amount"].sum()
@@ -221,14 +224,39 @@ def delete_workspace(token, instance_id):
     if os.path.exists(csv_path):
         os.remove(csv_path)
 
-    # step 6 delete associated reciept files
-    # PENDING
+    # Step 5.5: Delete the derived indexes and cached charts of the instance
+    shutil.rmtree(os.path.join(STORAGE_DIR, f"instances/{instance_id}"), ignore_errors=True)
+    shutil.rmtree(os.path.join(STORAGE_DIR, f"charts/{instance_id}"), ignore_errors=True)
+
+    # Step 6: Receipt images of the workspace are reclaimed by the image
+    # garbage collector (python -m app.services.images), which sees that
+    # the workspace is gone from the metadata
 
     return {"deleted": True}, 200
 
 
 
 def initialize_categories(token, instance_id, data):
+    # Parse input
+    raw_string = data.get("categories", "")
+    input_names = [name.strip() for name in raw_string.split(",") if name.strip()]
+    if not input_names:
+        return {"error": "No valid category names"}, 400
+
+    resp, status = add_categories(token, instance_id, input_names)
+    if status == 200 and not resp["categories"]:
+        return {"message": "No new categories to add"}, 200
+    return resp, status
+
+
+def add_categories(token, instance_id, names):
+    """
+    Add the categories among names that the workspace does not have yet
+    (compared case-insensitively), writing categories.csv once.
+
+    Returns:
+        tuple: ({"categories": [{"id", "name"}] of the new ones}, status)
+    """
     user_id = extract_user_id(token)
 
     # Step 1: Load metadata
@@ -247,41 +275,41 @@ def initialize_categories(token, instance_id, data):
     if workspace_row.iloc[0]["user_id"] != user_id:
         return {"error": "Forbidden"}, 403
 
-    # Step 2: Parse input
-    raw_string = data.get("categories", "")
-    input_names = [name.strip() for name in raw_string.split(",") if name.strip()]
-    if not input_names:
-        return {"error": "No valid category names"}, 400
-
-    # Step 3: Load or initialize categories.csv
-    if os.path.exists(CATEGORIES_PATH):
-        cat_df = pd.read_csv(CATEGORIES_PATH)
-    else:
-        cat_df = pd.DataFrame(columns=["instance_id", "id", "name"])
-
-    # Step 4: Filter existing categories for this instance
-    existing = cat_df[cat_df["instance_id"] == instance_id]["name"].str.lower()
-    new_names = [name for name in input_names if name.lower() not in existing.values]
-
-    if not new_names:
-        return {"message": "No new categories to add"}, 200
-
-    # Step 5: Calculate next ID
-    current_ids = cat_df[cat_df["instance_id"] == instance_id]["id"]
-    start_id = current_ids.max() + 1 if not current_ids.empty else 1
-
-    # Step 6: Create new rows
-    new_rows = pd.DataFrame([
-        {"instance_id": instance_id, "id": start_id + i, "name": name}
-        for i, name in enumerate(new_names)
-    ])
-
-    # Step 7: Append and save
-    cat_df = pd.concat([cat_df, new_rows], ignore_index=True)
-    cat_df.to_csv(CATEGORIES_PATH, index=False)
-
-    # Step 8: Build response
-    response = new_rows[["id", "name"]].to_dict(orient="records")
+    # Steps 2-6 hold the categories.csv lock so concurrent adds get distinct ids
+    with file_lock(CATEGORIES_PATH):
+        # Step 2: Load or initialize categories.csv
+        if os.path.exists(CATEGORIES_PATH):
+            cat_df = pd.read_csv(CATEGORIES_PATH)
+        else:
+            cat_df = pd.DataFrame(columns=["instance_id", "id", "name"])
+
+        # Step 3: Filter active categories of this instance and repeated names
+        existing = {n.lower() for n in get_category_map(instance_id, CATEGORIES_PATH).values()} if os.path.exists(CATEGORIES_PATH) else set()
+        new_names = []
+        for name in names:
+            if name.lower() not in existing:
+                existing.add(name.lower())
+                new_names.append(name)
+
+        if not new_names:
+            return {"categories": []}, 200
+
+        # Step 4: Calculate next ID
+        current_ids = cat_df[cat_df["instance_id"] == instance_id]["id"]
+        start_id = current_ids.max() + 1 if not current_ids.empty else 1
+
+        # Step 5: Create new rows
+        new_rows = pd.DataFrame([
+            {"instance_id": instance_id, "id": start_id + i, "name": name}
+            for i, name in enumerate(new_names)
+        ])
+
+        # Step 6: Append and save
+        cat_df = pd.concat([cat_df, new_rows], ignore_index=True)
+        cat_df.to_csv(CATEGORIES_PATH, index=False)
+
+    # Step 7: Build response
+    response = [{"id": int(row.id), "name": row.name} for row in new_rows.itertuples(index=False)]
     return {"categories": response}, 200
 
 
@@ -309,32 +337,32 @@ def add_category(token, instance_id, data):
     if not name:
         return {"error": "Missing category name"}, 400
 
-    # Step 3: Load or initialize categories.csv
-    if os.path.exists(CATEGORIES_PATH):
-        cat_df = pd.read_csv(CATEGORIES_PATH)
-    else:
-        cat_df = pd.DataFrame(columns=["instance_id", "id", "name"])
-
-    # Step 4: Check for duplicates
-    existing = cat_df[
-        (cat_df["instance_id"] == instance_id) &
-        (cat_df["name"].str.lower() == name.lower())
-    ]
-    if not existing.empty:
-        return {"error": "Category already exists"}, 400
-
-    # Step 5: Generate ID
-    current_ids = cat_df[cat_df["instance_id"] == instance_id]["id"]
-    new_id = current_ids.max() + 1 if not current_ids.empty else 1
-
-    # Step 6: Add new category
-    new_row = pd.DataFrame([{
-        "instance_id": instance_id,
-        "id": new_id,
-        "name": name
-    }])
-    cat_df = pd.concat([cat_df, new_row], ignore_index=True)
-    cat_df.to_csv(CATEGORIES_PATH, index=False)
+    # Steps 3-6 hold the categories.csv lock so concurrent adds get distinct ids
+    with file_lock(CATEGORIES_PATH):
+        # Step 3: Load or initialize categories.csv
+        if os.path.exists(CATEGORIES_PATH):
+            cat_df = pd.read_csv(CATEGORIES_PATH)
+        else:
+            cat_df = pd.DataFrame(columns=["instance_id", "id", "name"])
+
+        # Step 4: Check for duplicates among the active categories (deleted and
+        # merged ones keep their ids until compaction, but not their names)
+        existing = get_category_map(instance_id, CATEGORIES_PATH) if os.path.exists(CATEGORIES_PATH) else {}
+        if name.lower() in {n.lower() for n in existing.values()}:
+            return {"error": "Category already exists"}, 400
+
+        # Step 5: Generate ID
+        current_ids = cat_df[cat_df["instance_id"] == instance_id]["id"]
+        new_id = current_ids.max() + 1 if not current_ids.empty else 1
+
+        # Step 6: Add new category
+        new_row = pd.DataFrame([{
+            "instance_id": instance_id,
+            "id": new_id,
+            "name": name
+        }])
+        cat_df = pd.concat([cat_df, new_row], ignore_index=True)
+        cat_df.to_csv(CATEGORIES_PATH, index=False)
 
     # Step 7: Return response
     return {"id": int(new_id), "name": name}, 200
@@ -0,0 +1,152 @@
+from __future__ import annotations
+from app.utils.lazy import lazy_import
+from app.utils.ledger import DerivedFile, load_ledger, ledger_version, instance_lock
+from app.services.aggregators.anomalies import (
+    EWMA_ALPHA, Z_THRESHOLD, MIN_OBSERVATIONS, zscore, detect_anomalies, baseline_state
+)
+
+pd = lazy_import("pandas")
+
+# Running EWMA mean/variance of item amounts and daily totals per category:
+#   {"version": ..., "state": {cat: {"item": {...}, "day": {...}}}, "anomalies": [...]}
+# Ingest updates the state in O(1) per row and records new anomalies. Other
+# writes (corrections, category deletes and merges) leave it stale and the
+# next read rebuilds it by replaying the ledger.
+_file = DerivedFile("anomalies.json")
+
+# Only the newest anomalies are kept
+MAX_ANOMALIES = 1000
+
+
+def rebuild_stats(instance_id):
+    """
+    Replay the ledger of an instance into fresh statistics and anomalies.
+    """
+    with instance_lock(instance_id):
+        version = ledger_version(instance_id)
+        df = load_ledger(instance_id)
+        stats = {
+            "version": version,
+            "state": baseline_state(df),
+            "anomalies": detect_anomalies(df)[-MAX_ANOMALIES:]
+        }
+        _file.save(instance_id, stats)
+        return stats
+
+
+def load_stats(instance_id):
+    """
+    Return the anomaly statistics of an instance, rebuilding them if stale.
+    """
+    return _file.load(instance_id, rebuild_stats)
+
+
+def _update(moments, value, alpha=EWMA_ALPHA):
+    delta = value - moments["mean"]
+    if moments["n"] == 0:
+        moments["mean"], moments["var"] = value, 0.0
+    else:
+        increment = alpha * delta
+        moments["mean"] += increment
+        moments["var"] = (1 - alpha) * (moments["var"] + delta * increment)
+    moments["n"] += 1
+
+
+def _anomaly(kind, category, day, moments, value, z, row=None):
+    return {
+        "kind": kind,
+        "category_id": None if category == "none" else int(category),
+        "date": day,
+        "receipt_id": None if row is None else row.receipt_id,
+        "text": None if row is None else row.text,
+        "amount": round(float(value), 2),
+        "expected": round(float(moments["mean"]), 2),
+        "z": round(float(z), 2)
+    }
+
+
+def _observe(state, row, anomalies):
+    category = "none" if pd.isna(row.category_id) else str(int(row.category_id))
+    amount = 0.0 if pd.isna(row.amount) else float(row.amount)
+    day = None if pd.isna(row.date) else row.date.strftime("%Y-%m-%d")
+
+    entry = state.setdefault(category, {
+        "item": {"mean": 0.0, "var": 0.0, "n": 0},
+        "day": {"mean": 0.0, "var": 0.0, "n": 0, "current": None, "total": 0.0, "flagged": False}
+    })
+
+    item = entry["item"]
+    if item["n"] >= MIN_OBSERVATIONS:
+        z = zscore(amount, item["mean"], item["var"])
+        if z > Z_THRESHOLD:
+            anomalies.append(_anomaly("item", category, day, item, amount, z, row))
+    _update(item, amount)
+
+    daily = entry["day"]
+    if day is None or (daily["current"] is not None and day < daily["current"]):
+        # Late rows only count towards the item baseline
+        return
+    if day != daily["current"]:
+        if daily["current"] is not None:
+            _update(daily, daily["total"])
+        daily.update(current=day, total=0.0, flagged=False)
+    daily["total"] += amount
+
+    if daily["n"] < MIN_OBSERVATIONS:
+        return
+    z = zscore(daily["total"], daily["mean"], daily["var"])
+    anomaly = _anomaly("day", category, day, daily, daily["total"], z)
+    if daily["flagged"]:
+        # Already reported, keep its total current while the day is open
+        for existing in reversed(anomalies):
+            if (existing["kind"], existing["category_id"], existing["date"]) == \
+                    (anomaly["kind"], anomaly["category_id"], day):
+                existing.update(anomaly)
+                break
+    elif z > Z_THRESHOLD:
+        anomalies.append(anomaly)
+        daily["flagged"] = True
+
+
+def on_append(instance_id, rows: pd.DataFrame, previous_version, version):
+    """
+    Feed freshly ingested ledger rows through the running statistics.
+    """
+    with instance_lock(instance_id):
+        stats = _file.current(instance_id, previous_version)
+        if stats is None:
+            # Stale already, the next read rebuilds
+            return
+        rows = rows.assign(date=pd.to_datetime(rows["date"], errors="coerce"))
+        rows = rows.sort_values("date", kind="stable", na_position="first")
+        for row in rows.itertuples(index=False):
+            _observe(stats["state"], row, stats["anomalies"])
+        stats["anomalies"] = stats["anomalies"][-MAX_ANOMALIES:]
+        stats["version"] = version
+        _file.save(instance_id, stats)
+
+
+def on_patch(instance_id, previous_version, version):
+    """
+    Carry the statistics over a change that moves no amounts (a rename).
+    """
+    _file.carry_over(instance_id, previous_version, version)
+
+
+def query_anomalies(instance_id, kind=None, category_id=None, since=None, limit=50):
+    """
+    Recorded anomalies of an instance, newest first.
+    """
+    anomalies = load_stats(instance_id)["anomalies"]
+    matches = []
+    for anomaly in reversed(anomalies):
+        if kind and anomaly["kind"] != kind:
+            continue
+        if category_id is not None and anomaly["category_id"] != category_id:
+            continue
+        if since and (anomaly["date"] or "") < since:
+            continue
+        matches.append(anomaly)
+        if len(matches) >= limit:
+            break
+    return matches
@@ -0,0 +1,157 @@
+from __future__ import annotations
+import os
+import re
+import unicodedata
+from collections import Counter
+from app.utils.ledger import category_table_path
+from app.utils.query_transactions import get_category_map
+
+# Suggested category names are resolved to an existing category when their
+# normalized forms are similar enough, so "Groceries", "grocery" and
+# "Grocery & Food" do not each become a category of their own.
+#
+# A name is normalized to a key: case-folded, accents stripped, "&" read as
+# "and", stopwords dropped, each word lightly stemmed and the words sorted.
+# Equal keys match outright; otherwise the score is the Dice coefficient of
+# the keys' character trigrams, found through a trigram -> ids index.
+MATCH_THRESHOLD = 0.65
+
+# Short words one letter apart score as high as real variants ("Taxi" and
+# "Tax", "Card" and "Car" both 0.67), so a fuzzy match needs a whole word in
+# common, or both keys at least this long
+MIN_FUZZY_LENGTH = 5
+
+CATEGORIES_PATH = "storage/categories.csv"
+
+_STOPWORDS = {"and", "or", "of", "the", "for", "a", "an", "misc", "other", "others"}
+_WORD = re.compile(r"\w+")
+
+# instance_id -> (stamp, index)
+_index_cache = {}
+
+
+def _stem(word):
+    # Plural and -ing forms only: enough to fold "groceries"/"grocery",
+    # "restaurants"/"restaurant", "taxes"/"tax" style variants
+    if len(word) <= 3:
+        return word
+    if word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith(("ches", "shes", "sses", "xes", "zes")):
+        return word[:-2]
+    if word.endswith("ing") and len(word) > 6:
+        return word[:-3]
+    if word.endswith("s") and not word.endswith(("ss", "us")):
+        return word[:-1]
+    return word
+
+
+def category_key(name) -> str:
+    """
+    Normalized matching key of a category name ("" for an empty name).
+    """
+    if not isinstance(name, str):
+        return ""
+    name = unicodedata.normalize("NFKD", name.casefold().replace("&", " and "))
+    name = "".join(c for c in name if not unicodedata.combining(c))
+    words = _WORD.findall(name.replace("_", " "))
+    # Names made only of stopwords ("Other") keep them
+    words = [w for w in words if w not in _STOPWORDS] or words
+    return " ".join(sorted(_stem(w) for w in words))
+
+
+def _trigrams(key):
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _dice(grams, other):
+    return 2 * len(grams & other) / (len(grams) + len(other))
+
+
+def _may_match_fuzzily(key, other):
+    return bool(set(key.split()) & set(other.split())) or min(len(key), len(other)) >= MIN_FUZZY_LENGTH
+
+
+def similarity(a, b) -> float:
+    """
+    Score of category name b as a match for name a, as match_category
+    computes it: 1.0 for equal keys, the trigram Dice coefficient of the keys
+    if they may match fuzzily, else 0.0.
+
+    >>> similarity("Groceries", "grocery")
+    1.0
+    >>> round(similarity("Grocery & Food", "Groceries"), 2)
+    0.67
+    >>> round(similarity("Transport", "Transportation"), 2)
+    0.72
+    >>> similarity("Taxi", "Tax"), similarity("Card", "Car"), similarity("Rental", "Rent")
+    (0.0, 0.0, 0.0)
+    """
+    a, b = category_key(a), category_key(b)
+    if not a or not b:
+        return 0.0
+    if a == b:
+        return 1.0
+    return _dice(_trigrams(a), _trigrams(b)) if _may_match_fuzzily(a, b) else 0.0
+
+
+def _stamp(instance_id):
+    stamps = []
+    for path in (CATEGORIES_PATH, category_table_path(instance_id)):
+        try:
+            stamps.append(os.stat(path).st_mtime_ns)
+        except FileNotFoundError:
+            stamps.append(None)
+    return tuple(stamps)
+
+
+def _build(instance_id):
+    keys, trigrams, sizes, key_of = {}, {}, {}, {}
+    categories = get_category_map(instance_id, CATEGORIES_PATH) if os.path.exists(CATEGORIES_PATH) else {}
+    for category_id, name in categories.items():
+        key = category_key(name)
+        if not key or key in keys:
+            continue
+        keys[key] = category_id
+        key_of[category_id] = key
+        grams = _trigrams(key)
+        sizes[category_id] = len(grams)
+        for gram in grams:
+            trigrams.setdefault(gram, []).append(category_id)
+    return {"keys": keys, "trigrams": trigrams, "sizes": sizes, "key_of": key_of}
+
+
+def _index(instance_id):
+    stamp = _stamp(instance_id)
+    cached = _index_cache.get(instance_id)
+    if cached is None or cached[0] != stamp:
+        cached = (stamp, _build(instance_id))
+        _index_cache[instance_id] = cached
+    return cached[1]
+
+
+def match_category(instance_id, name, threshold=MATCH_THRESHOLD):
+    """
+    Resolve a suggested category name to an existing category.
+
+    Returns:
+        tuple: (category_id or None, similarity score)
+    """
+    key = category_key(name)
+    if not key:
+        return None, 0.0
+    index = _index(instance_id)
+    if key in index["keys"]:
+        return index["keys"][key], 1.0
+
+    grams = _trigrams(key)
+    shared = Counter()
+    for gram in grams:
+        shared.update(index["trigrams"].get(gram, ()))
+    best, score = None, 0.0
+    for category_id, count in shared.items():
+        dice = 2 * count / (len(grams) + index["sizes"][category_id])
+        if dice > score and _may_match_fuzzily(key, index["key_of"][category_id]):
+            best, score = category_id, dice
+    return (best, score) if score >= threshold else (None, score)
@@ -0,0 +1,148 @@
+import zlib
+from functools import wraps
+from flask import request, make_response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Responses smaller than this are sent as-is, compression would not pay off
+COMPRESS_MIN_SIZE = 1024
+
+COMPRESS_LEVELS = {"br": 5, "zstd": 3, "gzip": 6}
+
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/json",
+    "application/x-ndjson",
+    "image/svg+xml",
+)
+
+
+class _Compressor:
+    """
+    Uniform streaming interface over gzip, brotli and zstd.
+    """
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        level = COMPRESS_LEVELS[encoding]
+        if encoding == "br":
+            self._obj = brotli.Compressor(quality=level)
+        elif encoding == "zstd":
+            self._obj = zstandard.ZstdCompressor(level=level).compressobj()
+        else:
+            self._obj = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        if self.encoding == "br":
+            return self._obj.process(data)
+        return self._obj.compress(data)
+
+    def flush(self):
+        # Push out everything buffered so far without ending the stream
+        if self.encoding == "br":
+            return self._obj.flush()
+        if self.encoding == "zstd":
+            return self._obj.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+        return self._obj.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        if self.encoding == "br":
+            return self._obj.finish()
+        return self._obj.flush()
+
+
+def supported_encodings():
+    # Server preference order, used to break ties between equal q-values
+    encodings = []
+    if brotli is not None:
+        encodings.append("br")
+    if zstandard is not None:
+        encodings.append("zstd")
+    encodings.append("gzip")
+    return encodings
+
+
+def negotiate_encoding():
+    return request.accept_encodings.best_match(supported_encodings())
+
+
+def _is_compressible(response):
+    if response.status_code != 200 or "Content-Encoding" in response.headers:
+        return False
+    if response.cache_control.no_transform:
+        return False
+    return response.mimetype.startswith(COMPRESSIBLE_TYPES)
+
+
+def _stream(iterable, compressor):
+    first = True
+    for chunk in iterable:
+        if isinstance(chunk, str):
+            chunk = chunk.encode("utf-8")
+        data = compressor.compress(chunk)
+        if first:
+            # Get the first bytes to the client right away
+            data += compressor.flush()
+            first = False
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+def compress_response(response, min_size=COMPRESS_MIN_SIZE):
+    """
+    Compress a response with the best encoding the client accepts.
+
+    Buffered responses are compressed in one go when they are at least
+    min_size bytes; streamed responses are compressed chunk by chunk.
+    """
+    if not _is_compressible(response):
+        return response
+
+    response.vary.add("Accept-Encoding")
+
+    encoding = negotiate_encoding()
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        source = response.response
+        if hasattr(source, "close"):
+            response.call_on_close(source.close)
+        response.response = _stream(source, _Compressor(encoding))
+        response.direct_passthrough = False
+        response.headers.pop("Content-Length", None)
+    else:
+        data = response.get_data()
+        if len(data) < min_size:
+            return response
+        compressor = _Compressor(encoding)
+        response.set_data(compressor.compress(data) + compressor.finish())
+
+    response.headers["Content-Encoding"] = encoding
+
+    # A compressed body is a different representation, so it gets its own tag
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f"{etag}-{encoding}", weak=weak)
+
+    return response
+
+
+def compressed(view):
+    """
+    Route decorator applying compress_response to the view's response.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        return compress_response(make_response(view(*args, **kwargs)))
+
+    return wrapper
@@ -0,0 +1,64 @@
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Locks shared by every thread and worker process touching a file: an
+# RLock for the threads of this process plus an flock on "<path>.lock" for
+# other processes (server workers, the maintenance CLIs). Where fcntl is
+# missing only the threads of one process are serialised.
+
+
+class FileLock:
+    """
+    Reentrant exclusive lock on a path, across threads and processes.
+    """
+
+    def __init__(self, path):
+        self.path = f"{path}.lock"
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._file = None
+
+    def __enter__(self):
+        self._lock.acquire()
+        if self._depth == 0 and fcntl is not None:
+            try:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                self._file = open(self.path, "a")
+                fcntl.flock(self._file, fcntl.LOCK_EX)
+            except BaseException:
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+                self._lock.release()
+                raise
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if self._depth == 0 and self._file is not None:
+            # Closing the file releases the flock
+            self._file.close()
+            self._file = None
+        self._lock.release()
+
+
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+def file_lock(path) -> FileLock:
+    """
+    The lock of a path, one per path and process.
+    """
+    path = os.path.abspath(path)
+    with _locks_guard:
+        lock = _locks.get(path)
+        if lock is None:
+            lock = _locks[path] = FileLock(path)
+        return lock
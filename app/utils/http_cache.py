@@ -0,0 +1,36 @@
+from flask import request, make_response
+
+
+def not_modified(etag, last_modified=None):
+    """
+    Return a 304 response if the request's validators match, else None.
+
+    Tags produced by compress_response carry an encoding suffix
+    ("<etag>-gzip"), so those count as a match for the base tag too.
+    """
+    if etag is None:
+        return None
+
+    if request.if_none_match:
+        if request.if_none_match.star_tag:
+            matched = etag
+        else:
+            matched = next(
+                (tag for tag in request.if_none_match
+                 if tag == etag or tag.startswith(f"{etag}-")),
+                None
+            )
+        if matched is None:
+            return None
+    elif last_modified is not None and request.if_modified_since is not None:
+        if last_modified > request.if_modified_since:
+            return None
+        matched = etag
+    else:
+        return None
+
+    response = make_response("", 304)
+    response.set_etag(matched)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    return response
@@ -0,0 +1,244 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import hashlib
+import threading
+from functools import wraps
+from flask import request, make_response
+from app.utils.lazy import lazy_import
+from app.utils.image_store import upload_digest
+
+responses = lazy_import("starlette.responses")
+
+# Responses of mutating requests sent with an Idempotency-Key header are
+# kept for IDEMPOTENCY_TTL_SECONDS, so a client retrying after a timeout gets
+# the original response back instead of repeating the work (another vision
+# call, another receipt, duplicate ledger rows).
+#
+# Keys are scoped to the caller (Authorization header) and the route, and
+# live in a sqlite table shared by every worker process:
+#   key | fingerprint | status | body | content_type | created | locked_until
+# A row with a NULL status is a request still running; a retry arriving
+# meanwhile gets 409 and a Retry-After header. Rows of requests that died
+# are taken over once locked_until has passed.
+IDEMPOTENCY_DB = "storage/idempotency.sqlite3"
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", str(24 * 3600)))
+
+# Longest a request may hold its key before a retry can run it again
+LOCK_SECONDS = 300
+MAX_KEY_LENGTH = 255
+RETRY_AFTER_SECONDS = 2
+
+_local = threading.local()
+
+_stats_lock = threading.Lock()
+_stats = {"stored": 0, "replayed": 0, "conflicts": 0, "mismatches": 0}
+
+
+def _connection():
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "path", None) != IDEMPOTENCY_DB:
+        os.makedirs(os.path.dirname(IDEMPOTENCY_DB), exist_ok=True)
+        conn = sqlite3.connect(IDEMPOTENCY_DB, timeout=10, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, status INTEGER, body BLOB,"
+            " content_type TEXT, created REAL NOT NULL, locked_until REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS responses_created ON responses (created)")
+        _local.conn, _local.path = conn, IDEMPOTENCY_DB
+    return conn
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def _scoped_key(caller, method, path, key):
+    # The token is hashed in rather than stored
+    return hashlib.sha256(f"{caller}\0{method}\0{path}\0{key}".encode()).hexdigest()
+
+
+def _fingerprint(mimetype, get_body, get_form):
+    # JSON bodies must match on retry byte for byte. Uploads match on their
+    # form fields (instance_id) and the content hash of each file, which
+    # receipt images get while they are received (see ImageSpool)
+    if mimetype == "multipart/form-data":
+        fields, files = get_form()
+        payload = json.dumps({"fields": sorted(fields), "files": sorted(files)}, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+    return hashlib.sha256(get_body()).hexdigest()
+
+
+def _flask_form():
+    return (
+        list(request.form.items(multi=True)),
+        [(name, upload_digest(file.stream)) for name, file in request.files.items(multi=True)],
+    )
+
+
+async def _starlette_form(request):
+    fields, files = [], []
+    for name, value in (await request.form()).multi_items():
+        if isinstance(value, str):
+            fields.append((name, value))
+        else:
+            files.append((name, await asyncio.to_thread(upload_digest, value.file)))
+    return fields, files
+
+
+def _claim(key, fingerprint, now):
+    """
+    Take the key for this request, or return the stored row (status, body,
+    content_type, fingerprint) of the request that already holds it.
+    """
+    conn = _connection()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("DELETE FROM responses WHERE created < ?", (now - IDEMPOTENCY_TTL_SECONDS,))
+        row = conn.execute(
+            "SELECT status, body, content_type, fingerprint, locked_until FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is not None and (row[0] is not None or row[4] > now):
+            conn.execute("COMMIT")
+            return row[:4]
+        conn.execute(
+            "INSERT OR REPLACE INTO responses (key, fingerprint, status, body, content_type, created, locked_until)"
+            " VALUES (?, ?, NULL, NULL, NULL, ?, ?)",
+            (key, fingerprint, now, now + LOCK_SECONDS),
+        )
+        conn.execute("COMMIT")
+        return None
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def _store(key, status, body, content_type):
+    _connection().execute(
+        "UPDATE responses SET status = ?, body = ?, content_type = ? WHERE key = ?",
+        (status, body, content_type, key),
+    )
+    _count("stored")
+
+
+def _storable(status):
+    # Server errors and 429s are worth retrying for real
+    return status < 500 and status != 429
+
+
+def _answer(stored, fingerprint):
+    """
+    (status, body, content_type, headers) of a request whose key is taken.
+    """
+    status, body, content_type, stored_fingerprint = stored
+    if stored_fingerprint != fingerprint:
+        _count("mismatches")
+        error = "Idempotency-Key was already used with a different request body"
+        return 422, json.dumps({"error": error}).encode(), "application/json", {}
+    if status is None:
+        _count("conflicts")
+        error = "A request with this Idempotency-Key is in progress"
+        return 409, json.dumps({"error": error}).encode(), "application/json", {"Retry-After": str(RETRY_AFTER_SECONDS)}
+    _count("replayed")
+    return status, body, content_type, {"Idempotent-Replayed": "true"}
+
+
+def _release(key):
+    _connection().execute("DELETE FROM responses WHERE key = ? AND status IS NULL", (key,))
+
+
+def idempotent(view):
+    """
+    Route decorator replaying the stored response of a request retried with
+    the same Idempotency-Key. Requests without the header, and GETs, run as
+    usual. Server errors (5xx) and 429s are not stored, so they can be
+    retried.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get("Idempotency-Key")
+        if not key or request.method in ("GET", "HEAD", "OPTIONS"):
+            return view(*args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return {"error": f"Idempotency-Key longer than {MAX_KEY_LENGTH} characters"}, 400
+
+        key = _scoped_key(request.headers.get("Authorization", ""), request.method, request.path, key)
+        fingerprint = _fingerprint(request.mimetype, lambda: request.get_data(cache=True), _flask_form)
+        stored = _claim(key, fingerprint, time.time())
+        if stored is not None:
+            status, body, content_type, headers = _answer(stored, fingerprint)
+            response = make_response(body, status, headers)
+            response.content_type = content_type
+            return response
+
+        try:
+            response = make_response(view(*args, **kwargs))
+        except BaseException:
+            _release(key)
+            raise
+        if _storable(response.status_code) and not response.is_streamed:
+            _store(key, response.status_code, response.get_data(), response.content_type)
+        else:
+            _release(key)
+        return response
+
+    return wrapper
+
+
+def idempotent_async(handler):
+    """
+    idempotent for the ASGI endpoints: handler(request) is a coroutine
+    returning a starlette Response. The table is used from worker threads.
+    Body limits must be applied before, as the body is read here.
+    """
+    @wraps(handler)
+    async def wrapper(request):
+        key = request.headers.get("Idempotency-Key")
+        if not key or request.method in ("GET", "HEAD", "OPTIONS"):
+            return await handler(request)
+        if len(key) > MAX_KEY_LENGTH:
+            return responses.JSONResponse({"error": f"Idempotency-Key longer than {MAX_KEY_LENGTH} characters"}, 400)
+
+        key = _scoped_key(request.headers.get("Authorization", ""), request.method, request.url.path, key)
+        mimetype = request.headers.get("content-type", "").split(";")[0].strip()
+        if mimetype == "multipart/form-data":
+            # Parsed once here; the handler gets the same request and form
+            form = await _starlette_form(request)
+            fingerprint = _fingerprint(mimetype, None, lambda: form)
+        else:
+            body = await request.body()
+            fingerprint = _fingerprint(mimetype, lambda: body, None)
+        stored = await asyncio.to_thread(_claim, key, fingerprint, time.time())
+        if stored is not None:
+            status, body, content_type, headers = _answer(stored, fingerprint)
+            return responses.Response(body, status, {**headers, "Content-Type": content_type})
+
+        try:
+            response = await handler(request)
+        except BaseException:
+            await asyncio.to_thread(_release, key)
+            raise
+        if _storable(response.status_code) and hasattr(response, "body"):
+            await asyncio.to_thread(
+                _store, key, response.status_code, response.body, response.headers.get("content-type")
+            )
+        else:
+            await asyncio.to_thread(_release, key)
+        return response
+
+    return wrapper
+
+
+def idempotency_stats():
+    """
+    Counters of stored responses, replays, in-progress conflicts and keys
+    reused with a different body.
+    """
+    with _stats_lock:
+        return dict(_stats)
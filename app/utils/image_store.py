@@ -0,0 +1,411 @@
+from __future__ import annotations
+import os
+import glob
+import json
+import time
+import sqlite3
+import hashlib
+import tempfile
+import threading
+from app.utils.lazy import lazy_import
+
+Image = lazy_import("PIL.Image")
+
+# Receipt images are stored once per content under their sha256, sharded by
+# its first two byte pairs so no directory grows past a few thousand files:
+#   storage/receipts/images/ab/cd/abcd....jpg
+# A reference table maps each receipt to its image, so identical uploads
+# share one file and an image is deleted only once no receipt refers to it.
+# It lives in sqlite, shared by every worker process and the collector:
+#   receipts: receipt_id | sha | instance_id
+#   images:   sha | ext | refs
+# Uploads and the collector change it in IMMEDIATE transactions, so moving
+# a file into place and counting its reference cannot interleave with the
+# collector deleting it.
+IMAGES_DIR = "storage/receipts/images"
+THUMBS_DIR = "storage/receipts/thumbs"
+REFS_DB = "storage/receipts/image_refs.sqlite3"
+
+# JSON reference table of earlier versions, imported once
+LEGACY_REFS_FILE = "storage/receipts/image_refs.json"
+
+# Flat <receipt_id><ext> files written before the store existed
+LEGACY_DIR = "storage/receipts/uploads"
+
+THUMB_SIZE = 256
+COPY_CHUNK = 1 << 20
+
+# Leading bytes that tell the accepted formats apart
+SNIFF_BYTES = 12
+
+# Largest receipt image accepted. An upload request may be this plus the
+# multipart framing and form fields; larger bodies are refused before they
+# are read
+MAX_IMAGE_BYTES = int(os.getenv("RECEIPT_MAX_BYTES", str(10 << 20)))
+MAX_UPLOAD_BYTES = MAX_IMAGE_BYTES + (64 << 10)
+
+# Accepted image formats, told apart by their leading bytes
+IMAGE_TYPES = {".jpg": "image/jpeg", ".png": "image/png", ".gif": "image/gif", ".webp": "image/webp"}
+
+# Temp files of uploads still in progress are left alone by the collector
+TMP_GRACE_SECONDS = 3600
+
+_local = threading.local()
+
+
+class ImageTooLarge(ValueError):
+    pass
+
+
+def sniff_image_type(head: bytes):
+    """
+    Extension of the image format whose signature head starts with, or None.
+    """
+    if head.startswith(b"\xff\xd8\xff"):
+        return ".jpg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return ".png"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return ".gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return ".webp"
+    return None
+
+
+def image_mime(path):
+    """
+    MIME type of a stored image, from its content (legacy files were named
+    after whatever the client sent).
+    """
+    with open(path, "rb") as f:
+        ext = sniff_image_type(f.read(SNIFF_BYTES))
+    return IMAGE_TYPES.get(ext, "image/jpeg")
+
+
+def _shard(sha):
+    return os.path.join(sha[:2], sha[2:4])
+
+
+def object_path(sha, ext):
+    return os.path.join(IMAGES_DIR, _shard(sha), f"{sha}{ext}")
+
+
+def _connection():
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "path", None) != REFS_DB:
+        os.makedirs(os.path.dirname(REFS_DB), exist_ok=True)
+        # The collector holds the write lock while it deletes files
+        conn = sqlite3.connect(REFS_DB, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS images (sha TEXT PRIMARY KEY, ext TEXT NOT NULL, refs INTEGER NOT NULL)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS receipts ("
+            " receipt_id TEXT PRIMARY KEY, sha TEXT NOT NULL, instance_id TEXT NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS receipts_instance ON receipts (instance_id)")
+        _import_legacy_refs(conn)
+        _local.conn, _local.path = conn, REFS_DB
+    return conn
+
+
+def _import_legacy_refs(conn):
+    if not os.path.exists(LEGACY_REFS_FILE):
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Another worker may have imported it meanwhile
+        if os.path.exists(LEGACY_REFS_FILE):
+            with open(LEGACY_REFS_FILE) as f:
+                refs = json.load(f)
+            conn.executemany(
+                "INSERT OR IGNORE INTO images (sha, ext, refs) VALUES (?, ?, ?)",
+                [(sha, image["ext"], image["refs"]) for sha, image in refs["images"].items()],
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO receipts (receipt_id, sha, instance_id) VALUES (?, ?, ?)",
+                [(receipt_id, ref["sha"], ref["instance_id"]) for receipt_id, ref in refs["receipts"].items()],
+            )
+            os.remove(LEGACY_REFS_FILE)
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def _image_of(receipt_id):
+    """
+    (sha, ext) of a receipt's stored image, or None.
+    """
+    return _connection().execute(
+        "SELECT images.sha, images.ext FROM receipts JOIN images ON images.sha = receipts.sha"
+        " WHERE receipts.receipt_id = ?", (receipt_id,)
+    ).fetchone()
+
+
+class ImageSpool:
+    """
+    Writable container a receipt image is spooled into as the request body
+    is parsed (see UploadRequest): each chunk is sniffed, hashed and counted
+    as it is written, into a temp file in the store that put_image then
+    moves into place without another copy.
+
+    Once the image is found to be too large or not an image, the rest of
+    it is discarded unwritten and put_image raises the error. Closing the
+    spool removes its temp file unless put_image stored it.
+    """
+
+    def __init__(self, max_bytes=MAX_IMAGE_BYTES):
+        os.makedirs(IMAGES_DIR, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(dir=IMAGES_DIR, suffix=".tmp")
+        self._file = os.fdopen(fd, "w+b")
+        self._digest = hashlib.sha256()
+        self._head = b""
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.ext = None
+        self.error = None
+
+    def write(self, data):
+        if self.error is not None:
+            return len(data)
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            self._fail(ImageTooLarge(f"Image is larger than {self.max_bytes} bytes"))
+            return len(data)
+        if len(self._head) < SNIFF_BYTES:
+            self._head += bytes(data[:SNIFF_BYTES - len(self._head)])
+            if len(self._head) == SNIFF_BYTES:
+                self._sniff()
+        if self.error is None:
+            self._digest.update(data)
+            self._file.write(data)
+        return len(data)
+
+    def _sniff(self):
+        self.ext = sniff_image_type(self._head)
+        if self.ext is None:
+            self._fail(ValueError(f"Unsupported image format, expected one of {sorted(IMAGE_TYPES)}"))
+
+    def _fail(self, error):
+        self.error = error
+        self._file.truncate(0)
+
+    def finish(self):
+        """
+        (sha256, extension) of the complete image.
+
+        Raises:
+            ImageTooLarge, ValueError: As put_image.
+        """
+        if self.error is None and self.ext is None:
+            if not self._head:
+                self.error = ValueError("Empty image upload")
+            else:
+                self._sniff()
+        if self.error is not None:
+            raise self.error
+        self._file.flush()
+        return self._digest.hexdigest(), self.ext
+
+    @property
+    def received_digest(self):
+        """
+        sha256 and size of the bytes received so far, image or not.
+        """
+        return f"{self._digest.hexdigest()}:{self.size}"
+
+    def read(self, size=-1):
+        return self._file.read(size)
+
+    def seek(self, offset, whence=0):
+        return self._file.seek(offset, whence)
+
+    def tell(self):
+        return self._file.tell()
+
+    def close(self):
+        self._file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def upload_digest(stream) -> str:
+    """
+    Content hash of an uploaded file: an ImageSpool's, taken as it was
+    received, or else the sha256 of the stream, read through and rewound.
+    """
+    if isinstance(stream, ImageSpool):
+        return stream.received_digest
+    digest = hashlib.sha256()
+    stream.seek(0)
+    while chunk := stream.read(COPY_CHUNK):
+        digest.update(chunk)
+    stream.seek(0)
+    return digest.hexdigest()
+
+
+def _spool(stream, max_bytes):
+    spool = ImageSpool(max_bytes)
+    try:
+        while chunk := stream.read(COPY_CHUNK):
+            spool.write(chunk)
+            if spool.error is not None:
+                break
+    except BaseException:
+        spool.close()
+        raise
+    return spool
+
+
+def put_image(stream, receipt_id, instance_id, max_bytes=MAX_IMAGE_BYTES):
+    """
+    Store an uploaded image for a receipt.
+
+    stream is usually the ImageSpool the upload was received into, which is
+    stored as it is. Any other stream is spooled first, in one pass that
+    stops as soon as it is recognised as oversized or not an image.
+
+    An identical image already in the store is reused and only gains a
+    reference.
+
+    Returns:
+        str: Path of the stored image.
+
+    Raises:
+        ImageTooLarge: The image is larger than max_bytes.
+        ValueError: The upload is not a supported image.
+    """
+    spool = stream if isinstance(stream, ImageSpool) else _spool(stream, max_bytes)
+    try:
+        sha, ext = spool.finish()
+
+        conn = _connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT ext FROM images WHERE sha = ?", (sha,)).fetchone()
+            path = object_path(sha, row[0] if row else ext)
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(spool.path, path)
+            # A receipt stored again gives up its previous image
+            previous = conn.execute("SELECT sha FROM receipts WHERE receipt_id = ?", (receipt_id,)).fetchone()
+            if previous:
+                conn.execute("UPDATE images SET refs = refs - 1 WHERE sha = ?", previous)
+            conn.execute(
+                "INSERT INTO images (sha, ext, refs) VALUES (?, ?, 1)"
+                " ON CONFLICT (sha) DO UPDATE SET refs = refs + 1",
+                (sha, ext),
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO receipts (receipt_id, sha, instance_id) VALUES (?, ?, ?)",
+                (receipt_id, sha, instance_id),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return path
+    finally:
+        if spool is not stream:
+            spool.close()
+
+
+def image_path(receipt_id):
+    """
+    Path of a receipt's image, or None. Receipts uploaded before the store
+    existed resolve to their flat legacy file.
+    """
+    image = _image_of(receipt_id)
+    if image is not None:
+        return object_path(*image)
+    legacy = glob.glob(os.path.join(LEGACY_DIR, glob.escape(receipt_id) + ".*"))
+    return legacy[0] if legacy else None
+
+
+def thumbnail_path(receipt_id, size=THUMB_SIZE):
+    """
+    Path of a JPEG thumbnail (longest side size px) of a receipt's image,
+    rendered on first request and cached next to the other thumbnails.
+    """
+    source = image_path(receipt_id)
+    if source is None:
+        return None
+    # Keyed by the content address, so receipts sharing an image share thumbnails
+    image = _image_of(receipt_id)
+    key = image[0] if image else f"legacy-{receipt_id}"
+    path = os.path.join(THUMBS_DIR, key[:2], f"{key}_{size}.jpg")
+    if os.path.exists(path):
+        return path
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with Image.open(source) as img:
+        img.thumbnail((size, size))
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        img.convert("RGB").save(tmp_path, format="JPEG", quality=80)
+    os.replace(tmp_path, path)
+    return path
+
+
+def _remove_thumbnails(key):
+    for path in glob.glob(os.path.join(THUMBS_DIR, key[:2], f"{glob.escape(key)}_*.jpg")):
+        os.remove(path)
+
+
+def collect_garbage(live_instances, legacy_owners=None, now=None):
+    """
+    Reclaim the images of receipts whose workspace no longer exists.
+
+    Parameters:
+        live_instances (set): Ids of the workspaces that still exist.
+        legacy_owners (dict): receipt_id -> instance_id of legacy flat
+            uploads, which are removed when their workspace is gone.
+
+    Returns:
+        dict: Numbers of references dropped and files removed.
+    """
+    now = now or time.time()
+    stats = {"refs": 0, "images": 0, "legacy": 0, "tmp": 0}
+
+    conn = _connection()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        instances = [i for (i,) in conn.execute("SELECT DISTINCT instance_id FROM receipts")]
+        for instance_id in instances:
+            if instance_id in live_instances:
+                continue
+            dropped = conn.execute(
+                "SELECT sha, COUNT(*) FROM receipts WHERE instance_id = ? GROUP BY sha", (instance_id,)
+            ).fetchall()
+            conn.executemany("UPDATE images SET refs = refs - ? WHERE sha = ?", [(n, sha) for sha, n in dropped])
+            conn.execute("DELETE FROM receipts WHERE instance_id = ?", (instance_id,))
+            stats["refs"] += sum(n for _, n in dropped)
+
+        # Files go while the table is locked, so no upload can take a new
+        # reference to an image being deleted
+        for sha, ext in conn.execute("SELECT sha, ext FROM images WHERE refs <= 0").fetchall():
+            path = object_path(sha, ext)
+            if os.path.exists(path):
+                os.remove(path)
+            _remove_thumbnails(sha)
+            stats["images"] += 1
+        conn.execute("DELETE FROM images WHERE refs <= 0")
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+    for receipt_id, instance_id in (legacy_owners or {}).items():
+        if instance_id in live_instances:
+            continue
+        for path in glob.glob(os.path.join(LEGACY_DIR, glob.escape(receipt_id) + ".*")):
+            os.remove(path)
+            stats["legacy"] += 1
+        _remove_thumbnails(f"legacy-{receipt_id}")
+
+    # Leftovers of interrupted uploads
+    for path in glob.glob(os.path.join(IMAGES_DIR, "*.tmp")):
+        if now - os.path.getmtime(path) > TMP_GRACE_SECONDS:
+            os.remove(path)
+            stats["tmp"] += 1
+    return stats
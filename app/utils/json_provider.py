@@ -0,0 +1,139 @@
+import json
+import uuid
+import decimal
+import datetime
+from flask.json.provider import JSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class JSONFragment:
+    """
+    Already-encoded JSON that should be spliced into a response as-is.
+
+    Used for payloads that pandas can encode directly (``DataFrame.to_json``)
+    so we never build the intermediate list of dicts.
+    """
+
+    __slots__ = ("data",)
+
+    def __init__(self, data):
+        self.data = data.encode("utf-8") if isinstance(data, str) else data
+
+
+def frame_records(df) -> JSONFragment:
+    """
+    Encode a DataFrame as a JSON array of records in one pass.
+    """
+    return JSONFragment(df.to_json(orient="records", date_format="iso", force_ascii=False))
+
+
+def _convert(o):
+    # NumPy / pandas objects are detected by module so neither library has
+    # to be imported just to serialize a response.
+    module = type(o).__module__.split(".")[0]
+
+    if module == "numpy":
+        if hasattr(o, "tolist"):
+            return o.tolist()
+        return o.item()
+
+    if module == "pandas":
+        if o is None or str(o) in ("NaT", "<NA>"):
+            return None
+        if hasattr(o, "isoformat"):
+            return o.isoformat()
+        if hasattr(o, "to_dict") and hasattr(o, "columns"):
+            return o.to_dict(orient="records")
+        if hasattr(o, "tolist"):
+            return o.tolist()
+        return str(o)
+
+    if isinstance(o, (datetime.date, datetime.time)):
+        return o.isoformat()
+    if isinstance(o, (decimal.Decimal, uuid.UUID)):
+        return str(o)
+    if isinstance(o, (set, frozenset)):
+        return list(o)
+
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+def _fragments():
+    # Fragments are spliced natively by orjson >= 3.10. For older orjson
+    # and the stdlib encoder they become unique placeholders that are
+    # replaced after encoding.
+    native = orjson is not None and hasattr(orjson, "Fragment")
+    pending = {}
+
+    def default(o):
+        if isinstance(o, JSONFragment):
+            if native:
+                return orjson.Fragment(o.data)
+            token = f"__json_fragment_{len(pending)}_{id(o)}__"
+            pending[token] = o.data
+            return token
+        return _convert(o)
+
+    def splice(data: bytes) -> bytes:
+        for token, fragment in pending.items():
+            data = data.replace(f'"{token}"'.encode("utf-8"), fragment, 1)
+        return data
+
+    return default, splice
+
+
+def encode_json(obj, sort_keys=True, pretty=False) -> bytes:
+    """
+    Encode a response payload as the API does, outside of Flask too.
+    """
+    default, splice = _fragments()
+
+    if orjson is not None:
+        option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if pretty:
+            option |= orjson.OPT_INDENT_2
+        return splice(orjson.dumps(obj, default=default, option=option))
+
+    data = json.dumps(
+        obj,
+        default=default,
+        sort_keys=sort_keys,
+        ensure_ascii=False,
+        indent=2 if pretty else None,
+        separators=None if pretty else (",", ":"),
+    )
+    return splice(data.encode("utf-8"))
+
+
+class FastJSONProvider(JSONProvider):
+    """
+    JSON provider backed by orjson, with a standard library fallback.
+
+    Install on an app with ``app.json = FastJSONProvider(app)``.
+    """
+
+    sort_keys = True
+    compact = None
+    mimetype = "application/json"
+
+    def _encode(self, obj, pretty=False) -> bytes:
+        return encode_json(obj, sort_keys=self.sort_keys, pretty=pretty)
+
+    def dumps(self, obj, **kwargs) -> str:
+        return self._encode(obj, pretty=kwargs.get("indent") is not None).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        if orjson is not None:
+            return orjson.loads(s)
+        return json.loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        pretty = self.compact is False or (self.compact is None and self._app.debug)
+        return self._app.response_class(self._encode(obj, pretty=pretty), mimetype=self.mimetype)
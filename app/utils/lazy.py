@@ -0,0 +1,52 @@
+import sys
+import types
+import importlib
+import importlib.util
+
+
+class _LazyModule(types.ModuleType):
+    """
+    Stand-in for a module that imports it on first attribute access.
+
+    The import goes through importlib.import_module, whose per-module lock
+    makes threads racing on the first access wait for one complete import
+    (importlib.util.LazyLoader can hand them a half-executed module).
+    Functions, classes and submodules are copied onto the stand-in as they
+    are used, so later lookups cost the same as on the real module; data
+    attributes and assignments always go to the real module.
+    """
+
+    def __getattr__(self, attr):
+        value = getattr(importlib.import_module(self.__name__), attr)
+        if callable(value) or isinstance(value, types.ModuleType):
+            self.__dict__[attr] = value
+        return value
+
+    def __setattr__(self, attr, value):
+        setattr(importlib.import_module(self.__name__), attr, value)
+
+    def __dir__(self):
+        return dir(importlib.import_module(self.__name__))
+
+
+def lazy_import(name):
+    """
+    Return a module that is only really imported on first attribute access.
+
+    Lets heavy dependencies (pandas, numpy, openai) stay out of the startup
+    path while modules keep the usual ``pd = lazy_import("pandas")`` alias.
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+
+    if importlib.util.find_spec(name) is None:
+        raise ImportError(f"No module named '{name}'", name=name)
+    return _LazyModule(name)
+
+
+def is_available(name):
+    """
+    Whether an optional dependency is installed, without importing it.
+    """
+    return name in sys.modules or importlib.util.find_spec(name) is not None
@@ -0,0 +1,578 @@
+from __future__ import annotations
+import os
+import csv
+import sys
+import glob
+import json
+import logging
+from app.utils.lazy import lazy_import
+from app.utils.file_lock import file_lock
+from datetime import datetime, timezone
+
+pd = lazy_import("pandas")
+
+INSTANCES_DIR = "storage/instances"
+
+LEDGER_COLUMNS = ["date", "text", "amount", "category_id", "receipt_id", "vendor"]
+
+# Fixed dtypes keep every chunk of a ledger read on the same schema
+LEDGER_DTYPES = {
+    "date": "string",
+    "text": "string",
+    "amount": "float64",
+    "category_id": "Int64",
+    "receipt_id": "string",
+    "vendor": "string",
+}
+
+# In-memory schema of load_ledger: dates parsed once, the heavily repeated
+# text, receipt_id and vendor strings dictionary encoded, category ids as compact
+# nullable integers (no float64 + NaN round trip)
+LEDGER_SCHEMA = {
+    "date": "datetime64[ns]",
+    "text": "category",
+    "amount": "float64",
+    "category_id": "Int32",
+    "receipt_id": "category",
+    "vendor": "category",
+}
+
+LEDGER_CHUNK_ROWS = 50_000
+
+# Read as text and coerced (see coerce_amounts), so one malformed amount
+# loads as missing instead of failing every read of the ledger
+TEXT_READ_COLUMNS = ["date", "amount"]
+
+# Corrections are not written into the ledger CSV. Each one appends the new
+# values of the patched row to a small log, {"seq": row position, "fields":
+# {column: value}}, that every reader lays over the CSV. A full rewrite of
+# the ledger folds the log in and removes it.
+DELTAS_FILE = "deltas.jsonl"
+DELTA_FIELDS = ["text", "amount", "category_id"]
+
+# Patched rows past which the log is folded back into the CSV
+MAX_DELTA_ROWS = 5000
+
+# Category deletes, merges and renames are recorded per instance instead of
+# rewriting the ledger and categories.csv:
+#   {"remap": {old id: new id, or UNCATEGORIZED once deleted}, "names": {id: new name}}
+# remap is kept resolved (no target is itself remapped) and readers map ledger
+# category ids through it. Compaction folds the table into both files.
+CATEGORY_TABLE_FILE = "category_table.json"
+UNCATEGORIZED = 0
+
+logger = logging.getLogger(__name__)
+
+# instance_id -> (deltas file stamp, {seq: {column: value}})
+_deltas_cache = {}
+
+# instance_id -> (category table stamp, table)
+_category_table_cache = {}
+
+
+def ledger_path(instance_id):
+    return os.path.join(INSTANCES_DIR, f"{instance_id}.csv")
+
+
+def list_instances() -> list[str]:
+    """
+    Ids of all instances that have a ledger.
+    """
+    return sorted(
+        os.path.splitext(os.path.basename(path))[0]
+        for path in glob.glob(os.path.join(INSTANCES_DIR, "*.csv"))
+    )
+
+
+def instance_dir(instance_id):
+    """
+    Directory holding the derived files (indexes, counters) of an instance.
+    """
+    return os.path.join(INSTANCES_DIR, instance_id)
+
+
+def instance_lock(instance_id):
+    """
+    Lock serialising writes to one instance's ledger and the files derived
+    from it, across threads and processes (server workers and the CLIs).
+    """
+    return file_lock(ledger_path(instance_id))
+
+
+def deltas_path(instance_id):
+    return os.path.join(instance_dir(instance_id), DELTAS_FILE)
+
+
+def category_table_path(instance_id):
+    return os.path.join(instance_dir(instance_id), CATEGORY_TABLE_FILE)
+
+
+def _stamp(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return f"{st.st_mtime_ns:x}-{st.st_size:x}"
+
+
+def data_version(instance_id):
+    """
+    Version stamp of the rows of an instance ledger: the ledger file and its
+    correction log, not the category table.
+
+    Keys the derived files indexing rows by position (sorted ledger, text,
+    receipt and vendor indexes), which category deletes, merges and renames
+    leave valid. Returns None if the ledger does not exist.
+    """
+    version = _stamp(ledger_path(instance_id))
+    if version is None:
+        return None
+    deltas = _stamp(deltas_path(instance_id))
+    if deltas:
+        version = f"{version}-d{deltas}"
+    return version
+
+
+def ledger_version(instance_id):
+    """
+    Cheap version stamp of an instance ledger.
+
+    Changes whenever the ledger file, its correction log or its category
+    table is written, so it can key caches and HTTP validators without
+    reading the data. Returns None if the ledger does not exist.
+    """
+    version = data_version(instance_id)
+    if version is None:
+        return None
+    table = _stamp(category_table_path(instance_id))
+    if table:
+        version = f"{version}-c{table}"
+    return version
+
+
+def ledger_modified(instance_id):
+    """
+    Last modification time of the ledger as an aware UTC datetime.
+    """
+    try:
+        mtime = os.path.getmtime(ledger_path(instance_id))
+    except FileNotFoundError:
+        return None
+    for path in (deltas_path(instance_id), category_table_path(instance_id)):
+        if os.path.exists(path):
+            mtime = max(mtime, os.path.getmtime(path))
+    return datetime.fromtimestamp(int(mtime), tz=timezone.utc)
+
+
+def load_deltas(instance_id) -> dict:
+    """
+    Current corrections of an instance as {seq: {column: value}}, later
+    corrections of a field overriding earlier ones.
+    """
+    path = deltas_path(instance_id)
+    stamp = _stamp(path)
+    if stamp is None:
+        return {}
+    cached = _deltas_cache.get(instance_id)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+
+    deltas = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                deltas.setdefault(entry["seq"], {}).update(entry["fields"])
+    _deltas_cache[instance_id] = (stamp, deltas)
+    return deltas
+
+
+def append_deltas(instance_id, patches):
+    """
+    Record corrections, [(seq, {column: value})], in one append.
+    """
+    path = deltas_path(instance_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write("".join(
+            json.dumps({"seq": int(seq), "fields": fields}, ensure_ascii=False) + "\n"
+            for seq, fields in patches
+        ))
+
+
+def apply_deltas(df: pd.DataFrame, deltas: dict) -> pd.DataFrame:
+    """
+    Lay corrections over ledger rows whose index labels are their seq.
+    """
+    for field in DELTA_FIELDS:
+        if not deltas or field not in df.columns:
+            continue
+        patch = {seq: fields[field] for seq, fields in deltas.items() if field in fields}
+        seqs = [seq for seq in patch if seq in df.index]
+        if not seqs:
+            continue
+        values = [patch[seq] for seq in seqs]
+        column = df[field].copy()
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            new = pd.Index(values).dropna().unique().difference(column.cat.categories)
+            column = column.cat.add_categories(new)
+        column.loc[seqs] = values
+        df[field] = column
+    return df
+
+
+def load_category_table(instance_id) -> dict:
+    """
+    Category table of an instance, {"remap": {int: int}, "names": {int: str}}.
+    """
+    path = category_table_path(instance_id)
+    stamp = _stamp(path)
+    if stamp is None:
+        return {"remap": {}, "names": {}}
+    cached = _category_table_cache.get(instance_id)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+
+    with open(path, encoding="utf-8") as f:
+        raw = json.load(f)
+    table = {
+        "remap": {int(k): int(v) for k, v in raw.get("remap", {}).items()},
+        "names": {int(k): v for k, v in raw.get("names", {}).items()},
+    }
+    _category_table_cache[instance_id] = (stamp, table)
+    return table
+
+
+def save_category_table(instance_id, table):
+    path = category_table_path(instance_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(table, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def remap_categories(category_ids: pd.Series, remap: dict) -> pd.Series:
+    """
+    Map ledger category ids through a category table remap.
+    """
+    if not remap:
+        return category_ids
+    return category_ids.replace(remap)
+
+
+def coerce_amounts(amounts) -> pd.Series:
+    """
+    Amounts as float64, anything non-numeric ("$4.50", "") as NaN.
+    """
+    return pd.to_numeric(amounts, errors="coerce").astype("float64")
+
+
+def _inferred_bytes(df: pd.DataFrame) -> int:
+    """
+    Estimated size of df as plain read_csv inference would load it: object
+    strings for date/text/receipt_id and float64 category ids.
+    """
+    total = df.index.memory_usage()
+    for column in df.columns:
+        series = df[column]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            sizes = pd.Series([sys.getsizeof(v) for v in series.cat.categories], dtype="int64")
+            counts = series.cat.codes.value_counts()
+            counts = counts[counts.index >= 0]
+            total += 8 * len(series) + int((sizes.reindex(counts.index).to_numpy() * counts.to_numpy()).sum())
+        elif column == "date":
+            # Pointer plus a "YYYY-MM-DD" str object per row
+            total += len(series) * (8 + sys.getsizeof("2024-01-01"))
+        else:
+            total += 8 * len(series)
+    return int(total)
+
+
+def load_ledger(instance_id, columns=None, parse_dates=True, categorical=True) -> pd.DataFrame:
+    """
+    Load an instance ledger with the explicit LEDGER_SCHEMA.
+
+    Parameters:
+        columns (list[str]): Columns to read, all by default. Others are never parsed.
+        parse_dates (bool): Parse date into datetime64 (unparseable dates become NaT).
+            Writers that save the frame back pass False to keep dates verbatim.
+        categorical (bool): Dictionary-encode text, receipt_id and vendor. Writers
+            that assign new strings pass False to get plain string columns.
+
+    Columns a ledger predates (written before they were added) load as missing values.
+
+    The memory used and the estimated footprint of default inference are
+    kept in df.attrs["memory"] and logged at debug level.
+    """
+    columns = [c for c in LEDGER_COLUMNS if c in columns] if columns else LEDGER_COLUMNS
+    schema = LEDGER_SCHEMA if categorical else LEDGER_DTYPES
+    # Dates and amounts are read as strings and converted in one vectorized pass below
+    dtypes = {c: "string" if c in TEXT_READ_COLUMNS else schema[c] for c in columns}
+    if "category_id" in dtypes:
+        dtypes["category_id"] = LEDGER_SCHEMA["category_id"]
+
+    present = ledger_columns(instance_id)
+    df = pd.read_csv(
+        ledger_path(instance_id),
+        usecols=[c for c in columns if c in present],
+        dtype={c: v for c, v in dtypes.items() if c in present}
+    )
+    for column in columns:
+        if column not in present:
+            df[column] = pd.Series(pd.NA, index=df.index, dtype=dtypes[column])
+    if "amount" in df.columns:
+        df["amount"] = coerce_amounts(df["amount"])
+    df = apply_deltas(df[columns], load_deltas(instance_id))
+    if "category_id" in df.columns:
+        df["category_id"] = remap_categories(df["category_id"], load_category_table(instance_id)["remap"])
+    if parse_dates and "date" in df.columns:
+        df["date"] = pd.to_datetime(df["date"], errors="coerce")
+
+    used = int(df.memory_usage(deep=True).sum())
+    baseline = _inferred_bytes(df)
+    df.attrs["memory"] = {"bytes": used, "inferred_bytes": baseline, "saved_bytes": baseline - used}
+    logger.debug(
+        "Loaded ledger %s: %d rows, %d columns, %.1f KiB (%.1f KiB saved vs. inferred dtypes)",
+        instance_id, len(df), len(df.columns), used / 1024, (baseline - used) / 1024
+    )
+    return df
+
+
+def iter_ledger_chunks(instance_id, chunksize=LEDGER_CHUNK_ROWS, usecols=None):
+    """
+    Read an instance ledger in fixed-size chunks, so memory stays flat
+    whatever the ledger size. Corrections and category remaps are applied
+    to each chunk.
+    """
+    deltas = load_deltas(instance_id)
+    remap = load_category_table(instance_id)["remap"]
+    with pd.read_csv(
+        ledger_path(instance_id),
+        dtype={**LEDGER_DTYPES, "amount": "string"},
+        usecols=usecols,
+        chunksize=chunksize
+    ) as reader:
+        for chunk in reader:
+            if "amount" in chunk.columns:
+                chunk["amount"] = coerce_amounts(chunk["amount"])
+            chunk = apply_deltas(chunk, deltas)
+            if "category_id" in chunk.columns:
+                chunk["category_id"] = remap_categories(chunk["category_id"], remap)
+            yield chunk
+
+
+def ledger_columns(instance_id) -> list[str]:
+    """
+    Columns in the header of an instance ledger.
+    """
+    with open(ledger_path(instance_id), newline="", encoding="utf-8") as f:
+        return next(csv.reader(f), [])
+
+
+def write_ledger(instance_id, df: pd.DataFrame):
+    """
+    Atomically replace an instance ledger with df and drop the correction
+    log, which df (loaded with corrections applied) already contains.
+    """
+    with instance_lock(instance_id):
+        path = ledger_path(instance_id)
+        tmp_path = f"{path}.tmp"
+        df.to_csv(tmp_path, index=False)
+        os.replace(tmp_path, path)
+        if os.path.exists(deltas_path(instance_id)):
+            os.remove(deltas_path(instance_id))
+
+
+def compact_deltas(instance_id, max_rows=MAX_DELTA_ROWS):
+    """
+    Fold the correction log into the ledger CSV once it patches more than
+    max_rows rows. Derived files go stale and are rebuilt by their readers.
+    """
+    with instance_lock(instance_id):
+        if len(load_deltas(instance_id)) <= max_rows:
+            return False
+        write_ledger(instance_id, load_ledger(instance_id, parse_dates=False, categorical=False))
+        return True
+
+
+def upgrade_ledger(instance_id):
+    """
+    Rewrite a ledger written before some of LEDGER_COLUMNS existed so it has
+    all of them, the new ones empty. Rows keep their order and values.
+    """
+    with instance_lock(instance_id):
+        if ledger_columns(instance_id) == LEDGER_COLUMNS:
+            return False
+        write_ledger(instance_id, load_ledger(instance_id, parse_dates=False, categorical=False))
+        return True
+
+
+def append_rows(instance_id, rows: pd.DataFrame):
+    """
+    Append rows to an instance ledger, creating it if needed.
+
+    A ledger with an older header is upgraded first. Columns missing from
+    rows are written empty, amounts that are not numbers too.
+    """
+    path = ledger_path(instance_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    file_exists = os.path.exists(path)
+    if file_exists:
+        upgrade_ledger(instance_id)
+    rows = rows.reindex(columns=LEDGER_COLUMNS)
+    rows["amount"] = coerce_amounts(rows["amount"])
+    rows.to_csv(path, mode='a', header=not file_exists, index=False)
+
+
+def normalize_dates(dates: pd.Series) -> pd.Series:
+    """
+    Ledger dates as the ISO strings the derived files key rows by. They sort
+    chronologically; unparseable dates become "" and sort first.
+    """
+    return pd.to_datetime(dates, errors="coerce").dt.strftime("%Y-%m-%d").fillna("")
+
+
+class DerivedFile:
+    """
+    Per-instance JSON file derived from the ledger, {"version": ..., ...},
+    kept in memory once read.
+
+    version is the ledger version the data reflects, as given by the
+    version function (ledger_version, or data_version for files that do not
+    depend on categories). Writers that update the data along with the
+    ledger carry it to the new version; any other write leaves it stale and
+    the next reader rebuilds it from the ledger.
+
+    Given replay(instance_id, data, change), updates are not saved by
+    rewriting the file but appended to a log next to it (name.jsonl), one
+    {"from": version, "version": version, "change": change} per line, that
+    readers replay over the snapshot. Once the log outgrows the snapshot it
+    is folded into a new one, so an update costs time proportional to the
+    change.
+    """
+
+    def __init__(self, name, replay=None, version=ledger_version):
+        self.name = name
+        self.replay = replay
+        self.version = version
+        # instance_id -> [data, snapshot (mtime, size), bytes of the log replayed]
+        self._cache = {}
+
+    def path(self, instance_id):
+        return os.path.join(instance_dir(instance_id), self.name)
+
+    def log_path(self, instance_id):
+        return f"{os.path.splitext(self.path(instance_id))[0]}.jsonl"
+
+    def cached(self, instance_id):
+        """
+        Data as last written, whatever its version, or None.
+        """
+        try:
+            st = os.stat(self.path(instance_id))
+        except FileNotFoundError:
+            self._cache.pop(instance_id, None)
+            return None
+        stamp = (st.st_mtime_ns, st.st_size)
+        entry = self._cache.get(instance_id)
+        if entry is None or entry[1] != stamp:
+            with open(self.path(instance_id)) as f:
+                entry = self._cache[instance_id] = [json.load(f), stamp, 0]
+        if self.replay is not None:
+            self._catch_up(instance_id, entry)
+        return entry[0]
+
+    def _catch_up(self, instance_id, entry):
+        # Replay log lines written since the last look. Each applies to the
+        # version it was logged from only, so a log left over from before
+        # the snapshot, or read twice, changes nothing.
+        data = entry[0]
+        try:
+            with open(self.log_path(instance_id), "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                if size < entry[2]:
+                    entry[2] = 0
+                f.seek(entry[2])
+                chunk = f.read(size - entry[2])
+        except FileNotFoundError:
+            entry[2] = 0
+            return
+        chunk = chunk[:chunk.rfind(b"\n") + 1]
+        for line in chunk.splitlines():
+            logged = json.loads(line)
+            if logged["from"] == data["version"]:
+                if "change" in logged:
+                    self.replay(instance_id, data, logged["change"])
+                data["version"] = logged["version"]
+        entry[2] += len(chunk)
+
+    def current(self, instance_id, version):
+        """
+        Data if it reflects the given version, else None.
+        """
+        data = self.cached(instance_id)
+        return data if data is not None and data["version"] == version else None
+
+    def load(self, instance_id, build):
+        """
+        Current data, rebuilt with build(instance_id) if stale or missing.
+        """
+        data = self.current(instance_id, self.version(instance_id))
+        return data if data is not None else build(instance_id)
+
+    def save(self, instance_id, data):
+        """
+        Write data as the new snapshot, folding in and removing the log.
+        """
+        path = self.path(instance_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+        if self.replay is not None and os.path.exists(self.log_path(instance_id)):
+            os.remove(self.log_path(instance_id))
+        st = os.stat(path)
+        self._cache[instance_id] = [data, (st.st_mtime_ns, st.st_size), 0]
+
+    def update(self, instance_id, previous_version, version, change=None):
+        """
+        Apply change (replayed files only) to data that reflected
+        previous_version and stamp it with version, the one the write
+        making the change left. Callers hold instance_lock across that
+        write and the update, so version covers no other writer's change.
+
+        Returns:
+            bool: Whether the data was current and updated.
+        """
+        with instance_lock(instance_id):
+            data = self.current(instance_id, previous_version)
+            if data is None:
+                return False
+            if self.replay is None:
+                data["version"] = version
+                self.save(instance_id, data)
+                return True
+
+            logged = {"from": previous_version, "version": version}
+            if change is not None:
+                self.replay(instance_id, data, change)
+                logged["change"] = change
+            data["version"] = version
+            line = (json.dumps(logged, ensure_ascii=False) + "\n").encode("utf-8")
+            with open(self.log_path(instance_id), "ab") as f:
+                f.write(line)
+                log_size = f.tell()
+            entry = self._cache[instance_id]
+            entry[2] = log_size
+            if log_size > entry[1][1]:
+                self.save(instance_id, data)
+            return True
+
+    def carry_over(self, instance_id, previous_version, version):
+        """
+        Stamp data that reflected previous_version with version, after a
+        write it is not affected by.
+        """
+        self.update(instance_id, previous_version, version)
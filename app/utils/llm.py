@@ -0,0 +1,387 @@
+import os
+import math
+import uuid
+import sqlite3
+import asyncio
+import time
+import heapq
+import itertools
+import threading
+from contextlib import contextmanager, asynccontextmanager
+from app.utils.lazy import lazy_import
+from app.utils import llm_cassette
+
+openai = lazy_import("openai")
+
+LLM_MODEL = "gpt-4o"
+
+# Admission control in front of the model calls, so one tenant bulk
+# uploading receipts or flooding the chat cannot take every worker and the
+# whole OpenAI rate limit:
+# - each instance draws from its own token bucket (LLM_RATE_PER_MINUTE,
+#   bursts of LLM_BURST); an empty bucket is refused at once with the time
+#   until it refills;
+# - at most LLM_MAX_CONCURRENT calls run at a time. Callers over the cap
+#   wait in a weighted fair queue: each request starts at the later of the
+#   current virtual time and its instance's previous finish tag, finishes
+#   cost later, and freed slots go to the smallest finish tag, so a tenant
+#   with a long backlog cannot starve the others.
+#   Waiting is bounded by LLM_QUEUE_TIMEOUT and LLM_MAX_QUEUED per instance.
+#
+# The buckets and the running calls live in a sqlite table shared by every
+# worker process, so the limits hold for the server as a whole:
+#   buckets: instance_id | tokens | updated
+#   slots:   lease | expires
+# A running call holds a slot lease; leases of workers that died lapse after
+# LLM_SLOT_LEASE_SECONDS. The fair queue is per process: a worker hands the
+# slots its own calls free to its queue at once, and its waiters poll every
+# LLM_QUEUE_POLL_SECONDS for slots freed by other workers.
+LLM_MAX_CONCURRENT = int(os.getenv("LLM_MAX_CONCURRENT", "8"))
+LLM_RATE_PER_MINUTE = float(os.getenv("LLM_RATE_PER_MINUTE", "20"))
+LLM_BURST = float(os.getenv("LLM_BURST", "10"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "10"))
+LLM_MAX_QUEUED = int(os.getenv("LLM_MAX_QUEUED", "4"))
+LLM_SLOT_LEASE_SECONDS = float(os.getenv("LLM_SLOT_LEASE_SECONDS", "300"))
+LLM_QUEUE_POLL_SECONDS = 0.05
+LLM_ADMISSION_DB = "storage/llm_admission.sqlite3"
+
+# Relative cost of a call, in tokens and queue time: a receipt (vision) call
+# takes several times longer than a chat turn
+CHAT_COST = 1
+ADVICE_COST = 1
+RECEIPT_COST = 2
+
+
+class LLMBusy(Exception):
+    """
+    A model call was refused by admission control; retry after retry_after
+    seconds.
+    """
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+_local = threading.local()
+
+
+def _connection():
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "path", None) != LLM_ADMISSION_DB:
+        os.makedirs(os.path.dirname(LLM_ADMISSION_DB), exist_ok=True)
+        conn = sqlite3.connect(LLM_ADMISSION_DB, timeout=10, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets ("
+            " instance_id TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+        )
+        conn.execute("CREATE TABLE IF NOT EXISTS slots (lease TEXT PRIMARY KEY, expires REAL NOT NULL)")
+        _local.conn, _local.path = conn, LLM_ADMISSION_DB
+    return conn
+
+
+@contextmanager
+def _transaction():
+    conn = _connection()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+def _take_tokens(instance_id, cost):
+    # Seconds until the bucket holds cost tokens, or None once taken
+    rate = LLM_RATE_PER_MINUTE / 60
+    now = time.time()
+    with _transaction() as conn:
+        row = conn.execute(
+            "SELECT tokens, updated FROM buckets WHERE instance_id = ?", (str(instance_id),)
+        ).fetchone()
+        tokens = LLM_BURST if row is None else min(LLM_BURST, row[0] + max(0.0, now - row[1]) * rate)
+        if tokens < cost:
+            return (cost - tokens) / rate
+        conn.execute(
+            "INSERT OR REPLACE INTO buckets (instance_id, tokens, updated) VALUES (?, ?, ?)",
+            (str(instance_id), tokens - cost, now)
+        )
+    return None
+
+
+def _refund_tokens(instance_id, cost):
+    with _transaction() as conn:
+        conn.execute(
+            "UPDATE buckets SET tokens = MIN(?, tokens + ?) WHERE instance_id = ?",
+            (LLM_BURST, cost, str(instance_id))
+        )
+
+
+def _take_slot():
+    # A new slot lease, or None when LLM_MAX_CONCURRENT calls are running
+    now = time.time()
+    with _transaction() as conn:
+        conn.execute("DELETE FROM slots WHERE expires < ?", (now,))
+        (running,) = conn.execute("SELECT COUNT(*) FROM slots").fetchone()
+        if running >= LLM_MAX_CONCURRENT:
+            return None
+        lease = uuid.uuid4().hex
+        conn.execute("INSERT INTO slots (lease, expires) VALUES (?, ?)", (lease, now + LLM_SLOT_LEASE_SECONDS))
+    return lease
+
+
+def _free_slot(lease):
+    _connection().execute("DELETE FROM slots WHERE lease = ?", (lease,))
+
+
+def _running_everywhere():
+    return _connection().execute("SELECT COUNT(*) FROM slots WHERE expires >= ?", (time.time(),)).fetchone()[0]
+
+
+class _Admission:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.finish_tags = {}    # instance_id -> virtual finish tag of its last request
+        self.queued = {}         # instance_id -> requests waiting
+        self.waiting = []        # heap of [finish tag, seq, instance_id, wake, start tag, lease]
+        self.seq = itertools.count()
+        self.virtual_time = 0.0
+        self.running = 0
+        self.stats = {"admitted": 0, "queued": 0, "rate_limited": 0, "queue_full": 0, "timed_out": 0}
+
+    def _enqueue(self, instance_id, cost, wake):
+        """
+        Admit a request or queue it. Returns its entry, whose wake (entry[3])
+        is cleared and lease (entry[5]) set once it holds a slot; wake() is
+        called when a slot is handed to a queued request.
+        """
+        with self.lock:
+            if self.queued.get(instance_id, 0) >= LLM_MAX_QUEUED:
+                self.stats["queue_full"] += 1
+                raise LLMBusy("Too many LLM requests queued for this workspace", LLM_QUEUE_TIMEOUT)
+            refill = _take_tokens(instance_id, cost)
+            if refill is not None:
+                self.stats["rate_limited"] += 1
+                raise LLMBusy("LLM rate limit reached for this workspace", refill)
+
+            start = max(self.virtual_time, self.finish_tags.get(instance_id, 0.0))
+            self.finish_tags[instance_id] = start + cost
+            entry = [start + cost, next(self.seq), instance_id, wake, start, None]
+            lease = None if self.waiting else _take_slot()
+            if lease is not None:
+                entry[3], entry[5] = None, lease
+                self.running += 1
+                self.virtual_time = start
+                self.stats["admitted"] += 1
+                return entry
+            heapq.heappush(self.waiting, entry)
+            self.queued[instance_id] = self.queued.get(instance_id, 0) + 1
+            self.stats["queued"] += 1
+            return entry
+
+    def _give_up(self, entry, cost):
+        """
+        Withdraw a queued request. False if a slot was handed to it
+        meanwhile, in which case the caller holds it.
+        """
+        with self.lock:
+            instance_id = entry[2]
+            if entry[3] is None:
+                return False
+            entry[2] = None
+            self._dequeued(instance_id)
+            self.stats["timed_out"] += 1
+        # No call was made, so the tokens go back
+        _refund_tokens(instance_id, cost)
+        return True
+
+    def _hand_over(self):
+        # Free slots go to the queued requests in finish tag order
+        with self.lock:
+            while self.waiting:
+                entry = self.waiting[0]
+                _, _, instance_id, wake, start, _ = entry
+                if instance_id is None:
+                    heapq.heappop(self.waiting)
+                    continue  # gave up waiting
+                lease = _take_slot()
+                if lease is None:
+                    return
+                heapq.heappop(self.waiting)
+                entry[3], entry[5] = None, lease
+                self._dequeued(instance_id)
+                self.virtual_time = max(self.virtual_time, start)
+                self.running += 1
+                self.stats["admitted"] += 1
+                wake()
+
+    def acquire(self, instance_id, cost):
+        """
+        Wait for a slot; returns its lease, for release().
+        """
+        granted = threading.Event()
+        entry = self._enqueue(instance_id, cost, granted.set)
+        deadline = time.monotonic() + LLM_QUEUE_TIMEOUT
+        while entry[3] is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                if self._give_up(entry, cost):
+                    raise LLMBusy("LLM capacity exhausted, try again shortly", LLM_QUEUE_TIMEOUT)
+                break
+            if not granted.wait(min(LLM_QUEUE_POLL_SECONDS, remaining)):
+                self._hand_over()
+        return entry[5]
+
+    async def acquire_async(self, instance_id, cost):
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(None))
+
+        # The shared state is in sqlite, whose locks must not stall the loop
+        entry = await asyncio.to_thread(self._enqueue, instance_id, cost, wake)
+        deadline = loop.time() + LLM_QUEUE_TIMEOUT
+        try:
+            while entry[3] is not None:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    if await asyncio.to_thread(self._give_up, entry, cost):
+                        raise LLMBusy("LLM capacity exhausted, try again shortly", LLM_QUEUE_TIMEOUT)
+                    break
+                try:
+                    await asyncio.wait_for(asyncio.shield(granted), min(LLM_QUEUE_POLL_SECONDS, remaining))
+                except asyncio.TimeoutError:
+                    await asyncio.to_thread(self._hand_over)
+        except asyncio.CancelledError:
+            # A slot handed over as the caller went away is passed on
+            if not self._give_up(entry, cost):
+                self.release(entry[5])
+            raise
+        return entry[5]
+
+    def _dequeued(self, instance_id):
+        self.queued[instance_id] -= 1
+        if not self.queued[instance_id]:
+            del self.queued[instance_id]
+
+    def release(self, lease):
+        _free_slot(lease)
+        with self.lock:
+            self.running -= 1
+        self._hand_over()
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                **self.stats,
+                "running": self.running,
+                "running_all_workers": _running_everywhere(),
+                "waiting": sum(self.queued.values()),
+                "max_concurrent": LLM_MAX_CONCURRENT,
+            }
+
+
+_admission = _Admission()
+
+
+@contextmanager
+def llm_admission(instance_id, cost=CHAT_COST):
+    """
+    Hold one of the LLM call slots for the body of the with block.
+
+    Raises:
+        LLMBusy: The instance is over its rate, has too many requests
+            queued, or no slot freed up within LLM_QUEUE_TIMEOUT.
+    """
+    lease = _admission.acquire(instance_id, cost)
+    try:
+        yield
+    finally:
+        _admission.release(lease)
+
+
+@asynccontextmanager
+async def async_llm_admission(instance_id, cost=CHAT_COST):
+    """
+    llm_admission for coroutines: waiting for a slot does not block the
+    event loop.
+    """
+    lease = await _admission.acquire_async(instance_id, cost)
+    try:
+        yield
+    finally:
+        await asyncio.to_thread(_admission.release, lease)
+
+
+def admission_stats():
+    """
+    Admission counters, the calls running and queued in this worker and the
+    calls running in all of them.
+    """
+    return _admission.snapshot()
+
+
+def _client_messages(messages):
+    # The client JSON-encodes the request, so image data URLs kept as bytes
+    # so far (see image_to_base64) are decoded here, once, for it
+    return llm_cassette.map_image_urls(
+        messages, lambda url: url if isinstance(url, str) else str(url, "ascii")
+    )
+
+
+def chat_completion(messages, model=LLM_MODEL, purpose=None):
+    """
+    Send a chat completion request and return the reply text.
+
+    The OpenAI client is imported and configured on the first call. purpose
+    ("receipt", "advice", "chat") labels the call in cassettes.
+    """
+    if llm_cassette.LLM_CASSETTE_MODE == "replay":
+        call = llm_cassette.replay(messages, model, purpose)
+        time.sleep(llm_cassette.replay_delay(call))
+        return call["response"]
+
+    if openai.api_key is None:
+        openai.api_key = os.getenv("OPENAI_API_KEY")
+
+    start = time.perf_counter()
+    response = openai.chat.completions.create(
+        model=model,
+        messages=_client_messages(messages)
+    )
+    content = response.choices[0].message.content
+    if llm_cassette.LLM_CASSETTE_MODE == "record":
+        llm_cassette.record(messages, model, purpose, content, time.perf_counter() - start)
+    return content
+
+
+_async_client = None
+
+
+async def achat_completion(messages, model=LLM_MODEL, purpose=None):
+    """
+    chat_completion on the async OpenAI client, for the ASGI endpoints: the
+    call is awaited instead of holding a thread.
+    """
+    global _async_client
+    if llm_cassette.LLM_CASSETTE_MODE == "replay":
+        call = llm_cassette.replay(messages, model, purpose)
+        await asyncio.sleep(llm_cassette.replay_delay(call))
+        return call["response"]
+
+    if _async_client is None:
+        _async_client = openai.AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+    start = time.perf_counter()
+    response = await _async_client.chat.completions.create(
+        model=model,
+        messages=_client_messages(messages)
+    )
+    content = response.choices[0].message.content
+    if llm_cassette.LLM_CASSETTE_MODE == "record":
+        llm_cassette.record(messages, model, purpose, content, time.perf_counter() - start)
+    return content
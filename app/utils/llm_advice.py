@@ -1,14 +1,9 @@
-import openai
-import os
 import json
-from dotenv import load_dotenv
+import asyncio
 from app.services.reports import instance_report
+from app.utils.llm import chat_completion, achat_completion
 
-load_dotenv()
-openai.api_key = os.getenv("OPENAI_API_KEY")
-
-# Pass instance ID and optional focus to get suggestions
-def llm_advice(id: str, focus: str = None):
+def advice_messages(id: str, focus: str = None):
     report_data = instance_report(id)
     report_json = json.dumps(report_data, indent=2)
 
@@ -37,18 +32,19 @@ Input JSON:
 Return only a valid JSON object with a "suggestions" field. No commentary, no explanation, no code blocks.
 '''
 
+    return [
+        {
+            "role": "user",
+            "content": [{"type": "text", "text": prompt}],
+        }
+    ]
+
+
+# Pass instance ID and optional focus to get suggestions
+def llm_advice(id: str, focus: str = None):
+    messages = advice_messages(id, focus)
     try:
-        response = openai.chat.completions.create(
-            model='gpt-4o',
-            messages=[
-                {
-                    "role": "user",
-                    "content": [{"type": "text", "text": prompt}],
-                }
-            ]
-        )
-
-        response_text = response.choices[0].message.content.strip()
+        response_text = chat_completion(messages, purpose="advice").strip()
 
         # Parse and return just the JSON
         parsed = json.loads(response_text)
@@ -60,3 +56,18 @@ Return only a valid JSON object with a "suggestions" field. No commentary, no ex
     except Exception as e:
         print(f"OpenAI error: {str(e)}")
         return {"error": "LLM request failed"}
+
+
+async def llm_advice_async(id: str, focus: str = None):
+    # The report is built from the ledger files in a worker thread
+    messages = await asyncio.to_thread(advice_messages, id, focus)
+    try:
+        response_text = (await achat_completion(messages, purpose="advice")).strip()
+        return json.loads(response_text)
+
+    except json.JSONDecodeError:
+        print("Failed to parse JSON from model response")
+        return {"error": "Invalid response format"}
+    except Exception as e:
+        print(f"OpenAI error: {str(e)}")
+        return {"error": "LLM request failed"}
@@ -0,0 +1,190 @@
+import os
+import json
+import hashlib
+import threading
+from datetime import datetime, timezone
+
+# Record/replay of model calls. In record mode every call made through
+# chat_completion is appended to a cassette; in replay mode calls are
+# answered from it without touching the network, after the recorded latency
+# or none. That makes a slow or wrong parse reproducible and lets the
+# ingestion and insights pipelines run offline and deterministically.
+#
+# A cassette is a JSONL file, one call per line:
+#   {"fingerprint", "purpose", "model", "latency", "response", "recorded_at",
+#    "messages"}
+# The fingerprint is the sha256 of the model and messages. Stored messages
+# have their images replaced by the image's sha256, so cassettes stay small.
+#
+# Replay matches on the fingerprint. Prompts embedding data that differs
+# between runs (instance ids, today's budgets) never match; with
+# LLM_CASSETTE_MATCH=sequence such calls get the purpose's next recording in
+# recorded order instead.
+LLM_CASSETTE_MODE = os.getenv("LLM_CASSETTE_MODE", "off")              # off | record | replay
+LLM_CASSETTE_DIR = os.getenv("LLM_CASSETTE_DIR", "storage/cassettes")
+LLM_CASSETTE = os.getenv("LLM_CASSETTE", "default")
+LLM_CASSETTE_MATCH = os.getenv("LLM_CASSETTE_MATCH", "exact")          # exact | sequence
+LLM_REPLAY_LATENCY = os.getenv("LLM_REPLAY_LATENCY", "original")       # original | zero
+
+CASSETTE_MODES = ("off", "record", "replay")
+
+_lock = threading.Lock()
+
+# (path, stamp) -> (by fingerprint, by purpose)
+_cache = {}
+
+# Replay cursors: (path, fingerprint or purpose) -> calls served
+_cursors = {}
+
+_stats = {"recorded": 0, "replayed": 0, "sequence_matches": 0, "misses": 0}
+
+
+class CassetteMiss(LookupError):
+    pass
+
+
+def cassette_path(name=None):
+    return os.path.join(LLM_CASSETTE_DIR, f"{name or LLM_CASSETTE}.jsonl")
+
+
+def map_image_urls(messages, fn):
+    # Messages with the url of every image part replaced by fn(url)
+    def part(p):
+        if isinstance(p, dict) and p.get("type") == "image_url":
+            return {**p, "image_url": {**p["image_url"], "url": fn(p["image_url"]["url"])}}
+        return p
+
+    return [
+        {**m, "content": [part(p) for p in m["content"]]} if isinstance(m.get("content"), list) else m
+        for m in messages
+    ]
+
+
+def _url_bytes(url):
+    return url.encode("ascii") if isinstance(url, str) else url
+
+
+def fingerprint(messages, model) -> str:
+    """
+    Content hash of a model request: the sha256 of its JSON encoding.
+
+    Image data URLs may be str or bytes. They are hashed in place of a
+    placeholder rather than copied into the encoded payload, which is
+    the same as encoding them as strings (base64 needs no escaping).
+    """
+    urls = []
+
+    def placeholder(url):
+        urls.append(url)
+        return f"\0image{len(urls) - 1}\0"
+
+    payload = json.dumps(
+        {"model": model, "messages": map_image_urls(messages, placeholder)}, sort_keys=True, separators=(",", ":")
+    )
+    digest = hashlib.sha256()
+    for i, url in enumerate(urls):
+        head, payload = payload.split(json.dumps(f"\0image{i}\0"), 1)
+        digest.update(head.encode("utf-8"))
+        digest.update(b'"')
+        digest.update(_url_bytes(url))
+        digest.update(b'"')
+    digest.update(payload.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _redacted(messages):
+    # data: URLs of images are replaced by a hash of their content
+    return map_image_urls(messages, lambda url: f"sha256:{hashlib.sha256(_url_bytes(url)).hexdigest()}")
+
+
+def _load(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return {}, {}
+    key = (path, (st.st_mtime_ns, st.st_size))
+    if key not in _cache:
+        by_fingerprint, by_purpose = {}, {}
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                call = json.loads(line)
+                by_fingerprint.setdefault(call["fingerprint"], []).append(call)
+                by_purpose.setdefault(call.get("purpose"), []).append(call)
+        # Only the current version of a cassette is kept
+        for stale in [k for k in _cache if k[0] == path]:
+            del _cache[stale]
+        _cache[key] = (by_fingerprint, by_purpose)
+    return _cache[key]
+
+
+def _next(path, key, calls):
+    # Repeated identical calls get the recordings in order, then the last one
+    cursor = _cursors.get((path, key), 0)
+    _cursors[(path, key)] = cursor + 1
+    return calls[min(cursor, len(calls) - 1)]
+
+
+def replay(messages, model, purpose=None):
+    """
+    Recorded call answering this request, as a dict with "response" and
+    "latency".
+
+    Raises:
+        CassetteMiss: Nothing in the cassette matches.
+    """
+    path, key = cassette_path(), fingerprint(messages, model)
+    with _lock:
+        by_fingerprint, by_purpose = _load(path)
+        calls = by_fingerprint.get(key)
+        if calls:
+            _stats["replayed"] += 1
+            return _next(path, key, calls)
+        calls = by_purpose.get(purpose)
+        if LLM_CASSETTE_MATCH == "sequence" and calls:
+            _stats["replayed"] += 1
+            _stats["sequence_matches"] += 1
+            return _next(path, ("purpose", purpose), calls)
+        _stats["misses"] += 1
+    raise CassetteMiss(f"No recorded {purpose or 'LLM'} call matches this request in {path}")
+
+
+def replay_delay(call) -> float:
+    return call["latency"] if LLM_REPLAY_LATENCY == "original" else 0.0
+
+
+def record(messages, model, purpose, response, latency):
+    """
+    Append a call to the cassette.
+    """
+    call = {
+        "fingerprint": fingerprint(messages, model),
+        "purpose": purpose,
+        "model": model,
+        "latency": round(latency, 4),
+        "response": response,
+        "recorded_at": datetime.now(timezone.utc).isoformat(),
+        "messages": _redacted(messages),
+    }
+    line = json.dumps(call, ensure_ascii=False) + "\n"
+    path = cassette_path()
+    with _lock:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # One write per line on an O_APPEND file: safe across workers
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(line)
+        _stats["recorded"] += 1
+
+
+def reset_cursors():
+    """
+    Replay the cassette from its first recordings again.
+    """
+    with _lock:
+        _cursors.clear()
+
+
+def cassette_stats():
+    with _lock:
+        return {"mode": LLM_CASSETTE_MODE, "cassette": LLM_CASSETTE, **_stats}
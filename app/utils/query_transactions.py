@@ -1,58 +1,148 @@
-import pandas as pd
 import os
 import csv
+import bisect
+from app.utils.ledger import ledger_path, load_category_table
+from app.utils.sorted_ledger import load_sorted_index, scan_sorted, fetch_rows, encode_cursor, decode_cursor
+from app.utils.text_index import search as search_index
+
+TRANSACTION_FIELDS = ["date", "text", "amount", "category", "category_id", "receipt_id"]
+DEFAULT_FIELDS = ["date", "text", "amount", "category"]
 
 
 def get_category_map(instance_id, csv_path="storage/categories.csv"):
+    """
+    Active categories of an instance as {id: name}, with the deletes, merges
+    and renames of its category table applied.
+    """
     category_map = {}
+    table = load_category_table(instance_id)
 
     with open(csv_path, mode='r', encoding='utf-8') as file:
         reader = csv.DictReader(file)
         for row in reader:
             if row['instance_id'] == instance_id:
                 category_id = int(row['id'])
-                category_name = row['name']
+                if category_id in table["remap"]:
+                    continue
+                category_name = table["names"].get(category_id, row['name'])
                 category_map[category_id] = category_name
 
     return category_map
 
 
-def query_transactions(instance_id, date=None, category_id=None, offset=0, limit=50):
-    csv_path = f"storage/instances/{instance_id}.csv"
+def _search_keys(instance_id, search, lower, upper, order):
+    """
+    Sort keys of the rows matching a search, in page order and within the
+    exclusive (date, seq) bounds.
+
+    Date orders use (date, seq); relevance uses (-score, date, seq) so the
+    best matches come first and ties stay in date order.
+    """
+    keys = []
+    for seq, (date, score) in search_index(instance_id, search).items():
+        if lower and (date, seq) <= lower[-2:]:
+            continue
+        if upper and (date, seq) >= upper[-2:]:
+            continue
+        keys.append((-score, date, seq) if order == "relevance" else (date, seq))
+    return sorted(keys, reverse=(order == "desc"))
+
+
+def _fetch_in_order(instance_id, keys, limit):
+    # Resolve sort keys to rows a page-sized batch at a time, so filters that
+    # reject rows only cost another batch rather than the whole result set
+    for batch_start in range(0, len(keys), limit):
+        batch = keys[batch_start:batch_start + limit]
+        found = fetch_rows(instance_id, [key[-2:] for key in batch])
+        for key in batch:
+            row = found.get(key[-2:])
+            if row is not None:
+                yield key, row
+
+
+def query_transactions(instance_id, start=None, end=None, category_ids=None, min_amount=None,
+                       max_amount=None, text=None, fields=None, cursor=None, limit=50, order="asc",
+                       search=None):
+    """
+    Return one page of transactions ordered by date, filtered and projected.
 
-    if not os.path.exists(csv_path):
+    start/end are inclusive "YYYY-MM-DD" strings and bound the scan of the
+    date-sorted ledger; the remaining predicates are applied while reading.
+    search looks rows up in the text index instead of scanning, and may be
+    ordered by "relevance" as well as by date.
+    Pass the returned next_cursor back to get the following page.
+    """
+    if not os.path.exists(ledger_path(instance_id)):
         return {"error": f"CSV not found for instance_id: {instance_id}"}, 404
 
-    # Get category_id -> name mapping
-    categories = get_category_map(instance_id)
+    fields = fields or DEFAULT_FIELDS
+    unknown = [f for f in fields if f not in TRANSACTION_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {unknown}")
+    if order not in (("asc", "desc", "relevance") if search else ("asc", "desc")):
+        raise ValueError("order must be 'asc' or 'desc' ('relevance' with search)")
+    limit = max(1, int(limit))
 
-    # Load the CSV into a DataFrame
-    df = pd.read_csv(csv_path)
+    # Get category_id -> name mapping
+    categories = get_category_map(instance_id) if "category" in fields else {}
+    category_ids = set(category_ids) if category_ids else None
+    needle = text.casefold() if text else None
 
-    # Apply filters
-    if date:
-        df = df[df['date'] == date]
+    # Date bounds become exclusive (date, seq) keys around the whole day range
+    lower = (start, -1) if start else None
+    upper = (end, float("inf")) if end else None
 
-    if category_id is not None:
-        df = df[df['category_id'] == category_id]
+    after = None
+    if cursor:
+        key, cursor_order = decode_cursor(cursor)
+        if cursor_order != order:
+            raise ValueError("Cursor does not match the requested order")
+        if order == "relevance":
+            after = key
+        elif order == "asc":
+            lower = max(lower, key) if lower else key
+        else:
+            upper = min(upper, key) if upper else key
 
-    total_rows = len(df)
+    def matches(row):
+        if category_ids is not None and row["category_id"] not in category_ids:
+            return False
+        if min_amount is not None and (row["amount"] is None or row["amount"] < min_amount):
+            return False
+        if max_amount is not None and (row["amount"] is None or row["amount"] > max_amount):
+            return False
+        if needle and needle not in row["text"].casefold():
+            return False
+        return True
 
-    # Apply pagination
-    paginated_df = df.iloc[offset:offset + limit]
+    if search:
+        keys = _search_keys(instance_id, search, lower, upper, order)
+        if after is not None:
+            keys = keys[bisect.bisect_right(keys, after):]
+        candidates = _fetch_in_order(instance_id, keys, limit)
+    else:
+        candidates = (
+            ((row["date"], row["seq"]), row)
+            for row in scan_sorted(instance_id, lower, upper, descending=(order == "desc"))
+        )
 
-    # Format response and map category_id to category name
     rows = []
-    for _, row in paginated_df.iterrows():
-        category_name = categories.get(row['category_id'], "Unknown")
-        rows.append({
-            "date": row["date"],
-            "text": row["text"],
-            "amount": row["amount"],
-            "category": category_name
-        })
+    last_key = None
+    for key, row in candidates:
+        if not matches(row):
+            continue
+
+        row["category"] = categories.get(row["category_id"], "Unknown")
+        rows.append({field: row[field] for field in fields})
+        last_key = list(key)
+        if len(rows) == limit:
+            break
+
+    filtered = any(v is not None for v in (start, end, category_ids, min_amount, max_amount, needle, search))
 
     return {
         "rows": rows,
-        "total_rows": total_rows
+        "next_cursor": encode_cursor(last_key, order) if len(rows) == limit else None,
+        "total_rows": None if filtered else load_sorted_index(instance_id)["rows"]
     }
+
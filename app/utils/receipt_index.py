@@ -0,0 +1,74 @@
+from __future__ import annotations
+from app.utils.lazy import lazy_import
+from app.utils.ledger import DerivedFile, load_ledger, data_version, normalize_dates, instance_lock
+
+pd = lazy_import("pandas")
+
+# Ledger rows of each receipt, so a correction finds them without a scan:
+#   {"version": ..., "size": ledger rows, "rows": {receipt_id: [[date, seq], ...]}}
+# Rows are listed in ledger order, which is the order of the receipt's items,
+# so a fix's "line" is a position in the list. [date, seq] is the row's key
+# in the sorted ledger. Ingest is logged as changes next to it (see
+# DerivedFile) rather than rewriting it.
+INDEX_FILE = "receipt_rows.json"
+
+
+def _add(rows, receipt_ids, dates, start):
+    for seq, (receipt_id, date) in enumerate(zip(receipt_ids, dates), start):
+        if isinstance(receipt_id, str):
+            rows.setdefault(receipt_id, []).append([date, seq])
+
+
+def _replay(instance_id, index, change):
+    # {"append": [[receipt_id, date], ...]} for rows taking the next seq numbers
+    appended = change["append"]
+    _add(index["rows"], [r for r, _ in appended], [d for _, d in appended], index["size"])
+    index["size"] += len(appended)
+
+
+_file = DerivedFile(INDEX_FILE, replay=_replay, version=data_version)
+
+
+def build_receipt_index(instance_id):
+    """
+    Rebuild the receipt row index of an instance from its ledger.
+    """
+    with instance_lock(instance_id):
+        version = data_version(instance_id)
+        df = load_ledger(instance_id, ["date", "receipt_id"])
+        rows = {}
+        _add(rows, df["receipt_id"].astype(object).where(df["receipt_id"].notna()).tolist(),
+             normalize_dates(df["date"]).tolist(), 0)
+        index = {"version": version, "rows": rows, "size": len(df)}
+        _file.save(instance_id, index)
+        return index
+
+
+def load_receipt_index(instance_id):
+    """
+    Return the receipt row index of an instance, rebuilding it if stale.
+    """
+    return _file.load(instance_id, build_receipt_index)
+
+
+def receipt_rows(instance_id, receipt_id) -> list[tuple[str, int]]:
+    """
+    (date, seq) keys of a receipt's ledger rows in item order.
+    """
+    return [tuple(key) for key in load_receipt_index(instance_id)["rows"].get(receipt_id, [])]
+
+
+def on_append(instance_id, rows: pd.DataFrame, previous_version, version):
+    """
+    Register freshly appended ledger rows, which take the next seq numbers.
+    """
+    receipt_ids = rows["receipt_id"].astype(object).where(rows["receipt_id"].notna(), None).tolist()
+    change = {"append": [list(row) for row in zip(receipt_ids, normalize_dates(rows["date"]).tolist())]}
+    _file.update(instance_id, previous_version, version, change)
+
+
+def on_patch(instance_id, previous_version, version):
+    """
+    Carry the index over a correction, which never moves rows between receipts.
+    """
+    _file.carry_over(instance_id, previous_version, version)
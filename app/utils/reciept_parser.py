@@ -1,20 +1,35 @@
-import openai
 import os
 import base64
-import pandas as pd
-from dotenv import load_dotenv
+import asyncio
 import json
+from app.utils.llm import chat_completion, achat_completion
+from app.utils.query_transactions import get_category_map
+from app.utils.image_store import image_mime
 
-load_dotenv()
-openai.api_key = os.getenv('OPENAI_API_KEY')
+# Bytes encoded per step; a multiple of 3 so the pieces join without padding
+B64_CHUNK = 3 << 16
 
 
 def image_to_base64(image_path):
-    mime = image_path.split('.')[-1].lower()
+    # The data URL is encoded chunk by chunk straight into one buffer of its
+    # final size, so the raw image is never held whole next to its encoding.
+    # It stays bytes: the cassettes hash it as is and only the OpenAI client,
+    # which JSON-encodes the request itself, gets it decoded
+    prefix = f"data:{image_mime(image_path)};base64,".encode("ascii")
+    size = os.path.getsize(image_path)
+    url = bytearray(len(prefix) + 4 * ((size + 2) // 3))
+    url[:len(prefix)] = prefix
+    pos = len(prefix)
+    chunk = bytearray(B64_CHUNK)
+    view = memoryview(chunk)
     with open(image_path, "rb") as img_file:
-        encoded_bytes = base64.b64encode(img_file.read())
-        encoded_str = encoded_bytes.decode("utf-8")
-        return f"data:image/{mime};base64,{encoded_str}"
+        while n := img_file.readinto(chunk):
+            encoded = base64.b64encode(view[:n])
+            url[pos:pos + len(encoded)] = encoded
+            pos += len(encoded)
+    # Shorter only if the file changed underneath
+    del url[pos:]
+    return url
 
 
 def get_categories(instance_id):
@@ -22,27 +37,29 @@ def get_categories(instance_id):
     if not os.path.exists(path):
         return []
 
-    df = pd.read_csv(path)
-    df = df.dropna(subset=['id', 'name'])
+    # Active categories of the instance, deleted and merged ones left out
+    return [
+        {"id": category_id, "name": name}
+        for category_id, name in get_category_map(instance_id, path).items()
+        if isinstance(name, str) and name
+    ]
 
-    # Filter categories by instance_id
-    df = df[df['instance_id'] == instance_id]
-    return df.to_dict(orient='records')
 
-
-def reciept_parser(img_id, instance_id):
+def receipt_messages(image_path, instance_id):
+    """
+    Chat messages asking the model to parse a receipt image, or an error
+    dict if the image cannot be read.
+    """
     try:
         categories = get_categories(instance_id)
         category_list = "\n".join([f"- {cat['id']}: {cat['name']}" for cat in categories])
 
-        path = f"storage/receipts/uploads/{img_id}"
-        
         # Check if image file exists
-        if not os.path.exists(path):
-            print(f"Error: Image file not found at {path}")
-            return {"error": f"Image file not found: {img_id}"}
+        if not image_path or not os.path.exists(image_path):
+            print(f"Error: Image file not found at {image_path}")
+            return {"error": f"Image file not found: {image_path}"}
         
-        base64_url = image_to_base64(path)
+        base64_url = image_to_base64(image_path)
         
     except Exception as e:
         print(f"Error in image processing: {str(e)}")
@@ -75,21 +92,22 @@ def reciept_parser(img_id, instance_id):
     }}
     """
 
-    try:
-        response = openai.chat.completions.create(
-            model='gpt-4o',
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt},
-                        {"type": "image_url", "image_url": {"url": base64_url}}
-                    ]
-                }
+    return [
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": prompt},
+                {"type": "image_url", "image_url": {"url": base64_url}}
             ]
-        )
+        }
+    ]
 
-        response_text = response.choices[0].message.content
+
+def parse_receipt_reply(response_text):
+    """
+    Parsed receipt from the model's reply, or an error dict.
+    """
+    try:
         print(f"OpenAI Response: {response_text[:200]}...")  # Debug log
         
         # Clean up response text - remove markdown code blocks if present
@@ -131,4 +149,30 @@ def reciept_parser(img_id, instance_id):
             
     except Exception as e:
         print(f"OpenAI API error: {str(e)}")
-        return {"error": f"AI processing failed: {str(e)}"}
\ No newline at end of file
+        return {"error": f"AI processing failed: {str(e)}"}
+
+
+def reciept_parser(image_path, instance_id):
+    messages = receipt_messages(image_path, instance_id)
+    if isinstance(messages, dict):
+        return messages
+    try:
+        response_text = chat_completion(messages, purpose="receipt")
+    except Exception as e:
+        print(f"OpenAI API error: {str(e)}")
+        return {"error": f"AI processing failed: {str(e)}"}
+    return parse_receipt_reply(response_text)
+
+
+async def reciept_parser_async(image_path, instance_id):
+    # Reading the categories and encoding the image are file I/O, kept off
+    # the event loop
+    messages = await asyncio.to_thread(receipt_messages, image_path, instance_id)
+    if isinstance(messages, dict):
+        return messages
+    try:
+        response_text = await achat_completion(messages, purpose="receipt")
+    except Exception as e:
+        print(f"OpenAI API error: {str(e)}")
+        return {"error": f"AI processing failed: {str(e)}"}
+    return parse_receipt_reply(response_text)
\ No newline at end of file
@@ -1,14 +1,16 @@
-import os
 import uuid
+from app.utils.image_store import put_image
 
-RECEIPT_DIR = "storage/receipts/uploads"
-os.makedirs(RECEIPT_DIR, exist_ok=True)
 
+def save_receipt_image(file, instance_id=None):
+    """
+    Store an uploaded receipt image in the content-addressed image store
+    under a new receipt id. Returns (receipt_id, path of the stored image).
 
-def save_receipt_image(file):
+    The format comes from the content, not the client's file name. file is
+    a werkzeug FileStorage (Flask) or a starlette UploadFile (ASGI).
+    """
     receipt_id = str(uuid.uuid4())
-    ext = os.path.splitext(file.filename)[1] or ".jpg"
-    filename = f"{receipt_id}{ext}"
-    path = os.path.join(RECEIPT_DIR, filename)
-    file.save(path)
-    return receipt_id, path
\ No newline at end of file
+    stream = file.stream if hasattr(file, "stream") else file.file
+    path = put_image(stream, receipt_id, instance_id)
+    return receipt_id, path
@@ -0,0 +1,146 @@
+import time
+import asyncio
+import threading
+from app.utils.ledger import ledger_version
+
+# In-process request coalescing: concurrent callers asking for the same
+# (endpoint, key) share one computation instead of each running it. Only
+# calls that overlap in time are merged; nothing is cached afterwards.
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+_lock = threading.Lock()
+_calls = {}
+
+# endpoint -> {"executions", "coalesced", "errors", "busy_seconds", "saved_seconds"}
+_stats = {}
+
+
+def _endpoint_stats(endpoint):
+    return _stats.setdefault(endpoint, {
+        "executions": 0,
+        "coalesced": 0,
+        "errors": 0,
+        "busy_seconds": 0.0,
+        "saved_seconds": 0.0,
+    })
+
+
+def coalesce(endpoint, key, fn):
+    """
+    Return fn(), sharing one call among concurrent callers with the same
+    endpoint and key.
+
+    key must be hashable and cover everything the result depends on
+    (instance, params, data version). Exceptions raised by fn reach every
+    caller that waited for it.
+    """
+    flight = (endpoint, key)
+    with _lock:
+        call = _calls.get(flight)
+        leader = call is None
+        if leader:
+            call = _calls[flight] = _Call()
+        else:
+            call.waiters += 1
+
+    if not leader:
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    start = time.perf_counter()
+    try:
+        call.result = fn()
+    except BaseException as e:
+        call.error = e
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        with _lock:
+            del _calls[flight]
+            stats = _endpoint_stats(endpoint)
+            stats["executions"] += 1
+            stats["coalesced"] += call.waiters
+            stats["errors"] += call.error is not None
+            stats["busy_seconds"] += elapsed
+            # Every follower would have paid for its own computation
+            stats["saved_seconds"] += elapsed * call.waiters
+        call.done.set()
+    return call.result
+
+
+# Coalesced coroutines of the ASGI endpoints, which all run on one event
+# loop: (endpoint, key) -> [task, waiters]
+_async_calls = {}
+
+
+async def coalesce_async(endpoint, key, fn):
+    """
+    coalesce for coroutines: concurrent awaiters with the same endpoint and
+    key share one run of fn(), without blocking the event loop.
+    """
+    flight = (endpoint, key)
+    call = _async_calls.get(flight)
+    if call is not None:
+        call[1] += 1
+        # A follower going away must not cancel the shared run
+        return await asyncio.shield(call[0])
+
+    start = time.perf_counter()
+    call = _async_calls[flight] = [asyncio.ensure_future(fn()), 0]
+    failed = False
+    try:
+        return await asyncio.shield(call[0])
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        del _async_calls[flight]
+        with _lock:
+            stats = _endpoint_stats(endpoint)
+            stats["executions"] += 1
+            stats["coalesced"] += call[1]
+            stats["errors"] += failed
+            stats["busy_seconds"] += elapsed
+            stats["saved_seconds"] += elapsed * call[1]
+
+
+def request_key(instance_id, args=None, *extra):
+    """
+    Coalescing key of a request on an instance: the ledger version, the
+    query params (order-insensitive) and any extra hashable values.
+    """
+    params = tuple(sorted((k, tuple(args.getlist(k))) for k in args)) if args else ()
+    return (instance_id, ledger_version(instance_id), params, *extra)
+
+
+def coalescing_stats():
+    """
+    Per-endpoint coalescing counters, with the share of requests that were
+    served by another request's computation.
+    """
+    with _lock:
+        result = {}
+        for endpoint, stats in _stats.items():
+            requests = stats["executions"] + stats["coalesced"]
+            result[endpoint] = {
+                **stats,
+                "busy_seconds": round(stats["busy_seconds"], 3),
+                "saved_seconds": round(stats["saved_seconds"], 3),
+                "requests": requests,
+                "coalesced_ratio": round(stats["coalesced"] / requests, 4) if requests else 0.0,
+                "in_flight": sum(1 for e, _ in (*_calls, *_async_calls) if e == endpoint),
+            }
+        return result
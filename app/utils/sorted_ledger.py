@@ -0,0 +1,250 @@
+from __future__ import annotations
+import io
+import os
+import csv
+import json
+import base64
+import bisect
+from app.utils.lazy import lazy_import
+from app.utils.ledger import (
+    DerivedFile, load_ledger, load_deltas, load_category_table, data_version, normalize_dates,
+    instance_dir, instance_lock
+)
+
+pd = lazy_import("pandas")
+
+# A copy of the ledger sorted by (date, seq), where seq is the row's position
+# in the ledger CSV, plus a sparse index holding the key and byte offset of
+# every BLOCK_ROWS-th row. A page seeks straight to its first block and reads
+# forward, so it costs time proportional to the page, not the ledger.
+# Corrections never move a row (dates are not patched), so they and category
+# remaps are laid over the rows as they are read instead of rewriting the copy.
+SORTED_FILE = "sorted.csv"
+BLOCK_ROWS = 256
+
+SORTED_COLUMNS = ["seq", "date", "text", "amount", "category_id", "receipt_id"]
+
+_index_file = DerivedFile("sorted_index.json", version=data_version)
+
+
+def _sorted_path(instance_id):
+    return os.path.join(instance_dir(instance_id), SORTED_FILE)
+
+
+def _encode_rows(df: pd.DataFrame) -> bytes:
+    return df[SORTED_COLUMNS].to_csv(header=False, index=False, lineterminator="\n").encode("utf-8")
+
+
+def build_sorted_ledger(instance_id):
+    """
+    Rebuild the sorted copy and sparse index of an instance ledger.
+    """
+    with instance_lock(instance_id):
+        version = data_version(instance_id)
+        df = load_ledger(instance_id)
+        df.insert(0, "seq", range(len(df)))
+        df["date"] = normalize_dates(df["date"])
+        df = df.sort_values("date", kind="stable")
+
+        sorted_path = _sorted_path(instance_id)
+        os.makedirs(os.path.dirname(sorted_path), exist_ok=True)
+
+        keys, offsets = [], []
+        offset = 0
+        tmp_path = f"{sorted_path}.tmp"
+        with open(tmp_path, "wb") as f:
+            for start in range(0, len(df), BLOCK_ROWS):
+                block = df.iloc[start:start + BLOCK_ROWS]
+                keys.append([block["date"].iat[0], int(block["seq"].iat[0])])
+                offsets.append(offset)
+                data = _encode_rows(block)
+                f.write(data)
+                offset += len(data)
+        os.replace(tmp_path, sorted_path)
+
+        index = {
+            "version": version,
+            "rows": len(df),
+            "tail_rows": len(df) - BLOCK_ROWS * (len(keys) - 1) if keys else 0,
+            "keys": keys,
+            "offsets": offsets,
+            "end": offset,
+            # Key of the last row, which appends must not sort before
+            "last": [df["date"].iat[-1], int(df["seq"].iat[-1])] if len(df) else None,
+        }
+        _index_file.save(instance_id, index)
+        return index
+
+
+def load_sorted_index(instance_id):
+    """
+    Return the sparse index of an instance, rebuilding it if the ledger changed.
+    """
+    return _index_file.load(instance_id, build_sorted_ledger)
+
+
+def on_append(instance_id, rows: pd.DataFrame, previous_version, version):
+    """
+    Extend the sorted copy after rows were appended to the ledger.
+
+    Rows dated on or after the current last row are appended in place. Any
+    other case is left stale and rebuilt by the next reader.
+    """
+    with instance_lock(instance_id):
+        index = _index_file.current(instance_id, previous_version)
+        # Indexes written before "last" was kept are rebuilt too
+        if index is None or "last" not in index:
+            return
+
+        rows = rows.assign(date=normalize_dates(rows["date"])).sort_values("date", kind="stable")
+        last = index["last"]
+        if rows.empty or rows["date"].iat[0] == "" or (last and rows["date"].iat[0] < last[0]):
+            return
+
+        rows.insert(0, "seq", range(index["rows"], index["rows"] + len(rows)))
+
+        sorted_path = _sorted_path(instance_id)
+        offset = index["end"]
+        with open(sorted_path, "ab") as f:
+            for row in rows[SORTED_COLUMNS].astype(object).where(rows[SORTED_COLUMNS].notna(), "").itertuples(index=False):
+                if not index["keys"] or index["tail_rows"] == BLOCK_ROWS:
+                    index["keys"].append([row.date, int(row.seq)])
+                    index["offsets"].append(offset)
+                    index["tail_rows"] = 0
+                buffer = io.StringIO()
+                csv.writer(buffer, lineterminator="\n").writerow(row)
+                data = buffer.getvalue().encode("utf-8")
+                f.write(data)
+                offset += len(data)
+                index["tail_rows"] += 1
+
+        index["rows"] += len(rows)
+        index["end"] = offset
+        index["last"] = [rows["date"].iat[-1], int(rows["seq"].iat[-1])]
+        index["version"] = version
+        _index_file.save(instance_id, index)
+
+
+def on_patch(instance_id, previous_version, version):
+    """
+    Carry the index over a correction, which readers apply on the fly.
+    """
+    _index_file.carry_over(instance_id, previous_version, version)
+
+
+def encode_cursor(key, order):
+    payload = json.dumps({"k": key, "o": order}, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(payload).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    """
+    Decode an opaque page cursor into (key, order).
+
+    key is (date, seq), or (score, date, seq) for relevance-ordered pages.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded))
+        *score, date, seq = payload["k"]
+        if len(score) > 1:
+            raise ValueError
+        return (*map(float, score), str(date), int(seq)), payload["o"]
+    except (ValueError, KeyError, TypeError):
+        raise ValueError("Invalid cursor")
+
+
+def _amount(value):
+    # Ledgers written before amounts were coerced at ingest may hold text
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+def _read_block(f, index, block, deltas, remap):
+    start = index["offsets"][block]
+    end = index["offsets"][block + 1] if block + 1 < len(index["offsets"]) else index["end"]
+    f.seek(start)
+    text = f.read(end - start).decode("utf-8")
+    for seq, date, rtext, amount, category_id, receipt_id in csv.reader(io.StringIO(text, newline="")):
+        row = {
+            "seq": int(seq),
+            "date": date,
+            "text": rtext,
+            "amount": _amount(amount),
+            "category_id": int(category_id) if category_id else None,
+            "receipt_id": receipt_id,
+        }
+        if row["seq"] in deltas:
+            row.update(deltas[row["seq"]])
+        if row["category_id"] in remap:
+            row["category_id"] = remap[row["category_id"]]
+        yield row
+
+
+def scan_sorted(instance_id, lower=None, upper=None, descending=False):
+    """
+    Yield rows whose (date, seq) key lies strictly between lower and upper,
+    in key order, reading only the blocks that can hold them.
+    """
+    index = load_sorted_index(instance_id)
+    if not index["keys"]:
+        return
+
+    keys = [tuple(k) for k in index["keys"]]
+    deltas = load_deltas(instance_id)
+    remap = load_category_table(instance_id)["remap"]
+    sorted_path = _sorted_path(instance_id)
+
+    with open(sorted_path, "rb") as f:
+        if not descending:
+            block = max(bisect.bisect_right(keys, lower) - 1, 0) if lower else 0
+            for b in range(block, len(keys)):
+                for row in _read_block(f, index, b, deltas, remap):
+                    key = (row["date"], row["seq"])
+                    if lower and key <= lower:
+                        continue
+                    if upper and key >= upper:
+                        return
+                    yield row
+        else:
+            block = bisect.bisect_left(keys, upper) - 1 if upper else len(keys) - 1
+            for b in range(block, -1, -1):
+                for row in reversed(list(_read_block(f, index, b, deltas, remap))):
+                    key = (row["date"], row["seq"])
+                    if upper and key >= upper:
+                        continue
+                    if lower and key <= lower:
+                        return
+                    yield row
+
+
+def fetch_rows(instance_id, keys):
+    """
+    Look up rows by (date, seq) key, reading each block that holds one once.
+
+    Returns:
+        dict: key -> row, for the keys that exist.
+    """
+    index = load_sorted_index(instance_id)
+    if not index["keys"] or not keys:
+        return {}
+
+    block_keys = [tuple(k) for k in index["keys"]]
+    blocks = {}
+    for key in keys:
+        blocks.setdefault(max(bisect.bisect_right(block_keys, tuple(key)) - 1, 0), set()).add(tuple(key))
+
+    rows = {}
+    deltas = load_deltas(instance_id)
+    remap = load_category_table(instance_id)["remap"]
+    sorted_path = _sorted_path(instance_id)
+    with open(sorted_path, "rb") as f:
+        for block in sorted(blocks):
+            wanted = blocks[block]
+            for row in _read_block(f, index, block, deltas, remap):
+                key = (row["date"], row["seq"])
+                if key in wanted:
+                    rows[key] = row
+    return rows
@@ -0,0 +1,164 @@
+from __future__ import annotations
+from app.utils.lazy import lazy_import
+from datetime import date
+from app.utils.ledger import DerivedFile, load_ledger, ledger_version, instance_lock
+
+pd = lazy_import("pandas")
+
+# Running spend per category, overall and per day / ISO week / month bucket:
+#   {"version": ..., "totals": {cat: x}, "periods": {"M:2024-02": {cat: x}, ...}}
+# Ingest, corrections and category changes update them in place.
+_file = DerivedFile("spend.json")
+
+PERIOD_PREFIXES = {"daily": "D", "weekly": "W", "monthly": "M"}
+
+
+def _category_key(category_id):
+    return "none" if pd.isna(category_id) else str(int(category_id))
+
+
+def period_key(period, day):
+    """
+    Bucket key of a date for a budget period ("daily", "weekly", "monthly").
+    """
+    if period == "daily":
+        return f"D:{day.strftime('%Y-%m-%d')}"
+    if period == "weekly":
+        return f"W:{day.strftime('%G-W%V')}"
+    if period == "monthly":
+        return f"M:{day.strftime('%Y-%m')}"
+    raise ValueError(f"Unknown period: {period}")
+
+
+def _bucket(df: pd.DataFrame) -> dict:
+    """
+    Vectorized aggregation of ledger rows into counter buckets.
+    """
+    df = df.assign(
+        amount=pd.to_numeric(df["amount"], errors="coerce").fillna(0),
+        category=df["category_id"].map(_category_key),
+        date=pd.to_datetime(df["date"], errors="coerce")
+    )
+
+    totals = df.groupby("category")["amount"].sum().to_dict()
+
+    dated = df.dropna(subset=["date"])
+    keys = pd.concat([
+        "D:" + dated["date"].dt.strftime("%Y-%m-%d"),
+        "W:" + dated["date"].dt.strftime("%G-W%V"),
+        "M:" + dated["date"].dt.strftime("%Y-%m"),
+    ])
+    stacked = pd.DataFrame({
+        "period": keys.to_numpy(),
+        "category": pd.concat([dated["category"]] * 3).to_numpy(),
+        "amount": pd.concat([dated["amount"]] * 3).to_numpy(),
+    })
+    periods = {}
+    for (period, category), amount in stacked.groupby(["period", "category"])["amount"].sum().items():
+        periods.setdefault(period, {})[category] = amount
+
+    return {"totals": totals, "periods": periods}
+
+
+def _merge(counters, delta, sign=1):
+    for category, amount in delta["totals"].items():
+        counters["totals"][category] = counters["totals"].get(category, 0.0) + sign * amount
+    for period, buckets in delta["periods"].items():
+        target = counters["periods"].setdefault(period, {})
+        for category, amount in buckets.items():
+            target[category] = target.get(category, 0.0) + sign * amount
+
+
+def rebuild_counters(instance_id):
+    """
+    Recompute all counters of an instance from its ledger in one pass.
+    """
+    with instance_lock(instance_id):
+        version = ledger_version(instance_id)
+        df = load_ledger(instance_id, ["date", "amount", "category_id"])
+        counters = {"version": version, **_bucket(df)}
+        _file.save(instance_id, counters)
+        return counters
+
+
+def load_counters(instance_id):
+    """
+    Return the counters of an instance, rebuilding them if they are stale.
+    """
+    return _file.load(instance_id, rebuild_counters)
+
+
+def _apply(instance_id, previous_version, version, changes):
+    with instance_lock(instance_id):
+        counters = _file.current(instance_id, previous_version)
+        if counters is None:
+            # Stale already, the next read rebuilds
+            return
+        for rows, sign in changes:
+            if not rows.empty:
+                _merge(counters, _bucket(rows), sign)
+        counters["version"] = version
+        _file.save(instance_id, counters)
+
+
+def on_append(instance_id, rows: pd.DataFrame, previous_version, version):
+    """
+    Add freshly ingested ledger rows to the counters.
+    """
+    _apply(instance_id, previous_version, version, [(rows, 1)])
+
+
+def on_correction(instance_id, before: pd.DataFrame, after: pd.DataFrame, previous_version, version):
+    """
+    Move corrected rows from their old amount/category to the new one.
+    """
+    _apply(instance_id, previous_version, version, [(before, -1), (after, 1)])
+
+
+def on_recategorize(instance_id, old_id, new_id, previous_version, version):
+    """
+    Fold every counter of category old_id into new_id.
+    """
+    with instance_lock(instance_id):
+        counters = _file.current(instance_id, previous_version)
+        if counters is None:
+            return
+        old_key, new_key = _category_key(old_id), _category_key(new_id)
+        for buckets in [counters["totals"], *counters["periods"].values()]:
+            if old_key in buckets:
+                buckets[new_key] = buckets.get(new_key, 0.0) + buckets.pop(old_key)
+        counters["version"] = version
+        _file.save(instance_id, counters)
+
+
+def on_patch(instance_id, previous_version, version):
+    """
+    Carry the counters over a change that moves no spend (a rename).
+    """
+    _file.carry_over(instance_id, previous_version, version)
+
+
+def category_spend(instance_id, category_id, period="all", today=None):
+    """
+    Spend of one category over all time or in the current period bucket.
+    """
+    counters = load_counters(instance_id)
+    key = _category_key(category_id)
+    if period == "all":
+        return counters["totals"].get(key, 0.0)
+    bucket = period_key(period, today or date.today())
+    return counters["periods"].get(bucket, {}).get(key, 0.0)
+
+
+def period_totals(instance_id, period):
+    """
+    Total spend per bucket of a period across all categories, as
+    [(bucket, total)] sorted by bucket ("2024-02-25", "2024-W08", "2024-02").
+    """
+    prefix = f"{PERIOD_PREFIXES[period]}:"
+    counters = load_counters(instance_id)
+    return sorted(
+        (key[2:], sum(buckets.values()))
+        for key, buckets in counters["periods"].items()
+        if key.startswith(prefix)
+    )
@@ -0,0 +1,18 @@
+import os
+
+STORAGE_DIR = "storage"
+
+STORAGE_DIRS = [
+    STORAGE_DIR,
+    os.path.join(STORAGE_DIR, "instances"),
+    os.path.join(STORAGE_DIR, "receipts", "images"),
+    os.path.join(STORAGE_DIR, "charts"),
+]
+
+
+def init_storage():
+    """
+    Create the storage directory layout. Called once at app startup.
+    """
+    for path in STORAGE_DIRS:
+        os.makedirs(path, exist_ok=True)
@@ -0,0 +1,170 @@
+from __future__ import annotations
+import re
+import math
+import bisect
+import unicodedata
+from app.utils.lazy import lazy_import
+from app.utils.ledger import DerivedFile, load_ledger, data_version, normalize_dates, instance_lock
+
+pd = lazy_import("pandas")
+
+# Inverted index over the item text of a ledger:
+#   {"version": ..., "dates": [date of each seq], "postings": {token: [seq, ...]}}
+# seq is the row's position in the ledger CSV (as in the sorted ledger), and
+# each postings list is sorted. Ingest and corrections are logged as changes
+# next to it (see DerivedFile) rather than rewriting it.
+INDEX_FILE = "text_index.json"
+
+# Prefix matches count for less than whole-token matches
+PREFIX_WEIGHT = 0.5
+
+_TOKEN = re.compile(r"\w+")
+
+# instance_id -> (index, its tokens in sorted order), kept sorted as
+# changes are replayed
+_vocabularies = {}
+
+
+def tokenize(text) -> list[str]:
+    """
+    Normalized tokens of a text: case-folded, accents stripped, split on
+    anything that is not a letter or digit.
+    """
+    if not isinstance(text, str) or not text:
+        return []
+    text = unicodedata.normalize("NFKD", text.casefold())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return _TOKEN.findall(text)
+
+
+def _vocabulary(instance_id, index):
+    cached = _vocabularies.get(instance_id)
+    if cached is None or cached[0] is not index:
+        cached = _vocabularies[instance_id] = (index, sorted(index["postings"]))
+    return cached[1]
+
+
+def build_text_index(instance_id):
+    """
+    Rebuild the text index of an instance from its ledger.
+    """
+    with instance_lock(instance_id):
+        version = data_version(instance_id)
+        df = load_ledger(instance_id, ["date", "text"])
+
+        # Tokenize each distinct text once and spread it over its rows
+        per_text = pd.Series([sorted(set(tokenize(text))) for text in df["text"].cat.categories], dtype=object)
+        codes = df["text"].cat.codes
+        tokens = per_text.reindex(codes.to_numpy()).set_axis(df.index).explode().dropna()
+        postings = {
+            token: seqs.tolist()
+            for token, seqs in pd.Series(tokens.index, index=tokens.to_numpy()).groupby(level=0)
+        }
+        index = {"version": version, "dates": normalize_dates(df["date"]).tolist(), "postings": postings}
+        _file.save(instance_id, index)
+        return index
+
+
+def _load(instance_id):
+    index = _file.load(instance_id, build_text_index)
+    return index, _vocabulary(instance_id, index)
+
+
+def _add(index, vocabulary, seq, text):
+    for token in set(tokenize(text)):
+        postings = index["postings"].get(token)
+        if postings is None:
+            postings = index["postings"][token] = []
+            bisect.insort(vocabulary, token)
+        bisect.insort(postings, seq)
+
+
+def _remove(index, vocabulary, seq, text):
+    for token in set(tokenize(text)):
+        postings = index["postings"].get(token, [])
+        position = bisect.bisect_left(postings, seq)
+        if position < len(postings) and postings[position] == seq:
+            del postings[position]
+        if not postings and token in index["postings"]:
+            del index["postings"][token]
+            del vocabulary[bisect.bisect_left(vocabulary, token)]
+
+
+def _replay(instance_id, index, change):
+    # {"append": [[date, text], ...]} for rows taking the next seq numbers, or
+    # {"correct": [[seq, old text, new text], ...]}
+    vocabulary = _vocabulary(instance_id, index)
+    for date, text in change.get("append", []):
+        index["dates"].append(date)
+        _add(index, vocabulary, len(index["dates"]) - 1, text)
+    for seq, old, new in change.get("correct", []):
+        _remove(index, vocabulary, seq, old)
+        _add(index, vocabulary, seq, new)
+
+
+_file = DerivedFile(INDEX_FILE, replay=_replay, version=data_version)
+
+
+def _texts(texts: pd.Series) -> list:
+    return texts.astype(object).where(texts.notna(), None).tolist()
+
+
+def on_append(instance_id, rows: pd.DataFrame, previous_version, version):
+    """
+    Index freshly appended ledger rows, which take the next seq numbers.
+    """
+    change = {"append": [list(row) for row in zip(normalize_dates(rows["date"]).tolist(), _texts(rows["text"]))]}
+    _file.update(instance_id, previous_version, version, change)
+
+
+def on_correction(instance_id, before: pd.DataFrame, after: pd.DataFrame, previous_version, version):
+    """
+    Re-index corrected rows. Both frames are indexed by ledger position.
+    """
+    new = dict(zip(after.index, _texts(after["text"])))
+    change = {"correct": [[int(seq), old, new[seq]] for seq, old in zip(before.index, _texts(before["text"]))]}
+    _file.update(instance_id, previous_version, version, change)
+
+
+def on_patch(instance_id, previous_version, version):
+    """
+    Carry the index over a change that leaves item text alone.
+    """
+    _file.carry_over(instance_id, previous_version, version)
+
+
+def search(instance_id, query):
+    """
+    Rows whose text matches every term of query, as {seq: (date, score)}.
+
+    Each term matches tokens it equals or is a prefix of. A row scores the
+    sum over terms of the inverse document frequency of its matching
+    tokens, with prefix matches weighted down.
+    """
+    terms = tokenize(query)
+    if not terms:
+        return {}
+
+    index, vocabulary = _load(instance_id)
+    postings = index["postings"]
+    total = max(len(index["dates"]), 1)
+
+    scores = None
+    for term in terms:
+        term_scores = {}
+        position = bisect.bisect_left(vocabulary, term)
+        while position < len(vocabulary) and vocabulary[position].startswith(term):
+            token = vocabulary[position]
+            weight = (1.0 if token == term else PREFIX_WEIGHT) * math.log(1 + total / len(postings[token]))
+            for seq in postings[token]:
+                term_scores[seq] = max(term_scores.get(seq, 0.0), weight)
+            position += 1
+
+        if scores is None:
+            scores = term_scores
+        else:
+            scores = {seq: score + term_scores[seq] for seq, score in scores.items() if seq in term_scores}
+        if not scores:
+            return {}
+
+    return {seq: (index["dates"][seq], round(score, 6)) for seq, score in scores.items()}
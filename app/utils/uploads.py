@@ -0,0 +1,37 @@
+from flask import Request, current_app
+from app.utils.image_store import ImageSpool, MAX_UPLOAD_BYTES
+
+# Views marked with image_upload take receipt images. For them the request
+# body is capped at MAX_UPLOAD_BYTES and every uploaded file is received
+# straight into an ImageSpool as Werkzeug parses the body, so the image is
+# sniffed, hashed and capped while it arrives and written to disk once,
+# whichever code (the view or a decorator) reads the form first.
+
+
+def image_upload(view):
+    """
+    Mark a view as receiving receipt images (see UploadRequest).
+    """
+    view.image_upload = True
+    return view
+
+
+class UploadRequest(Request):
+    """
+    Flask request spooling the uploads of image_upload views into the image
+    store as they are received.
+    """
+
+    def _image_upload(self):
+        view = current_app.view_functions.get(self.endpoint) if self.endpoint else None
+        return getattr(view, "image_upload", False)
+
+    def _load_form_data(self):
+        if self._image_upload():
+            self.max_content_length = MAX_UPLOAD_BYTES
+        super()._load_form_data()
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self._image_upload():
+            return ImageSpool()
+        return super()._get_file_stream(total_content_length, content_type, filename, content_length)
@@ -0,0 +1,97 @@
+from __future__ import annotations
+import re
+import unicodedata
+from app.utils.lazy import lazy_import
+from app.utils.ledger import DerivedFile, load_ledger, data_version, instance_lock
+
+pd = lazy_import("pandas")
+
+# Normalized vendor names of an instance:
+#   {"version": ..., "vendors": {key: {"name": display name, "aliases": [raw names]}}}
+# key is normalize_vendor() of the raw name, so "WALMART #1234" and
+# "Walmart Inc." share one entry. The first spelling seen is the display
+# name.
+_file = DerivedFile("vendors.json", version=data_version)
+
+# Legal-form suffixes and store numbers that do not tell vendors apart
+_SUFFIXES = re.compile(r"\b(inc|incorporated|ltd|limited|llc|plc|pvt|corp|corporation|gmbh|sa)\b")
+_STORE_NUMBER = re.compile(r"(#\s*\d+|\bno\.?\s*\d+|\bstore\s*\d+)")
+_APOSTROPHE = re.compile(r"['\u2019`]")
+_NON_WORD = re.compile(r"[^\w]+")
+
+
+def normalize_vendor(name) -> str | None:
+    """
+    Matching key of a vendor name: case-folded, accents, punctuation, store
+    numbers and legal suffixes removed. None for a missing or empty name.
+    """
+    if not isinstance(name, str):
+        return None
+    key = unicodedata.normalize("NFKD", name.casefold())
+    key = "".join(c for c in key if not unicodedata.combining(c))
+    key = _STORE_NUMBER.sub(" ", _APOSTROPHE.sub("", key))
+    key = _NON_WORD.sub(" ", key).replace("_", " ")
+    key = " ".join(_SUFFIXES.sub(" ", key).split())
+    return key or None
+
+
+def _add(vendors, names):
+    for name in names:
+        key = normalize_vendor(name)
+        if key is None:
+            continue
+        entry = vendors.setdefault(key, {"name": name.strip(), "aliases": []})
+        if name not in entry["aliases"]:
+            entry["aliases"].append(name)
+
+
+def build_vendor_index(instance_id):
+    """
+    Rebuild the vendor index of an instance from its ledger.
+    """
+    with instance_lock(instance_id):
+        version = data_version(instance_id)
+        vendor = load_ledger(instance_id, ["vendor"])["vendor"]
+        # Distinct names in order of first appearance
+        names = vendor.cat.categories[pd.unique(vendor.cat.codes[vendor.cat.codes >= 0])]
+        vendors = {}
+        _add(vendors, names)
+        index = {"version": version, "vendors": vendors}
+        _file.save(instance_id, index)
+        return index
+
+
+def load_vendor_index(instance_id):
+    """
+    Return the vendor index of an instance, rebuilding it if stale.
+    """
+    return _file.load(instance_id, build_vendor_index)
+
+
+def on_append(instance_id, rows: pd.DataFrame, previous_version, version):
+    """
+    Register the vendors of freshly appended ledger rows.
+    """
+    if "vendor" not in rows.columns:
+        return
+    with instance_lock(instance_id):
+        index = _file.current(instance_id, previous_version)
+        if index is None:
+            return
+        _add(index["vendors"], rows["vendor"].dropna().unique())
+        index["version"] = version
+        _file.save(instance_id, index)
+
+
+def on_patch(instance_id, previous_version, version):
+    """
+    Carry the index over a correction, which never changes a vendor.
+    """
+    _file.carry_over(instance_id, previous_version, version)
+
+
+def vendor_names(instance_id) -> dict:
+    """
+    {normalized key: display name} of an instance's vendors.
+    """
+    return {key: entry["name"] for key, entry in load_vendor_index(instance_id)["vendors"].items()}
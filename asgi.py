@@ -0,0 +1,18 @@
+import os
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.routing import Mount
+from run import app as flask_app
+from app.routes.llm_async import routes as llm_routes
+
+# ASGI entry point: receipt upload, advice and chat run natively async,
+# every other route is the Flask app on a thread pool.
+#
+#   uvicorn asgi:app --workers 2
+WSGI_THREADS = int(os.getenv("WSGI_THREADS", "16"))
+
+app = Starlette(routes=[
+    *llm_routes,
+    # Routes the async ones do not match (GET /v1/reciepts too) fall through
+    Mount("/", app=WSGIMiddleware(flask_app, workers=WSGI_THREADS)),
+])
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Startup import-time benchmark.
+
+Imports the app module in fresh interpreters with ``python -X importtime``
+and reports the median wall time of the import plus the most expensive
+modules (self and cumulative time).
+
+Usage:
+    python benchmarks/import_time.py [--target run] [--repeat 5] [--top 15] [--json]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def profile_import(target):
+    """
+    Import target once in a fresh interpreter.
+
+    Returns (wall seconds, {module: (self_us, cumulative_us)}).
+    """
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {target}"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True
+    )
+    wall = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(f"Importing {target} failed:\n{proc.stderr}")
+
+    modules = {}
+    for line in proc.stderr.splitlines():
+        # "import time:   self [us] | cumulative | imported package"
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return wall, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--target", default="run", help="module to import (default: run)")
+    parser.add_argument("--repeat", type=int, default=5, help="fresh interpreters to sample")
+    parser.add_argument("--top", type=int, default=15, help="modules to list")
+    parser.add_argument("--json", action="store_true", help="print machine-readable output")
+    args = parser.parse_args()
+
+    walls, samples = [], []
+    for _ in range(args.repeat):
+        wall, modules = profile_import(args.target)
+        walls.append(wall)
+        samples.append(modules)
+
+    # Median per module across runs smooths out disk cache effects
+    names = set().union(*samples)
+    median = {
+        name: (
+            statistics.median(s[name][0] for s in samples if name in s),
+            statistics.median(s[name][1] for s in samples if name in s),
+        )
+        for name in names
+    }
+    top_cumulative = sorted(median.items(), key=lambda kv: kv[1][1], reverse=True)[:args.top]
+    top_self = sorted(median.items(), key=lambda kv: kv[1][0], reverse=True)[:args.top]
+
+    result = {
+        "target": args.target,
+        "wall_ms": round(statistics.median(walls) * 1000, 1),
+        "modules_imported": len(median),
+        "heavy_loaded": sorted(n for n in ("pandas", "numpy", "matplotlib", "openai", "pyarrow") if n in median),
+        "top_cumulative_ms": {n: round(v[1] / 1000, 1) for n, v in top_cumulative},
+        "top_self_ms": {n: round(v[0] / 1000, 1) for n, v in top_self},
+    }
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+
+    print(f"import {result['target']}: {result['wall_ms']} ms median wall time over {args.repeat} runs")
+    print(f"modules imported: {result['modules_imported']}")
+    print(f"heavy dependencies loaded at import: {', '.join(result['heavy_loaded']) or 'none'}")
+    print("\nTop cumulative import time (ms):")
+    for name, ms in result["top_cumulative_ms"].items():
+        print(f"  {ms:10.1f}  {name}")
+    print("\nTop self import time (ms):")
+    for name, ms in result["top_self_ms"].items():
+        print(f"  {ms:10.1f}  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+End-to-end ingestion and insights benchmark on recorded model calls.
+
+Each run creates a workspace in a scratch storage directory, uploads every
+receipt image in --images (sorted by name), sets a budget, asks for advice
+and holds a short chat, all through the Flask app. In record mode the model
+is called and every call is written to a cassette; in replay mode the
+cassette answers instead, with the recorded latency or none, so runs are
+offline and repeatable.
+
+Usage:
+    python benchmarks/llm_pipeline.py record --images DIR [--cassette pipeline]
+    python benchmarks/llm_pipeline.py replay --images DIR [--cassette pipeline]
+        [--latency original|zero] [--repeat 3] [--json]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".webp")
+CHAT_MESSAGES = [
+    "Where did most of my money go?",
+    "Which category grew the most?",
+    "How can I stay within my budget?",
+]
+TOKEN = "benchmark-user"
+
+
+def run_pipeline(client, images):
+    """
+    One pass over the pipeline. Returns {stage: [seconds, ...]} and the
+    number of failed requests.
+    """
+    headers = {"Authorization": f"Bearer {TOKEN}"}
+    timings = {"upload": [], "advice": [], "chat": []}
+    failures = 0
+
+    resp = client.post("/v1/instances", json={"name": "benchmark"}, headers=headers)
+    instance_id = resp.get_json()["instance_id"]
+    client.post(f"/v1/instances/{instance_id}/budgets", json={"category_id": 1, "limit": 500})
+
+    def timed(stage, *args, **kwargs):
+        nonlocal failures
+        start = time.perf_counter()
+        resp = client.post(*args, **kwargs)
+        timings[stage].append(time.perf_counter() - start)
+        body = resp.get_json(silent=True)
+        failures += resp.status_code != 200 or (isinstance(body, dict) and "error" in body)
+
+    for path in images:
+        with open(path, "rb") as f:
+            timed("upload", "/v1/reciepts", headers=headers, content_type="multipart/form-data",
+                  data={"reciept": (f, os.path.basename(path)), "instance_id": instance_id})
+    timed("advice", f"/v1/instances/{instance_id}/advice", json={"focus": "groceries"})
+    for message in CHAT_MESSAGES:
+        timed("chat", f"/v1/instances/{instance_id}/chat", json={"message": message})
+    return timings, failures
+
+
+def summarize(samples):
+    return {
+        "calls": len(samples),
+        "total_s": round(sum(samples), 3),
+        "median_ms": round(statistics.median(samples) * 1000, 1) if samples else None,
+        "max_ms": round(max(samples) * 1000, 1) if samples else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("mode", choices=["record", "replay"])
+    parser.add_argument("--images", required=True, help="directory of receipt images")
+    parser.add_argument("--cassette", default="pipeline", help="cassette name (default: pipeline)")
+    parser.add_argument("--cassette-dir", default=os.path.join(ROOT, "storage", "cassettes"))
+    parser.add_argument("--latency", choices=["original", "zero"], default="original",
+                        help="replayed call latency (default: as recorded)")
+    parser.add_argument("--repeat", type=int, default=1, help="pipeline runs (replay only)")
+    parser.add_argument("--json", action="store_true", help="print machine-readable output")
+    args = parser.parse_args()
+
+    images = sorted(
+        os.path.join(args.images, name) for name in os.listdir(args.images)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+    if not images:
+        parser.error(f"no receipt images in {args.images}")
+
+    # Configured before the app is imported; the storage paths are relative,
+    # so each run works in its own scratch directory
+    os.environ.update({
+        "LLM_CASSETTE_MODE": args.mode,
+        "LLM_CASSETTE_DIR": os.path.abspath(args.cassette_dir),
+        "LLM_CASSETTE": args.cassette,
+        "LLM_CASSETTE_MATCH": "sequence",
+        "LLM_REPLAY_LATENCY": args.latency,
+        # Admission control is not what is measured here
+        "LLM_BURST": "1000000",
+    })
+    images = [os.path.abspath(p) for p in images]
+    sys.path.insert(0, ROOT)
+    os.chdir(tempfile.mkdtemp(prefix="llm-pipeline-"))
+    from run import app
+    from app.utils.storage import init_storage
+    from app.utils.llm_cassette import cassette_stats, reset_cursors
+
+    repeat = args.repeat if args.mode == "replay" else 1
+    runs = []
+    for _ in range(repeat):
+        os.chdir(tempfile.mkdtemp(prefix="llm-pipeline-"))
+        init_storage()
+        reset_cursors()
+        start = time.perf_counter()
+        timings, failures = run_pipeline(app.test_client(), images)
+        runs.append({"wall_s": round(time.perf_counter() - start, 3), "failures": failures,
+                     **{stage: summarize(samples) for stage, samples in timings.items()}})
+
+    result = {
+        "mode": args.mode,
+        "cassette": os.path.join(args.cassette_dir, f"{args.cassette}.jsonl"),
+        "latency": args.latency if args.mode == "replay" else "live",
+        "images": len(images),
+        "wall_s_median": round(statistics.median(r["wall_s"] for r in runs), 3),
+        "runs": runs,
+        "cassette_stats": cassette_stats(),
+    }
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+
+    print(f"{args.mode} {result['cassette']} ({result['latency']} latency): "
+          f"{len(images)} receipt(s), {repeat} run(s), {result['wall_s_median']} s median wall time")
+    for i, run in enumerate(runs, 1):
+        stages = ", ".join(
+            f"{stage} {run[stage]['calls']}x median {run[stage]['median_ms']} ms"
+            for stage in ("upload", "advice", "chat")
+        )
+        print(f"  run {i}: {run['wall_s']} s, {stages}, {run['failures']} failed request(s)")
+    stats = result["cassette_stats"]
+    print(f"cassette: {stats['recorded']} recorded, {stats['replayed']} replayed "
+          f"({stats['sequence_matches']} by order), {stats['misses']} missed")
+
+
+if __name__ == "__main__":
+    main()
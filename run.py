@@ -1,3 +1,5 @@
+import os
+import hmac
 from flask import Flask, request,jsonify,render_template
 from app.routes.workspace import workspace_bp
 from app.routes.categories import categories_dp
@@ -6,10 +8,29 @@ from app.routes.transactions import transaction_bp
 from app.routes.reports import report_bp
 from app.routes.insights import insights_bp
 from app.utils.save_reciept_image import save_receipt_image
+from app.utils.image_store import ImageTooLarge
+from app.utils.uploads import UploadRequest, image_upload
 from app.utils.reciept_parser import reciept_parser
+from app.utils.json_provider import FastJSONProvider
+from app.utils.storage import init_storage
+from app.utils.single_flight import coalescing_stats
+from app.utils.idempotency import idempotency_stats
+from app.utils.llm import admission_stats
+from app.utils.llm_cassette import cassette_stats
 from datetime import datetime,timezone
+from dotenv import load_dotenv
+
+# Startup: environment and storage layout, before any request is served
+load_dotenv()
+init_storage()
+
+# Internal counters are for operators: served only when METRICS_TOKEN is set,
+# to requests bearing it
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
 
 app = Flask(__name__)
+app.request_class = UploadRequest
+app.json = FastJSONProvider(app)
 
 app.register_blueprint(workspace_bp)
 app.register_blueprint(categories_dp)
@@ -30,13 +51,33 @@ def check_health():
     }
 
 
+@app.route('/v1/metrics',methods=['GET'])
+def metrics():
+    if not METRICS_TOKEN:
+        return {"error": "Not found"}, 404
+    if not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {METRICS_TOKEN}"):
+        return {"error": "Forbidden"}, 403
+    return {
+        "single_flight": coalescing_stats(),
+        "idempotency": idempotency_stats(),
+        "llm_admission": admission_stats(),
+        "llm_cassette": cassette_stats()
+    }
+
+
 @app.route("/upload",methods=['GET',"POST"])
+@image_upload
 def testing():
     if request.method == "POST": 
        file = request.files.get("reciept")
        instance_id = request.form.get("instance_id")
 
-       resp = save_receipt_image(file)
+       try:
+           resp = save_receipt_image(file, instance_id)
+       except ImageTooLarge as e:
+           return {"error": str(e)}, 413
+       except ValueError as e:
+           return {"error": str(e)}, 400
        return {"resp":resp},200
         
     return render_template("upload.html")
@@ -44,4 +85,6 @@ def testing():
 
 
 
-app.run(debug=True)
+if __name__ == "__main__":
+    app.run(debug=True)
+
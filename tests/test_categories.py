@@ -0,0 +1,42 @@
+from conftest import AUTH
+from app.services.categories import compact_categories
+from app.utils.ledger import UNCATEGORIZED
+
+
+def categorised(workspace):
+    return sorted((row["text"], row["category_id"]) for row in workspace.transactions(fields="text,category_id")["rows"])
+
+
+def test_merge_delete_and_rename_then_compaction(workspace, client, assert_matches_rebuild):
+    workspace.upload("2024-06-01", [("Milk", 2.5, "Groceries"), ("Soap", 1.5, "Household")])
+    workspace.upload("2024-06-03", [("Taxi ride", 12.0, "Transport"), ("Bus", 2.0, "Transport")])
+    workspace.upload("2024-06-04", [("Bread", 3.0, "Groceries"), ("Sponge", 1.0, "Household")])
+    ids = workspace.category_ids()
+    for name, limit in (("Household", 10), ("Groceries", 20), ("Transport", 30)):
+        resp = client.post(f"/v1/instances/{workspace.id}/budgets", json={"category_id": ids[name], "limit": limit})
+        assert resp.status_code in (200, 201), resp.get_data()
+
+    resp = client.post(f"/v1/categories/{ids['Groceries']}", json={"name": "Food"}, headers=AUTH)
+    assert resp.status_code == 200, resp.get_data()
+    resp = client.post(f"/v1/categories/{ids['Household']}/merge", json={"into": ids["Groceries"]}, headers=AUTH)
+    assert resp.status_code == 200, resp.get_data()
+    resp = client.delete(f"/v1/categories/{ids['Transport']}", headers=AUTH)
+    assert resp.status_code == 200, resp.get_data()
+
+    food = ids["Groceries"]
+    expected = [
+        ("Bread", food), ("Bus", UNCATEGORIZED), ("Milk", food),
+        ("Soap", food), ("Sponge", food), ("Taxi ride", UNCATEGORIZED),
+    ]
+    assert categorised(workspace) == expected
+    assert_matches_rebuild(workspace.id)
+
+    budgets = client.get(f"/v1/instances/{workspace.id}/budgets").get_json()["Details"]
+    assert [(b["category"], b["limit"], b["spent"]) for b in budgets] == [("Food", 30.0, 8.0)]
+
+    assert compact_categories(workspace.id)
+    assert not compact_categories(workspace.id)
+    assert categorised(workspace) == expected
+    assert_matches_rebuild(workspace.id)
+    assert workspace.category_ids().get("Food") == food
+    assert "Household" not in workspace.category_ids()
@@ -0,0 +1,43 @@
+def test_appends_keep_derived_files_equal_to_a_rebuild(workspace, assert_matches_rebuild):
+    workspace.upload("2024-01-01", [("Milk", 2.5, "Groceries"), ("Soap", 1.5, "Household")])
+    workspace.upload("2024-01-10", [("Bread", 3.0, "Groceries")], vendor="Bakery Inc.")
+    assert_matches_rebuild(workspace.id)
+
+    # Out of date order, then in order again
+    workspace.upload("2024-01-05", [("Taxi ride", 12.0, "Transport")])
+    workspace.upload("2024-02-01", [("Organic milk", 4.0, "Groceries")])
+    assert_matches_rebuild(workspace.id)
+
+    dates = [row["date"] for row in workspace.transactions()["rows"]]
+    assert dates == sorted(dates) and len(dates) == 5
+
+
+def test_corrections_keep_derived_files_equal_to_a_rebuild(workspace, client, assert_matches_rebuild):
+    first = workspace.upload("2024-03-01", [("Milk", 2.5, "Groceries"), ("Soap", 1.5, "Household")])
+    second = workspace.upload("2024-03-02", [("Coffee beans", 9.0, "Groceries")])
+
+    resp = client.patch(f"/v1/reciepts/{first}", json={
+        "instance_id": workspace.id, "fixes": [{"line": 0, "text": "Oat drink", "price": 3.5}]
+    })
+    assert resp.status_code == 200, resp.get_data()
+    assert_matches_rebuild(workspace.id)
+
+    resp = client.patch("/v1/reciepts", json={"instance_id": workspace.id, "corrections": [
+        {"receipt_id": first, "fixes": [{"line": 1, "text": "Dish soap"}]},
+        {"receipt_id": second, "fixes": [{"line": 0, "price": 11.0}]},
+    ]})
+    assert resp.status_code == 200, resp.get_data()
+    assert resp.get_json()["rows_patched"] == 2
+    assert_matches_rebuild(workspace.id)
+
+    texts = sorted(row["text"] for row in workspace.transactions()["rows"])
+    assert texts == ["Coffee beans", "Dish soap", "Oat drink"]
+    assert [row["text"] for row in workspace.transactions(search="oat")["rows"]] == ["Oat drink"]
+
+
+def test_unparseable_prices_are_kept_as_missing_amounts(workspace, assert_matches_rebuild):
+    workspace.upload("2024-04-01", [("Milk", "two fifty", "Groceries"), ("Bread", 3.0, "Groceries")])
+    assert_matches_rebuild(workspace.id)
+
+    amounts = {row["text"]: row["amount"] for row in workspace.transactions()["rows"]}
+    assert amounts == {"Milk": None, "Bread": 3.0}
@@ -0,0 +1,55 @@
+import threading
+from conftest import Workspace, receipt_image
+
+ITEMS = [("Milk", 2.5, "Groceries")]
+
+
+def test_retry_replays_the_stored_response(workspace):
+    image = receipt_image()
+    first = workspace.post_receipt("2024-07-01", ITEMS, image=image, headers={"Idempotency-Key": "replay"})
+    assert first.status_code == 200, first.get_data()
+
+    retry = workspace.post_receipt("2024-07-01", ITEMS, image=image, headers={"Idempotency-Key": "replay"})
+    assert retry.status_code == 200
+    assert retry.headers.get("Idempotent-Replayed") == "true"
+    assert retry.get_json() == first.get_json()
+    # Answered from the store: no second model call, no second set of rows
+    assert workspace.fake_llm.calls == 1
+    assert len(workspace.transactions()["rows"]) == 1
+
+
+def test_key_reused_for_a_different_request_is_refused(workspace, client, fake_llm):
+    other = Workspace(client, fake_llm)
+    image = receipt_image()
+    assert workspace.post_receipt("2024-07-02", ITEMS, image=image, headers={"Idempotency-Key": "reused"}).status_code == 200
+
+    # Same key, another instance or another image
+    resp = workspace.post_receipt("2024-07-02", ITEMS, image=image, headers={"Idempotency-Key": "reused"}, instance_id=other.id)
+    assert resp.status_code == 422
+    resp = workspace.post_receipt("2024-07-02", ITEMS, headers={"Idempotency-Key": "reused"})
+    assert resp.status_code == 422
+    assert len(other.transactions()["rows"]) == 0
+
+
+def test_retry_while_the_request_runs_gets_409(workspace, app, fake_llm):
+    fake_llm.hold, fake_llm.started = threading.Event(), threading.Event()
+    image = receipt_image()
+    results = {}
+
+    def first():
+        results["first"] = workspace.post_receipt("2024-07-03", ITEMS, image=image, headers={"Idempotency-Key": "running"})
+
+    thread = threading.Thread(target=first)
+    thread.start()
+    try:
+        assert fake_llm.started.wait(10)
+        workspace.client = app.test_client()
+        retry = workspace.post_receipt("2024-07-03", ITEMS, image=image, headers={"Idempotency-Key": "running"})
+        assert retry.status_code == 409
+        assert retry.headers.get("Retry-After")
+    finally:
+        fake_llm.hold.set()
+        thread.join()
+
+    assert results["first"].status_code == 200
+    fake_llm.receipts.clear()
@@ -0,0 +1,33 @@
+from app.utils import llm
+
+
+def chat(workspace):
+    return workspace.client.post(f"/v1/instances/{workspace.id}/chat", json={"message": "How am I doing?"})
+
+
+def test_instance_over_its_rate_gets_429(workspace, monkeypatch):
+    monkeypatch.setattr(llm, "LLM_BURST", 2)
+    monkeypatch.setattr(llm, "LLM_RATE_PER_MINUTE", 20)
+
+    assert chat(workspace).status_code == 200
+    assert chat(workspace).status_code == 200
+    resp = chat(workspace)
+    assert resp.status_code == 429
+    # One token refills in 60 / 20 seconds
+    assert resp.headers["Retry-After"] == "3"
+
+
+def test_request_waiting_past_the_queue_timeout_gets_429(workspace, monkeypatch):
+    monkeypatch.setattr(llm, "LLM_MAX_CONCURRENT", 1)
+    monkeypatch.setattr(llm, "LLM_QUEUE_TIMEOUT", 0.2)
+
+    timed_out = llm.admission_stats()["timed_out"]
+    with llm.llm_admission("another-instance"):
+        resp = chat(workspace)
+    assert resp.status_code == 429
+    assert resp.headers["Retry-After"]
+    assert llm.admission_stats()["timed_out"] == timed_out + 1
+
+    # The slot is free again and the refused call's tokens were returned
+    assert chat(workspace).status_code == 200
+    assert llm.admission_stats()["running_all_workers"] == 0
@@ -0,0 +1,50 @@
+import types
+import pytest
+from conftest import Workspace
+from app.utils import llm, llm_cassette
+
+MESSAGES = [{"role": "system", "content": "You are a budgeting assistant."}, {"role": "user", "content": "Hello"}]
+
+
+@pytest.fixture
+def cassette(tmp_path, monkeypatch):
+    monkeypatch.setattr(llm_cassette, "LLM_CASSETTE_DIR", str(tmp_path))
+    monkeypatch.setattr(llm_cassette, "LLM_CASSETTE", "test")
+    monkeypatch.setattr(llm_cassette, "LLM_REPLAY_LATENCY", "zero")
+    llm_cassette.reset_cursors()
+    return tmp_path / "test.jsonl"
+
+
+def replaying(monkeypatch):
+    def offline(**kwargs):
+        raise AssertionError("replay must not call the model")
+    completions = types.SimpleNamespace(create=offline)
+    monkeypatch.setattr(llm, "openai", types.SimpleNamespace(api_key="test", chat=types.SimpleNamespace(completions=completions)))
+    monkeypatch.setattr(llm_cassette, "LLM_CASSETTE_MODE", "replay")
+
+
+def test_recorded_call_is_replayed_offline(cassette, fake_llm, monkeypatch):
+    monkeypatch.setattr(llm_cassette, "LLM_CASSETTE_MODE", "record")
+    assert llm.chat_completion(MESSAGES, purpose="chat") == "ok"
+    assert cassette.exists()
+
+    replaying(monkeypatch)
+    assert llm.chat_completion(MESSAGES, purpose="chat") == "ok"
+    with pytest.raises(llm_cassette.CassetteMiss):
+        llm.chat_completion([*MESSAGES, {"role": "user", "content": "Something else"}], purpose="chat")
+
+
+def test_recorded_receipt_upload_is_replayed(cassette, workspace, client, fake_llm, monkeypatch):
+    monkeypatch.setattr(llm_cassette, "LLM_CASSETTE_MODE", "record")
+    workspace.upload("2024-08-01", [("Milk", 2.5, "Groceries"), ("Bread", 3.0, "Groceries")], vendor="Market")
+    recorded = workspace.transactions(fields="date,text,amount")["rows"]
+
+    # Another image and instance (the prompt lists its categories) never match
+    # exactly; sequence matching replays the recordings in order instead
+    replaying(monkeypatch)
+    monkeypatch.setattr(llm_cassette, "LLM_CASSETTE_MATCH", "sequence")
+    other = Workspace(client, fake_llm)
+    resp = other.post_receipt("2024-08-01", [])
+    assert resp.status_code == 200, resp.get_data()
+    assert other.transactions(fields="date,text,amount")["rows"] == recorded
+    fake_llm.receipts.clear()
@@ -0,0 +1,43 @@
+import pytest
+
+
+@pytest.fixture
+def ledger(workspace):
+    for day in range(1, 8):
+        workspace.upload(f"2024-05-{day:02d}", [(f"Item {day}a", float(day), "Groceries"), (f"Item {day}b", 1.0, "Household")])
+    return workspace
+
+
+@pytest.mark.parametrize("order", ["asc", "desc"])
+def test_cursor_paging_round_trips(ledger, order):
+    everything = ledger.transactions(order=order, limit=500)["rows"]
+    assert len(everything) == 14
+
+    pages, cursor = [], None
+    while True:
+        page = ledger.transactions(order=order, limit=3, **({"cursor": cursor} if cursor else {}))
+        pages.append(page["rows"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    assert [row for rows in pages for row in rows] == everything
+    assert all(len(rows) == 3 for rows in pages[:-1])
+
+
+def test_cursor_paging_within_a_date_range(ledger):
+    rows, cursor = [], None
+    while True:
+        page = ledger.transactions(start="2024-05-03", end="2024-05-05", limit=2, **({"cursor": cursor} if cursor else {}))
+        rows += page["rows"]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    assert [row["date"] for row in rows] == ["2024-05-03"] * 2 + ["2024-05-04"] * 2 + ["2024-05-05"] * 2
+
+
+def test_cursor_of_another_order_is_refused(ledger, client):
+    cursor = ledger.transactions(limit=2)["next_cursor"]
+    resp = client.get(f"/v1/instances/{ledger.id}/transactions", query_string={"cursor": cursor, "order": "desc"})
+    assert resp.status_code == 400